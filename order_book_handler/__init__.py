@@ -1,5 +1,83 @@
-from .order_book import *
-from .order import *
-from .order_book_reconstructor import *
-from .trade_costs_reconstructor import *
-from .data_visualisation import *
\ No newline at end of file
+import importlib
+
+#Submodules and the names below are resolved on first use (PEP 562). Importing the package therefore loads neither
+#pandas nor matplotlib until something needs them, and an unknown name is an AttributeError that imports nothing.
+#These are the public names of the modules that used to be star-imported here; add new ones to the list of their module.
+exported_names = {
+    'order_book': ('OrderBook',),
+    'order': ('Order',),
+    'order_book_reconstructor': (
+        'hours_before_end_of_session_to_visualise',
+        'read_orders',
+        'reconstruct_order_book_one_product_one_day',
+        'reconstruct_order_books_by_product_one_day',
+        'read_orders_for_products',
+        'replay_encoded_delivery_periods',
+        'stream_delivery_period_features_and_depth',
+        'stream_delivery_period_features',
+        'replay_delivery_period_features',
+        'replay_delivery_period_timed',
+        'replay_delivery_periods_in_parallel',
+        'reconstruct_order_book_one_delivery_period_by_groups'
+    ),
+    'trade_costs_reconstructor': (
+        'calculate_implicit_trade_cost_by_product_by_day',
+        'calculate_implicit_trade_cost_from_order_books',
+        'calculate_implicit_trade_cost_from_features',
+        'calculate_implicit_trade_costs_by_side_by_product_by_day',
+        'calculate_implicit_trade_costs_by_side_from_order_books',
+        'calculate_implicit_trade_costs_by_side_from_features',
+        'stream_implicit_trade_costs_by_side',
+        'read_aggressor_trades',
+        'implicit_trade_costs_by_side',
+        'record_trade_counts',
+        'previous_mid_prices_before_trades',
+        'split_by_delivery_start'
+    ),
+    'data_visualisation': (
+        'figure_dpi',
+        'PlotSeries',
+        'FigurePanel',
+        'last_hours_of_series',
+        'series_times_to_nanoseconds',
+        'figure_filename',
+        'draw_panel',
+        'render_figure',
+        'render_grid_figure',
+        'render_figures',
+        'render_panels',
+        'bid_ask_spread_changes',
+        'bas_5min_avg_panel',
+        'bas_5min_avg_panels',
+        'bas_5min_avg_panels_from_spreads',
+        'visualise_bas_5min_avg_by_product',
+        'step_series',
+        'bas_over_time_panels',
+        'visualise_bas_over_time_by_product',
+        'buy_sell_trade_costs_panels',
+        'visualise_buy_sell_trade_costs',
+        'visualise_delivery_period_stream',
+        'visualise_trade_costs_by_product_by_day'
+    )
+}
+module_by_exported_name = {
+    name: module_name
+    for module_name, names in exported_names.items()
+    for name in names
+}
+
+def __getattr__(name):
+    module_name = module_by_exported_name.get(name)
+    if module_name is not None:
+        globals()[name] = getattr(importlib.import_module(f"{__name__}.{module_name}"), name)
+        return globals()[name]
+    if not name.startswith('_'):
+        try:
+            return importlib.import_module(f"{__name__}.{name}")
+        except ModuleNotFoundError as error:
+            if error.name != f"{__name__}.{name}":
+                raise
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(set(globals()) | set(exported_names) | set(module_by_exported_name))
@@ -0,0 +1,3 @@
+import order_book_handler.cli as cli
+
+cli.main()
@@ -0,0 +1,171 @@
+import os
+import re
+import glob
+import pandas as pd
+import order_book_handler.order_book_reconstructor as ob_reconstruction
+import order_book_handler.reconstruction_cache as rc
+import order_book_handler.trade_costs_reconstructor as tcr
+import order_book_handler.metrics as om
+from contextlib import ExitStack
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple, Union
+
+epex_filename_pattern = re.compile(r'Continuous_(Orders|Trades)-[A-Za-z]+-(\d{8})-')
+
+def pair_orders_and_trades_files_by_date(
+    input_path: str
+) -> List[Tuple[str, str, Optional[str]]]:
+    if os.path.isdir(input_path):
+        filepaths = glob.glob(os.path.join(input_path, 'Continuous_*.csv'))
+    else:
+        filepaths = glob.glob(input_path)
+
+    orders_filepath_by_date = {}
+    trades_filepath_by_date = {}
+    for filepath in filepaths:
+        match = epex_filename_pattern.search(os.path.basename(filepath))
+        if match is None:
+            continue
+        file_type, date = match.groups()
+        filepaths_by_date = orders_filepath_by_date if file_type == 'Orders' else trades_filepath_by_date
+        if date in filepaths_by_date:
+            raise ValueError(f"More than one {file_type} file for {date}: {filepaths_by_date[date]} and {filepath}")
+        filepaths_by_date[date] = filepath
+
+    for date in sorted(set(trades_filepath_by_date) - set(orders_filepath_by_date)):
+        print(f"No orders file for {date}, skipping trades file {trades_filepath_by_date[date]}")
+
+    return [
+        (date, orders_filepath_by_date[date], trades_filepath_by_date.get(date))
+        for date in sorted(orders_filepath_by_date)
+    ]
+
+def write_frames_by_delivery_start(
+    frames_by_delivery_start: Dict[str, pd.DataFrame],
+    output_filepath: str
+):
+    frames = pd.concat(frames_by_delivery_start, names=['delivery_start']) if frames_by_delivery_start else pd.DataFrame()
+    frames.to_csv(output_filepath)
+
+def append_frame_for_delivery_start(
+    output_file,
+    delivery_start_time: str,
+    frame: pd.DataFrame,
+    write_header: bool
+):
+    pd.concat({delivery_start_time: frame}, names=['delivery_start']).to_csv(output_file, header=write_header)
+
+#Writes each delivery period's features and trade costs as it is reconstructed, so one period is held at a time rather than the day
+def stream_one_product_one_day(
+    date: str,
+    orders_csv_filepath: str,
+    trades_csv_filepath: Optional[str],
+    product_name: str,
+    output_directory: str,
+    metrics: Optional[om.ReconstructionMetrics] = None
+) -> List[str]:
+    feature_stream = ob_reconstruction.stream_delivery_period_features(orders_csv_filepath, product_name, metrics=metrics)
+    output_filepaths = [os.path.join(output_directory, f"{date}_{product_name}_features.csv")]
+    if trades_csv_filepath is None:
+        period_outputs = ((delivery_start_time, features) for delivery_start_time, features in feature_stream)
+    else:
+        period_outputs = tcr.stream_implicit_trade_costs_by_side(trades_csv_filepath, product_name, feature_stream, metrics=metrics)
+        output_filepaths += [os.path.join(output_directory, f"{date}_{product_name}_{side}_trade_costs.csv") for side in ('buy', 'sell')]
+
+    with ExitStack() as stack:
+        output_files = [stack.enter_context(open(output_filepath, 'w', newline='')) for output_filepath in output_filepaths]
+        for period_number, (delivery_start_time, *frames) in enumerate(period_outputs):
+            for output_file, frame in zip(output_files, frames):
+                append_frame_for_delivery_start(output_file, delivery_start_time, frame, period_number == 0)
+    return output_filepaths
+
+def process_one_day(
+    date: str,
+    orders_csv_filepath: str,
+    trades_csv_filepath: Optional[str],
+    product_name: Union[str, List[str]],
+    output_directory: str,
+    write_metrics: bool = False
+) -> List[str]:
+    output_filepaths = []
+    metrics = om.ReconstructionMetrics() if write_metrics else None
+    if isinstance(product_name, str) and product_name != 'all':
+        output_filepaths += stream_one_product_one_day(date, orders_csv_filepath, trades_csv_filepath, product_name, output_directory, metrics)
+        order_books_by_product = {}
+        metrics_name = product_name
+    else:
+        #Several products (or 'all') are reconstructed from one read of the orders file
+        order_books_by_product = ob_reconstruction.reconstruct_order_books_by_product_one_day(
+            orders_csv_filepath,
+            product_name,
+            metrics=metrics
+        )
+        metrics_name = product_name if isinstance(product_name, str) else '_'.join(product_name)
+
+    for product, order_books in list(order_books_by_product.items()):
+        features_filepath = os.path.join(output_directory, f"{date}_{product}_features.csv")
+        with om.stage(metrics, 'feature_extraction'):
+            features_by_delivery_start_time = rc.features_from_order_books(order_books)
+        del order_books, order_books_by_product[product]
+        write_frames_by_delivery_start(features_by_delivery_start_time, features_filepath)
+        output_filepaths.append(features_filepath)
+
+        if trades_csv_filepath is not None:
+            implicit_buy_costs, implicit_sell_costs = tcr.calculate_implicit_trade_costs_by_side_from_features(
+                trades_csv_filepath,
+                product,
+                features_by_delivery_start_time,
+                metrics=metrics
+            )
+            for side, implicit_costs in (('buy', implicit_buy_costs), ('sell', implicit_sell_costs)):
+                trade_costs_filepath = os.path.join(output_directory, f"{date}_{product}_{side}_trade_costs.csv")
+                write_frames_by_delivery_start(implicit_costs, trade_costs_filepath)
+                output_filepaths.append(trade_costs_filepath)
+
+    if metrics is not None:
+        metrics_filepath = os.path.join(output_directory, f"{date}_{metrics_name}_metrics.json")
+        delivery_period_metrics_filepath = os.path.join(output_directory, f"{date}_{metrics_name}_delivery_period_metrics.csv")
+        metrics.save_json(metrics_filepath)
+        metrics.save_csv(delivery_period_metrics_filepath)
+        output_filepaths += [metrics_filepath, delivery_period_metrics_filepath]
+
+    return output_filepaths
+
+#At most `workers` days are in memory at once; each day is written to disk by its worker as soon as it finishes
+def process_days(
+    input_path: str,
+    product_name: Union[str, List[str]],
+    output_directory: str,
+    workers: int = 1,
+    write_metrics: bool = False
+) -> Dict[str, List[str]]:
+    os.makedirs(output_directory, exist_ok=True)
+    files_by_date = pair_orders_and_trades_files_by_date(input_path)
+    output_filepaths_by_date = {}
+
+    if workers <= 1:
+        for date, orders_csv_filepath, trades_csv_filepath in files_by_date:
+            output_filepaths_by_date[date] = process_one_day(date, orders_csv_filepath, trades_csv_filepath, product_name, output_directory, write_metrics)
+            print(f"Processed {date}")
+        return output_filepaths_by_date
+
+    remaining_days = iter(files_by_date)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        date_by_future = {}
+        for date, orders_csv_filepath, trades_csv_filepath in remaining_days:
+            date_by_future[executor.submit(process_one_day, date, orders_csv_filepath, trades_csv_filepath, product_name, output_directory, write_metrics)] = date
+            if len(date_by_future) >= workers:
+                break
+
+        while date_by_future:
+            finished, _ = wait(date_by_future, return_when=FIRST_COMPLETED)
+            for future in finished:
+                date = date_by_future.pop(future)
+                output_filepaths_by_date[date] = future.result()
+                print(f"Processed {date}")
+                next_day = next(remaining_days, None)
+                if next_day is not None:
+                    next_date, orders_csv_filepath, trades_csv_filepath = next_day
+                    date_by_future[executor.submit(process_one_day, next_date, orders_csv_filepath, trades_csv_filepath, product_name, output_directory, write_metrics)] = next_date
+
+    return dict(sorted(output_filepaths_by_date.items()))
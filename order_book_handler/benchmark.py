@@ -0,0 +1,262 @@
+import os
+import sys
+import json
+import platform
+import argparse
+import resource
+import tempfile
+import tracemalloc
+import subprocess
+import order_book_handler.order_book as ob
+import order_book_handler.order as o
+import order_book_handler.compact_order_book as cob
+import order_book_handler.order_book_reconstructor as ob_reconstruction
+import order_book_handler.replay_engine as replay
+import order_book_handler.reconstruction_cache as rc
+import order_book_handler.trade_costs_reconstructor as tcr
+import order_book_handler.synthetic_data as sd
+from contextlib import contextmanager
+from dataclasses import asdict
+from datetime import datetime, timezone
+from time import perf_counter
+from typing import Dict, Optional
+
+#ru_maxrss is the peak for the whole process so far, in kilobytes on Linux and bytes on macOS
+def peak_rss_megabytes() -> float:
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / 1024 ** 2 if sys.platform == 'darwin' else peak_rss / 1024
+
+#ru_maxrss never goes down, so cumulative_peak_rss_mb is the peak of every stage up to and including this one. With
+#trace_memory, peak_traced_mb is this stage's own peak: the most memory allocated during it and not yet freed. Tracing
+#slows allocation down, so it is off by default and wall times from traced runs are not comparable with untraced ones.
+@contextmanager
+def timed_stage(
+    stages: Dict[str, Dict],
+    stage_name: str,
+    trace_memory: bool = False
+):
+    if trace_memory:
+        tracemalloc.start()
+    start_time = perf_counter()
+    try:
+        yield
+    finally:
+        wall_time_seconds = perf_counter() - start_time
+        if trace_memory:
+            peak_traced_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    stages[stage_name] = {
+        'wall_time_seconds': wall_time_seconds,
+        'cumulative_peak_rss_mb': peak_rss_megabytes()
+    }
+    if trace_memory:
+        stages[stage_name]['peak_traced_mb'] = peak_traced_bytes / 1024 ** 2
+
+def current_git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+#Measured in a fresh interpreter, since this one has already imported everything
+def import_time(
+    module_name: str = 'order_book_handler'
+) -> Dict:
+    completed = subprocess.run(
+        [sys.executable, '-c', f"import sys, time; start_time = time.perf_counter(); import {module_name}; print(time.perf_counter() - start_time, 'matplotlib' in sys.modules)"],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    seconds, matplotlib_loaded = completed.stdout.split()
+    return {'module': module_name, 'seconds': float(seconds), 'matplotlib_loaded': matplotlib_loaded == 'True'}
+
+def run_benchmark(
+    orders_csv_filepath: str,
+    trades_csv_filepath: str,
+    product_name: str,
+    plot_directory: Optional[str] = None,
+    hours_to_plot: int = ob_reconstruction.hours_before_end_of_session_to_visualise,
+    compare_order_stores: bool = False,
+    trace_memory: bool = False
+) -> Dict:
+    stages = {}
+
+    with timed_stage(stages, 'ingest', trace_memory):
+        encoded_orders_by_delivery_start = replay.encode_orders_by_delivery_start(
+            ob_reconstruction.read_orders(orders_csv_filepath, product_name)
+        )
+
+    with timed_stage(stages, 'replay', trace_memory):
+        order_books = {
+            delivery_start_time: replay.replay_delivery_period(encoded_orders)
+            for delivery_start_time, encoded_orders in encoded_orders_by_delivery_start.items()
+        }
+
+    with timed_stage(stages, 'feature_extraction', trace_memory):
+        features_by_delivery_start_time = rc.features_from_order_books(order_books)
+
+    with timed_stage(stages, 'trade_cost_join', trace_memory):
+        implicit_buy_costs, implicit_sell_costs = tcr.calculate_implicit_trade_costs_by_side_from_features(
+            trades_csv_filepath,
+            product_name,
+            features_by_delivery_start_time
+        )
+
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        plot_directory = plot_directory or temporary_directory
+        with timed_stage(stages, 'plotting', trace_memory):
+            #matplotlib is only loaded, and its backend only chosen, by the stage that draws
+            import matplotlib
+            matplotlib.use('Agg')
+            import order_book_handler.data_visualisation as dv
+            dv.visualise_bas_5min_avg_by_product(order_books, hours_to_plot, os.path.join(plot_directory, 'bid_ask_spread'))
+            dv.visualise_buy_sell_trade_costs(implicit_buy_costs, implicit_sell_costs, hours_to_plot, os.path.join(plot_directory, 'trade_costs'))
+
+    events = sum(len(encoded_orders) for encoded_orders in encoded_orders_by_delivery_start.values())
+    total_wall_time = sum(stage['wall_time_seconds'] for stage in stages.values())
+    results = {
+        'run_at': datetime.now(timezone.utc).isoformat(),
+        'git_commit': current_git_commit(),
+        'engine_version': replay.ENGINE_VERSION,
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'orders_csv_filepath': os.path.abspath(orders_csv_filepath),
+        'trades_csv_filepath': os.path.abspath(trades_csv_filepath),
+        'product_name': product_name,
+        'delivery_periods': len(encoded_orders_by_delivery_start),
+        'events': events,
+        'replay_events_per_second': events / stages['replay']['wall_time_seconds'] if stages['replay']['wall_time_seconds'] > 0 else None,
+        'end_to_end_events_per_second': events / total_wall_time if total_wall_time > 0 else None,
+        'cumulative_peak_rss_mb': peak_rss_megabytes(),
+        'memory_traced': trace_memory,
+        'stages': stages,
+        'import_times': [import_time(module_name) for module_name in ('order_book_handler', 'order_book_handler.order_book_reconstructor')]
+    }
+    if compare_order_stores:
+        results['order_stores'] = benchmark_order_stores(encoded_orders_by_delivery_start)
+    return results
+
+#Traced allocations of a whole book (orders and price levels) holding number_of_orders resting orders, per order
+def memory_per_resting_order(
+    order_book_class: type,
+    number_of_orders: int = 100_000
+) -> float:
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        order_book = order_book_class()
+        for initial_id in range(number_of_orders):
+            side = 'BUY' if initial_id % 2 == 0 else 'SELL'
+            price = 50.0 - (initial_id % 500) * 0.01 if side == 'BUY' else 50.01 + (initial_id % 500) * 0.01
+            order_book.add_order(o.Order(initial_id=initial_id, price=price, available_volume=float(initial_id % 50 + 1)), side)
+        used = tracemalloc.get_traced_memory()[0] - baseline
+    finally:
+        tracemalloc.stop()
+    del order_book
+    return used / number_of_orders
+
+def benchmark_order_stores(
+    encoded_orders_by_delivery_start: Dict[str, replay.EncodedOrders],
+    number_of_orders: int = 100_000
+) -> Dict[str, Dict]:
+    events = sum(len(encoded_orders) for encoded_orders in encoded_orders_by_delivery_start.values())
+    results = {}
+    for store_name, order_book_class, compact_orders in (('objects', ob.OrderBook, False), ('compact', cob.CompactOrderBook, True)):
+        start_time = perf_counter()
+        for encoded_orders in encoded_orders_by_delivery_start.values():
+            replay.replay_delivery_period(encoded_orders, compact_orders=compact_orders)
+        replay_wall_time = perf_counter() - start_time
+        results[store_name] = {
+            'bytes_per_resting_order': memory_per_resting_order(order_book_class, number_of_orders),
+            'replay_events_per_second': events / replay_wall_time if replay_wall_time > 0 else None
+        }
+        print(f"{store_name} order store: {results[store_name]['bytes_per_resting_order']:.0f} bytes per resting order, {results[store_name]['replay_events_per_second']:.0f} events/s")
+    return results
+
+def run_synthetic_benchmark(
+    config: sd.SyntheticMarketConfig,
+    data_directory: str,
+    plot_directory: Optional[str] = None,
+    compare_order_stores: bool = False,
+    trace_memory: bool = False
+) -> Dict:
+    orders_csv_filepath, trades_csv_filepath = sd.write_synthetic_day(data_directory, config)
+    results = run_benchmark(orders_csv_filepath, trades_csv_filepath, config.product_name, plot_directory, compare_order_stores=compare_order_stores, trace_memory=trace_memory)
+    results['synthetic_config'] = asdict(config)
+    return results
+
+def save_benchmark_results(
+    results: Dict,
+    output_filepath: str
+):
+    os.makedirs(os.path.dirname(os.path.abspath(output_filepath)), exist_ok=True)
+    with open(output_filepath, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"Saved benchmark results: {output_filepath}")
+
+#Ratio of current to baseline wall time per stage, so values above 1 are regressions
+def compare_benchmark_results(
+    baseline_filepath: str,
+    current_filepath: str
+) -> Dict[str, float]:
+    with open(baseline_filepath) as baseline_file:
+        baseline = json.load(baseline_file)
+    with open(current_filepath) as current_file:
+        current = json.load(current_file)
+
+    wall_time_ratios = {}
+    for stage_name, stage in current['stages'].items():
+        baseline_stage = baseline['stages'].get(stage_name)
+        if baseline_stage is None or baseline_stage['wall_time_seconds'] == 0:
+            continue
+        wall_time_ratios[stage_name] = stage['wall_time_seconds'] / baseline_stage['wall_time_seconds']
+        print(f"{stage_name}: {baseline_stage['wall_time_seconds']:.3f}s -> {stage['wall_time_seconds']:.3f}s ({wall_time_ratios[stage_name]:.2f}x)")
+    return wall_time_ratios
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark order book reconstruction on recorded or synthetic EPEX files.')
+    parser.add_argument('--output', required=True, help='JSON file to write the results to')
+    parser.add_argument('--orders', help='Continuous_Orders CSV; synthetic data is generated when omitted')
+    parser.add_argument('--trades', help='Continuous_Trades CSV matching --orders')
+    parser.add_argument('--product', default='GB_Half_Hour_Power')
+    parser.add_argument('--plot-directory')
+    parser.add_argument('--data-directory', help='Where synthetic files are written', default=os.path.join(tempfile.gettempdir(), 'epex_synthetic'))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--delivery-periods', type=int, default=48)
+    parser.add_argument('--events-per-period', type=int, default=20_000)
+    parser.add_argument('--events-per-second', type=float, default=2.0)
+    parser.add_argument('--crossed-book-probability', type=float, default=0.01)
+    parser.add_argument('--compare-with', help='Earlier results JSON to compare stage times against')
+    parser.add_argument('--order-stores', action='store_true', help='Also compare memory and replay throughput of the object and compact order stores')
+    parser.add_argument('--trace-memory', action='store_true', help='Also record the peak memory allocated within each stage; slows every stage down')
+    arguments = parser.parse_args()
+
+    if arguments.orders is not None:
+        if arguments.trades is None:
+            parser.error('--trades is required with --orders')
+        results = run_benchmark(arguments.orders, arguments.trades, arguments.product, arguments.plot_directory, compare_order_stores=arguments.order_stores, trace_memory=arguments.trace_memory)
+    else:
+        config = sd.SyntheticMarketConfig(
+            seed=arguments.seed,
+            product_name=arguments.product,
+            number_of_delivery_periods=arguments.delivery_periods,
+            events_per_period=arguments.events_per_period,
+            events_per_second=arguments.events_per_second,
+            crossed_book_probability=arguments.crossed_book_probability
+        )
+        results = run_synthetic_benchmark(config, arguments.data_directory, arguments.plot_directory, arguments.order_stores, arguments.trace_memory)
+
+    save_benchmark_results(results, arguments.output)
+    if arguments.compare_with is not None:
+        compare_benchmark_results(arguments.compare_with, arguments.output)
+
+if __name__ == '__main__':
+    main()
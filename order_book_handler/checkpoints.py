@@ -0,0 +1,176 @@
+import numpy as np
+import pandas as pd
+import order_book_handler.order_book as ob
+import order_book_handler.order as o
+import order_book_handler.order_book_reconstructor as ob_reconstruction
+import order_book_handler.replay_engine as replay
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+@dataclass(slots=True)
+class OrderBookCheckpoint:
+    transaction_times_applied : int
+    side_codes : np.ndarray
+    initial_ids : np.ndarray
+    prices : np.ndarray
+    volumes : np.ndarray
+    hibernated : np.ndarray
+    feature_values : Tuple[float, ...]
+    feature_updates : int = 0
+
+#Live orders are stored level by level so each price level keeps its queue order when restored
+def take_checkpoint(
+    order_book: ob.OrderBook,
+    transaction_times_applied: int
+) -> OrderBookCheckpoint:
+    rows = []
+    for side_code, side in enumerate(replay.SIDES):
+        price_levels = order_book.price_levels[side]
+        for price in price_levels.prices:
+            for initial_id, volume in price_levels.levels[price].order_ids.items():
+                rows.append((side_code, initial_id, price, volume, False))
+        for hibernated_order in order_book.hibernated_orders[side].values():
+            rows.append((side_code, hibernated_order.initial_id, hibernated_order.price, hibernated_order.available_volume, True))
+        #Live orders with a NaN price are not held in any price level
+        for live_order in order_book.orders[side].values():
+            if live_order.price != live_order.price:
+                rows.append((side_code, live_order.initial_id, live_order.price, live_order.available_volume, False))
+
+    side_codes, initial_ids, prices, volumes, hibernated = zip(*rows) if rows else ((), (), (), (), ())
+    return OrderBookCheckpoint(
+        transaction_times_applied=transaction_times_applied,
+        side_codes=np.array(side_codes, dtype=np.int8),
+        initial_ids=np.array(initial_ids, dtype=np.int64),
+        prices=np.array(prices, dtype=np.float64),
+        volumes=np.array(volumes, dtype=np.float64),
+        hibernated=np.array(hibernated, dtype=bool),
+        feature_values=(
+            order_book.current_best_bid,
+            order_book.current_best_ask,
+            order_book.current_bid_ask_spread,
+            order_book.current_mid_price,
+            order_book.current_relative_bid_ask_spread
+        ),
+        feature_updates=order_book.feature_updates
+    )
+
+#The restored book has the orders and current feature values of the checkpoint, but no feature history
+def restore_checkpoint(
+    checkpoint: OrderBookCheckpoint,
+    depth_levels: int = 0,
+    depth_price_band: Optional[float] = None
+) -> ob.OrderBook:
+    order_book = ob.OrderBook(depth_levels, depth_price_band)
+    for side_code, initial_id, price, volume, hibernated in zip(
+        checkpoint.side_codes.tolist(),
+        checkpoint.initial_ids.tolist(),
+        checkpoint.prices.tolist(),
+        checkpoint.volumes.tolist(),
+        checkpoint.hibernated.tolist()
+    ):
+        side = replay.SIDES[side_code]
+        order = o.Order(initial_id=initial_id, price=price, available_volume=volume)
+        if hibernated:
+            order_book.hibernated_orders[side][initial_id] = order
+            order_book.hibernated_volume[side] += volume
+        else:
+            order_book.add_order(order, side)
+    (
+        order_book.current_best_bid,
+        order_book.current_best_ask,
+        order_book.current_bid_ask_spread,
+        order_book.current_mid_price,
+        order_book.current_relative_bid_ask_spread
+    ) = checkpoint.feature_values
+    order_book.feature_updates = checkpoint.feature_updates
+    return order_book
+
+#Number of transaction times applied before each checkpoint
+def checkpoint_positions(
+    encoded_orders: replay.EncodedOrders,
+    checkpoint_every_events: Optional[int] = None,
+    checkpoint_interval: Optional[pd.Timedelta] = None
+) -> np.ndarray:
+    positions = []
+    if checkpoint_every_events is not None:
+        event_bounds = np.append(encoded_orders.transaction_time_starts, len(encoded_orders))
+        positions.append(np.flatnonzero(np.diff(event_bounds // checkpoint_every_events) > 0) + 1)
+    if checkpoint_interval is not None:
+        interval_buckets = encoded_orders.transaction_times // pd.Timedelta(checkpoint_interval).value
+        positions.append(np.flatnonzero(np.diff(interval_buckets) > 0) + 1)
+    if not positions:
+        return np.empty(0, dtype=np.int64)
+    positions = np.unique(np.concatenate(positions))
+    return positions[(positions > 0) & (positions < len(encoded_orders.transaction_times))]
+
+class CheckpointedOrderBooks:
+    def __init__(
+        self,
+        encoded_orders_by_delivery_start: Dict[str, replay.EncodedOrders],
+        checkpoint_every_events: Optional[int] = 10_000,
+        checkpoint_interval: Optional[pd.Timedelta] = None,
+        depth_levels: int = 0,
+        depth_price_band: Optional[float] = None
+    ):
+        self.encoded_orders_by_delivery_start = encoded_orders_by_delivery_start
+        self.depth_levels = depth_levels
+        self.depth_price_band = depth_price_band
+        self.order_books : Dict[str, ob.OrderBook] = {}
+        self.checkpoints_by_delivery_start : Dict[str, List[OrderBookCheckpoint]] = {}
+
+        for delivery_start_time, encoded_orders in encoded_orders_by_delivery_start.items():
+            order_book = ob.OrderBook(depth_levels, depth_price_band)
+            checkpoints = []
+            transaction_times_applied = 0
+            for position in checkpoint_positions(encoded_orders, checkpoint_every_events, checkpoint_interval).tolist():
+                replay.replay_transaction_times(order_book, encoded_orders, transaction_times_applied, position)
+                checkpoints.append(take_checkpoint(order_book, position))
+                transaction_times_applied = position
+            replay.replay_transaction_times(order_book, encoded_orders, transaction_times_applied)
+            self.order_books[delivery_start_time] = order_book
+            self.checkpoints_by_delivery_start[delivery_start_time] = checkpoints
+
+    #Book after every transaction time at or before the timestamp, replayed from the nearest earlier checkpoint
+    def state_at(
+        self,
+        delivery_start_time: str,
+        timestamp
+    ) -> ob.OrderBook:
+        encoded_orders = self.encoded_orders_by_delivery_start[delivery_start_time]
+        checkpoints = self.checkpoints_by_delivery_start[delivery_start_time]
+        transaction_times_to_apply = int(np.searchsorted(encoded_orders.transaction_times, pd.Timestamp(timestamp).value, side='right'))
+
+        nearest_checkpoint = bisect_right(
+            [checkpoint.transaction_times_applied for checkpoint in checkpoints],
+            transaction_times_to_apply
+        ) - 1
+        if nearest_checkpoint >= 0:
+            checkpoint = checkpoints[nearest_checkpoint]
+            order_book = restore_checkpoint(checkpoint, self.depth_levels, self.depth_price_band)
+            transaction_times_applied = checkpoint.transaction_times_applied
+        else:
+            order_book = ob.OrderBook(self.depth_levels, self.depth_price_band)
+            transaction_times_applied = 0
+
+        replay.replay_transaction_times(order_book, encoded_orders, transaction_times_applied, transaction_times_to_apply)
+        return order_book
+
+def build_checkpointed_order_books(
+    orders_csv_filepath: str,
+    product_name: str,
+    checkpoint_every_events: Optional[int] = 10_000,
+    checkpoint_interval: Optional[pd.Timedelta] = None,
+    cache_directory: Optional[str] = None,
+    depth_levels: int = 0,
+    depth_price_band: Optional[float] = None
+) -> CheckpointedOrderBooks:
+    return CheckpointedOrderBooks(
+        replay.encode_orders_by_delivery_start(
+            ob_reconstruction.read_orders(orders_csv_filepath, product_name, cache_directory)
+        ),
+        checkpoint_every_events,
+        checkpoint_interval,
+        depth_levels,
+        depth_price_band
+    )
@@ -0,0 +1,122 @@
+import os
+import argparse
+from contextlib import nullcontext
+import order_book_handler.order_book_reconstructor as obr
+import order_book_handler.batch_processing as batch
+import order_book_handler.metrics as om
+from typing import List, Optional
+
+def product_names_argument(
+    product_name: str
+):
+    product_names = product_name.split(',')
+    return product_names[0] if len(product_names) == 1 else product_names
+
+def reconstruct(
+    arguments: argparse.Namespace
+):
+    os.makedirs(arguments.output_directory, exist_ok=True)
+    metrics = om.ReconstructionMetrics() if arguments.metrics else None
+    orders_name = os.path.splitext(os.path.basename(arguments.orders))[0]
+    features_filepath = os.path.join(arguments.output_directory, f"{orders_name}_{arguments.product}_features.csv")
+    depth_filepath = None
+    if arguments.depth_levels > 0 or arguments.depth_price_band is not None:
+        depth_filepath = os.path.join(arguments.output_directory, f"{orders_name}_{arguments.product}_depth.csv")
+    feature_stream = obr.stream_delivery_period_features_and_depth(
+        arguments.orders,
+        arguments.product,
+        arguments.workers,
+        arguments.cache_directory,
+        arguments.depth_levels,
+        arguments.depth_price_band,
+        metrics=metrics,
+        compact_orders=arguments.compact_orders
+    )
+    with open(features_filepath, 'w', newline='') as features_file, (open(depth_filepath, 'w', newline='') if depth_filepath is not None else nullcontext()) as depth_file:
+        for period_number, (delivery_start_time, features, depth) in enumerate(feature_stream):
+            batch.append_frame_for_delivery_start(features_file, delivery_start_time, features, period_number == 0)
+            if depth_file is not None:
+                batch.append_frame_for_delivery_start(depth_file, delivery_start_time, depth, period_number == 0)
+    print(f"Saved features: {features_filepath}")
+    if depth_filepath is not None:
+        print(f"Saved depth: {depth_filepath}")
+
+    if metrics is not None:
+        metrics.save_json(os.path.join(arguments.output_directory, f"{orders_name}_{arguments.product}_metrics.json"))
+        metrics.save_csv(os.path.join(arguments.output_directory, f"{orders_name}_{arguments.product}_delivery_period_metrics.csv"))
+
+def trade_costs(
+    arguments: argparse.Namespace
+):
+    output_filepaths_by_date = batch.process_days(
+        arguments.input,
+        product_names_argument(arguments.product),
+        arguments.output_directory,
+        arguments.workers,
+        arguments.metrics
+    )
+    print(f"Wrote {sum(len(output_filepaths) for output_filepaths in output_filepaths_by_date.values())} files for {len(output_filepaths_by_date)} days to {arguments.output_directory}")
+
+def plot(
+    arguments: argparse.Namespace
+):
+    #Only plotting needs matplotlib, so it is imported here rather than with the rest of the CLI
+    import order_book_handler.data_visualisation as dv
+
+    order_books = obr.reconstruct_order_book_one_product_one_day(
+        arguments.orders,
+        arguments.product,
+        arguments.workers,
+        arguments.cache_directory,
+        feature_grid_width='5min' if arguments.time_weighted else None
+    )
+    if arguments.kind == 'bas-5min-avg':
+        dv.visualise_bas_5min_avg_by_product(order_books, arguments.hours, arguments.output_directory, arguments.workers, time_weighted=arguments.time_weighted)
+    else:
+        dv.visualise_bas_over_time_by_product(order_books, arguments.hours, arguments.output_directory, arguments.workers)
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='order_book_handler', description='Reconstruct EPEX intraday order books and the measures derived from them.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    reconstruct_parser = subparsers.add_parser('reconstruct', help='Replay one orders file and write the order book features of every delivery period')
+    reconstruct_parser.add_argument('--orders', required=True, help='Continuous_Orders CSV')
+    reconstruct_parser.add_argument('--product', default='GB_Half_Hour_Power')
+    reconstruct_parser.add_argument('--output-directory', required=True)
+    reconstruct_parser.add_argument('--workers', type=int, default=1)
+    reconstruct_parser.add_argument('--cache-directory', help='Columnar cache of the orders file, built on first use')
+    reconstruct_parser.add_argument('--depth-levels', type=int, default=0, help='Price levels per side to write volumes for in a depth CSV')
+    reconstruct_parser.add_argument('--depth-price-band', type=float, help='Also write the volume within this distance of the mid price to the depth CSV')
+    reconstruct_parser.add_argument('--compact-orders', action='store_true')
+    reconstruct_parser.add_argument('--metrics', action='store_true', help='Also write stage and delivery period metrics')
+    reconstruct_parser.set_defaults(command_function=reconstruct)
+
+    trade_costs_parser = subparsers.add_parser('trade-costs', help='Write features and buy and sell implicit trade costs for every day of orders and trades files')
+    trade_costs_parser.add_argument('input', help='Directory or glob of Continuous_Orders and Continuous_Trades CSVs')
+    trade_costs_parser.add_argument('--product', default='GB_Half_Hour_Power', help="Product, comma separated products, or 'all'")
+    trade_costs_parser.add_argument('--output-directory', required=True)
+    trade_costs_parser.add_argument('--workers', type=int, default=1, help='Days processed at once')
+    trade_costs_parser.add_argument('--metrics', action='store_true', help='Also write stage and delivery period metrics')
+    trade_costs_parser.set_defaults(command_function=trade_costs)
+
+    plot_parser = subparsers.add_parser('plot', help='Replay one orders file and plot the bid-ask spread of every delivery period')
+    plot_parser.add_argument('--orders', required=True, help='Continuous_Orders CSV')
+    plot_parser.add_argument('--product', default='GB_Half_Hour_Power')
+    plot_parser.add_argument('--output-directory', required=True)
+    plot_parser.add_argument('--kind', choices=['bas-5min-avg', 'bas-over-time'], default='bas-5min-avg')
+    plot_parser.add_argument('--hours', type=int, default=obr.hours_before_end_of_session_to_visualise, help='Hours before the end of the session to plot')
+    plot_parser.add_argument('--workers', type=int, default=1)
+    plot_parser.add_argument('--cache-directory', help='Columnar cache of the orders file, built on first use')
+    plot_parser.add_argument('--time-weighted', action='store_true', help='Average the spread over time rather than over changes (bas-5min-avg only)')
+    plot_parser.set_defaults(command_function=plot)
+
+    return parser
+
+def main(
+    argv: Optional[List[str]] = None
+):
+    arguments = build_parser().parse_args(argv)
+    arguments.command_function(arguments)
+
+if __name__ == '__main__':
+    main()
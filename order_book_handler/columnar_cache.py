@@ -0,0 +1,264 @@
+import os
+import re
+import glob
+import json
+import hashlib
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import order_book_handler.feature_table as ft
+from typing import Dict, List, Optional, Union
+
+cache_format_version = 1
+csv_chunk_size = 1_000_000
+
+#The hive partition keys of the cache directories, see partition_directory
+partition_schema = pa.schema([('product', pa.string()), ('delivery_date', pa.string()), ('delivery_start', pa.int64())])
+
+timestamp_columns = ['DeliveryStart', 'DeliveryEnd', 'TransactionTime', 'ValidityTime', 'ExecutionTime']
+categorical_columns = ['Product', 'Side', 'ActionCode', 'DeliveryArea', 'Type', 'State']
+
+def source_file_signature(
+    source_csv_filepath: str
+) -> Dict:
+    source_stat = os.stat(source_csv_filepath)
+    return {
+        'source': os.path.abspath(source_csv_filepath),
+        'size': source_stat.st_size,
+        'mtime_ns': source_stat.st_mtime_ns,
+        'cache_format_version': cache_format_version
+    }
+
+#Keyed on the absolute path as well as the name, so same-named files in different directories get caches of their own
+def cache_path_for_source(
+    source_csv_filepath: str,
+    cache_directory: str
+) -> str:
+    source_name = os.path.splitext(os.path.basename(source_csv_filepath))[0]
+    source_path_hash = hashlib.sha256(os.path.abspath(source_csv_filepath).encode()).hexdigest()[:16]
+    return os.path.join(cache_directory, f"{source_name}-{source_path_hash}")
+
+def cache_is_current(
+    cache_path: str,
+    signature: Dict
+) -> bool:
+    manifest_path = os.path.join(cache_path, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        return False
+    with open(manifest_path) as manifest_file:
+        return json.load(manifest_file)['signature'] == signature
+
+def partition_directory(
+    cache_path: str,
+    product: str,
+    delivery_start_ns: int
+) -> str:
+    delivery_date = pd.Timestamp(delivery_start_ns, tz='UTC').strftime('%Y-%m-%d')
+    return os.path.join(cache_path, f"product={product}", f"delivery_date={delivery_date}", f"delivery_start={delivery_start_ns}")
+
+#Records how each timestamp column was written in the CSV so cached int64 values can be turned back into identical strings
+def detect_timestamp_format(
+    example_value: str
+) -> Dict:
+    fraction = re.search(r'\.(\d+)', example_value)
+    return {
+        'fraction_digits': len(fraction.group(1)) if fraction else 0,
+        'suffix': 'Z' if example_value.endswith('Z') else ''
+    }
+
+def format_timestamps(
+    timestamps_ns: pd.Series,
+    timestamp_format: Dict
+) -> pd.Series:
+    timestamps = pd.to_datetime(timestamps_ns, unit='ns')
+    formatted = timestamps.dt.strftime('%Y-%m-%dT%H:%M:%S')
+    if timestamp_format['fraction_digits'] > 0:
+        fractions = (timestamps_ns % 1_000_000_000).astype(np.int64).astype(str).str.zfill(9)
+        formatted = formatted + '.' + fractions.str[:timestamp_format['fraction_digits']]
+    return formatted + timestamp_format['suffix']
+
+def convert_column_types(
+    chunk: pd.DataFrame
+) -> pd.DataFrame:
+    for column in chunk.columns:
+        if column in timestamp_columns:
+            chunk[column] = ft.to_nanoseconds(chunk[column])
+        elif column in categorical_columns:
+            chunk[column] = chunk[column].astype('category')
+    return chunk
+
+def build_cache(
+    source_csv_filepath: str,
+    cache_directory: str
+) -> str:
+    cache_path = cache_path_for_source(source_csv_filepath, cache_directory)
+    signature = source_file_signature(source_csv_filepath)
+    if cache_is_current(cache_path, signature):
+        return cache_path
+    if os.path.exists(cache_path):
+        print(f"Source file changed, rebuilding cache: {cache_path}")
+
+    #Built beside the cache and moved into place whole, so readers never see a half-written cache
+    temporary_path = f"{cache_path}.{os.getpid()}.tmp"
+    shutil.rmtree(temporary_path, ignore_errors=True)
+    timestamp_formats = {}
+    columns = []
+    for chunk_number, chunk in enumerate(pd.read_csv(source_csv_filepath, header=1, chunksize=csv_chunk_size)):
+        for column in chunk.columns:
+            if column in timestamp_columns and column not in timestamp_formats and chunk[column].notna().any():
+                timestamp_formats[column] = detect_timestamp_format(str(chunk[column].dropna().iloc[0]))
+        columns = list(chunk.columns)
+        chunk = convert_column_types(chunk.dropna(subset=['Product', 'DeliveryStart']))
+        for (product, delivery_start_ns), partition in chunk.groupby(['Product', 'DeliveryStart'], observed=True):
+            directory = partition_directory(temporary_path, product, delivery_start_ns)
+            os.makedirs(directory, exist_ok=True)
+            partition.to_parquet(os.path.join(directory, f"part-{chunk_number:05d}.parquet"), index=False)
+
+    os.makedirs(temporary_path, exist_ok=True)
+    with open(os.path.join(temporary_path, 'manifest.json'), 'w') as manifest_file:
+        json.dump({'signature': signature, 'columns': columns, 'timestamp_formats': timestamp_formats}, manifest_file, indent=2)
+    install_cache(temporary_path, cache_path, signature)
+    print(f"Built columnar cache: {cache_path}")
+
+    return cache_path
+
+#A directory cannot be replaced by another while it has files in it, so an outdated cache is moved aside first. If another
+#process installed a current cache in the meantime, that one is kept and this build dropped.
+def install_cache(
+    temporary_path: str,
+    cache_path: str,
+    signature: Dict
+):
+    outdated_path = None
+    if os.path.exists(cache_path) and not cache_is_current(cache_path, signature):
+        outdated_path = f"{cache_path}.{os.getpid()}.old"
+        try:
+            os.replace(cache_path, outdated_path)
+        except FileNotFoundError:
+            outdated_path = None
+    try:
+        os.replace(temporary_path, cache_path)
+    except OSError:
+        if not cache_is_current(cache_path, signature):
+            raise
+        shutil.rmtree(temporary_path, ignore_errors=True)
+    if outdated_path is not None:
+        shutil.rmtree(outdated_path, ignore_errors=True)
+
+#One scan of the whole cache, with the product and delivery start filters pruning partition directories before any file is
+#opened; filters are in the DNF list form pd.read_parquet takes and apply to the rows of the remaining files
+def read_cached_partitions(
+    cache_path: str,
+    product_names: List[str],
+    columns: List[str],
+    delivery_starts: Optional[List[str]] = None,
+    filters: Optional[List] = None
+) -> pd.DataFrame:
+    dataset = ds.dataset(
+        cache_path,
+        format='parquet',
+        partitioning=ds.partitioning(partition_schema, flavor='hive'),
+        ignore_prefixes=['.', '_', 'manifest']
+    )
+    expression = ds.field('product').isin(product_names)
+    if delivery_starts is not None:
+        expression &= ds.field('delivery_start').isin([pd.Timestamp(delivery_start).value for delivery_start in delivery_starts])
+    if filters:
+        expression &= pq.filters_to_expression(filters)
+    return dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+def read_cached_csv(
+    source_csv_filepath: str,
+    cache_directory: str,
+    product_name: Union[str, List[str]],
+    columns: List[str],
+    delivery_starts: Optional[List[str]] = None,
+    filters: Optional[List] = None,
+    parse_dates: Optional[List[str]] = None
+) -> pd.DataFrame:
+    cache_path = build_cache(source_csv_filepath, cache_directory)
+    with open(os.path.join(cache_path, 'manifest.json')) as manifest_file:
+        manifest = json.load(manifest_file)
+
+    product_names = [product_name] if isinstance(product_name, str) else product_name
+    data = read_cached_partitions(cache_path, product_names, columns, delivery_starts, filters)
+    if len(data) == 0:
+        return pd.DataFrame(columns=columns)
+
+    parse_dates = parse_dates or []
+    for column in data.columns:
+        if column in categorical_columns:
+            data[column] = data[column].astype(str).astype('category')
+        elif column in parse_dates:
+            data[column] = pd.to_datetime(data[column], unit='ns', utc=True)
+        elif column in manifest['timestamp_formats']:
+            data[column] = format_timestamps(data[column], manifest['timestamp_formats'][column])
+    return data
+
+#Same frame as pd.read_csv(header=1) filtered to one product, served from the columnar cache when a cache directory is given
+def read_epex_csv(
+    source_csv_filepath: str,
+    product_name: str,
+    columns: List[str],
+    cache_directory: Optional[str] = None,
+    dtype: Optional[Dict] = None,
+    parse_dates: Optional[List[str]] = None,
+    delivery_starts: Optional[List[str]] = None
+) -> pd.DataFrame:
+    if cache_directory is not None:
+        data = read_cached_csv(
+            source_csv_filepath,
+            cache_directory,
+            product_name,
+            columns,
+            delivery_starts,
+            parse_dates=parse_dates
+        )
+        return data.astype(dtype) if dtype else data
+
+    data = pd.read_csv(
+        source_csv_filepath,
+        header=1,
+        usecols=columns,
+        dtype=dtype,
+        parse_dates=parse_dates
+    )
+    selected = data['Product'] == product_name
+    if delivery_starts is not None:
+        selected &= np.isin(ft.to_nanoseconds(data['DeliveryStart']), [pd.Timestamp(delivery_start).value for delivery_start in delivery_starts])
+    return data[selected]
+
+def cached_products(
+    cache_path: str
+) -> List[str]:
+    return sorted(
+        os.path.basename(product_directory)[len('product='):]
+        for product_directory in glob.glob(os.path.join(cache_path, 'product=*'))
+    )
+
+#Like read_epex_csv for several products, or every product when product_names is None, from one read of the file
+def read_epex_csv_products(
+    source_csv_filepath: str,
+    product_names: Optional[List[str]],
+    columns: List[str],
+    cache_directory: Optional[str] = None,
+    dtype: Optional[Dict] = None,
+    parse_dates: Optional[List[str]] = None
+) -> pd.DataFrame:
+    if cache_directory is not None:
+        cache_path = build_cache(source_csv_filepath, cache_directory)
+        product_names = cached_products(cache_path) if product_names is None else product_names
+        data = read_cached_csv(source_csv_filepath, cache_directory, product_names, columns, parse_dates=parse_dates)
+        return data.astype(dtype) if dtype else data
+
+    data = pd.read_csv(
+        source_csv_filepath,
+        header=1,
+        usecols=columns,
+        dtype=dtype,
+        parse_dates=parse_dates
+    )
+    return data if product_names is None else data[data['Product'].isin(product_names)]
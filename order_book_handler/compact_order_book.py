@@ -0,0 +1,360 @@
+import numpy as np
+import order_book_handler.order_book as ob
+import order_book_handler.order as order
+import order_book_handler.price_levels as pl
+from array import array
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, Optional
+
+SIDE_CODES = {'BUY': 0, 'SELL': 1}
+NO_SLOT = -1
+
+#Orders as parallel arrays indexed by slot; released slots go on a free list and are reused before the arrays grow.
+#next_slots and previous_slots link the live orders of each price level in arrival order.
+class CompactOrderStore:
+    def __init__(
+        self,
+        initial_capacity: int = 1024
+    ):
+        self.initial_ids = np.zeros(initial_capacity, dtype=np.int64)
+        self.prices = np.zeros(initial_capacity, dtype=np.float64)
+        self.volumes = np.zeros(initial_capacity, dtype=np.float64)
+        self.side_codes = np.zeros(initial_capacity, dtype=np.int8)
+        #Stdlib arrays, since the links are read and written one item at a time where NumPy scalar access is slow
+        self.next_slots = array('q', [NO_SLOT]) * initial_capacity
+        self.previous_slots = array('q', [NO_SLOT]) * initial_capacity
+        self.free_slots : List[int] = []
+        self.slots_used = 0
+
+    def __len__(
+        self
+    ) -> int:
+        return self.slots_used - len(self.free_slots)
+
+    def allocate(
+        self,
+        initial_id: int,
+        side_code: int,
+        price: float,
+        volume: float
+    ) -> int:
+        if self.free_slots:
+            slot = self.free_slots.pop()
+        else:
+            if self.slots_used == len(self.initial_ids):
+                self._grow()
+            slot = self.slots_used
+            self.slots_used += 1
+        self.initial_ids[slot] = initial_id
+        self.prices[slot] = price
+        self.volumes[slot] = volume
+        self.side_codes[slot] = side_code
+        return slot
+
+    def release(
+        self,
+        slot: int
+    ):
+        self.free_slots.append(slot)
+
+    def _grow(
+        self
+    ):
+        capacity = 2 * len(self.initial_ids)
+        for name in ('initial_ids', 'prices', 'volumes', 'side_codes'):
+            values = getattr(self, name)
+            grown = np.zeros(capacity, dtype=values.dtype)
+            grown[:len(values)] = values
+            setattr(self, name, grown)
+        for name in ('next_slots', 'previous_slots'):
+            getattr(self, name).extend(array('q', [NO_SLOT]) * (capacity - len(getattr(self, name))))
+
+    def nbytes(
+        self
+    ) -> int:
+        links = (self.next_slots, self.previous_slots)
+        return sum(getattr(self, name).nbytes for name in ('initial_ids', 'prices', 'volumes', 'side_codes')) + sum(len(slots) * slots.itemsize for slots in links)
+
+#A price level holding only its volume, order count and the ends of its list of slots, rather than a dict entry per order
+class SlotPriceLevel:
+    __slots__ = ('store', 'volume', 'count', 'head', 'tail')
+
+    def __init__(
+        self,
+        store: CompactOrderStore
+    ):
+        self.store = store
+        self.volume = 0.0
+        self.count = 0
+        self.head = NO_SLOT
+        self.tail = NO_SLOT
+
+    #{initial_id: volume} in arrival order, as PriceLevel.order_ids, built on demand (e.g. for checkpoints)
+    @property
+    def order_ids(
+        self
+    ) -> Dict[int, float]:
+        order_ids = {}
+        slot = self.head
+        while slot != NO_SLOT:
+            order_ids[int(self.store.initial_ids[slot])] = float(self.store.volumes[slot])
+            slot = self.store.next_slots[slot]
+        return order_ids
+
+#PriceLevels whose levels link store slots; add and remove take the order's slot rather than its InitialId
+class SlotPriceLevels(pl.PriceLevels):
+    def __init__(
+        self,
+        store: CompactOrderStore,
+        depth_levels: int = 0,
+        best_is_highest: bool = True
+    ):
+        super().__init__(depth_levels, best_is_highest)
+        self.store = store
+
+    def new_level(
+        self
+    ) -> SlotPriceLevel:
+        return SlotPriceLevel(self.store)
+
+    def add(
+        self,
+        price: float,
+        slot: int,
+        volume: float
+    ):
+        if price != price:
+            return
+
+        level = self.level_at(price)
+        store = self.store
+        store.previous_slots[slot] = level.tail
+        store.next_slots[slot] = NO_SLOT
+        if level.tail == NO_SLOT:
+            level.head = slot
+        else:
+            store.next_slots[level.tail] = slot
+        level.tail = slot
+        level.count += 1
+        self.add_volume(price, level, volume)
+
+    def remove(
+        self,
+        price: float,
+        slot: int
+    ):
+        if price != price:
+            return
+
+        level = self.levels[price]
+        store = self.store
+        previous_slot = store.previous_slots[slot]
+        next_slot = store.next_slots[slot]
+        if previous_slot == NO_SLOT:
+            level.head = next_slot
+        else:
+            store.next_slots[previous_slot] = next_slot
+        if next_slot == NO_SLOT:
+            level.tail = previous_slot
+        else:
+            store.previous_slots[next_slot] = previous_slot
+        level.count -= 1
+        self.remove_volume(price, level, float(store.volumes[slot]), level.count == 0)
+
+#Read-only {initial_id: Order} view over one side and state of the store, so code written against OrderBook.orders keeps working
+class OrderSlotsView(Mapping):
+    def __init__(
+        self,
+        store: CompactOrderStore,
+        slots: Dict[int, int]
+    ):
+        self.store = store
+        self.slots = slots
+
+    def __getitem__(
+        self,
+        initial_id: int
+    ) -> order.Order:
+        slot = self.slots[initial_id]
+        return order.Order(
+            initial_id=initial_id,
+            price=float(self.store.prices[slot]),
+            available_volume=float(self.store.volumes[slot])
+        )
+
+    def __iter__(
+        self
+    ) -> Iterator[int]:
+        return iter(self.slots)
+
+    def __len__(
+        self
+    ) -> int:
+        return len(self.slots)
+
+    def __contains__(
+        self,
+        initial_id
+    ) -> bool:
+        return initial_id in self.slots
+
+#Same behaviour as OrderBook, including its errors, with orders held in a CompactOrderStore rather than one Order per order.
+#The *_values methods take the event fields directly so the replay does not build an Order per event.
+class CompactOrderBook(ob.OrderBook):
+    def __init__(
+        self,
+        depth_levels: int = 0,
+        depth_price_band: Optional[float] = None,
+        feature_grid_width: Optional[str] = None,
+        record_feature_changes: bool = True,
+        initial_capacity: int = 1024
+    ):
+        super().__init__(depth_levels, depth_price_band, feature_grid_width, record_feature_changes)
+        self.store = CompactOrderStore(initial_capacity)
+        self.price_levels = {
+            'BUY': SlotPriceLevels(self.store, depth_levels, best_is_highest=True),
+            'SELL': SlotPriceLevels(self.store, depth_levels, best_is_highest=False)
+        }
+        self.live_slots = {
+            'BUY': {},
+            'SELL': {}
+        }
+        self.hibernated_slots = {
+            'BUY': {},
+            'SELL': {}
+        }
+        self.orders = {side: OrderSlotsView(self.store, slots) for side, slots in self.live_slots.items()}
+        self.hibernated_orders = {side: OrderSlotsView(self.store, slots) for side, slots in self.hibernated_slots.items()}
+
+    def add_order_values(
+        self,
+        initial_id: int,
+        price: float,
+        volume: float,
+        order_side: str
+    ):
+        live_slots = self.live_slots[order_side]
+        if initial_id in live_slots:
+            raise ValueError(f"Order with initial_id {initial_id} already exists in {order_side} orders.")
+        live_slot = self.store.allocate(initial_id, SIDE_CODES[order_side], price, volume)
+        live_slots[initial_id] = live_slot
+        self.price_levels[order_side].add(price, live_slot, volume)
+
+        hibernated_slot = self.hibernated_slots[order_side].pop(initial_id, None)
+        if hibernated_slot is not None:
+            self.hibernated_volume[order_side] -= float(self.store.volumes[hibernated_slot])
+            self.store.release(hibernated_slot)
+
+    def change_existing_order_values(
+        self,
+        initial_id: int,
+        price: float,
+        volume: float,
+        order_side: str
+    ):
+        hibernated_slot = self.hibernated_slots[order_side].get(initial_id)
+        if hibernated_slot is not None:
+            self.hibernated_volume[order_side] += volume - float(self.store.volumes[hibernated_slot])
+            self.store.prices[hibernated_slot] = price
+            self.store.volumes[hibernated_slot] = volume
+            return
+
+        live_slot = self.live_slots[order_side].get(initial_id)
+        if live_slot is None:
+            raise ValueError(f"Order with initial_id {initial_id} does not exist in {order_side} orders.")
+        price_levels = self.price_levels[order_side]
+        price_levels.remove(float(self.store.prices[live_slot]), live_slot)
+        self.store.prices[live_slot] = price
+        self.store.volumes[live_slot] = volume
+        price_levels.add(price, live_slot, volume)
+
+    def delete_order_values(
+        self,
+        initial_id: int,
+        price: float,
+        volume: float,
+        order_side: str
+    ):
+        live_slot = self.live_slots[order_side].pop(initial_id, None)
+        if live_slot is not None:
+            self.price_levels[order_side].remove(float(self.store.prices[live_slot]), live_slot)
+            self.store.release(live_slot)
+            return
+
+        hibernated_slot = self.hibernated_slots[order_side].pop(initial_id, None)
+        if hibernated_slot is None:
+            raise KeyError(f"Order with initial_id {initial_id} does not exist in {order_side} orders.")
+        self.hibernated_volume[order_side] -= float(self.store.volumes[hibernated_slot])
+        self.store.release(hibernated_slot)
+
+    #As in OrderBook, the hibernated order takes the event's price and volume and replaces any earlier hibernated entry
+    def hibernate_order_values(
+        self,
+        initial_id: int,
+        price: float,
+        volume: float,
+        order_side: str
+    ):
+        live_slot = self.live_slots[order_side].pop(initial_id, None)
+        if live_slot is None:
+            raise KeyError(f"Order with initial_id {initial_id} does not exist in {order_side} orders.")
+        self.price_levels[order_side].remove(float(self.store.prices[live_slot]), live_slot)
+
+        hibernated_slots = self.hibernated_slots[order_side]
+        if initial_id in hibernated_slots:
+            self.store.release(live_slot)
+            live_slot = hibernated_slots[initial_id]
+        self.store.prices[live_slot] = price
+        self.store.volumes[live_slot] = volume
+        hibernated_slots[initial_id] = live_slot
+        self.hibernated_volume[order_side] += volume
+
+    def add_order(
+        self,
+        order : order.Order,
+        order_side : str
+    ):
+        self.add_order_values(order.initial_id, order.price, order.available_volume, order_side)
+
+    def change_existing_order(
+        self,
+        order: order.Order,
+        order_side: str
+    ):
+        self.change_existing_order_values(order.initial_id, order.price, order.available_volume, order_side)
+
+    def delete_order(
+        self,
+        order: order.Order,
+        order_side: str
+    ):
+        self.delete_order_values(order.initial_id, order.price, order.available_volume, order_side)
+
+    def hibernate_order(
+        self,
+        order: order.Order,
+        order_side: str
+    ):
+        self.hibernate_order_values(order.initial_id, order.price, order.available_volume, order_side)
+
+    action_code_to_action = {
+        'A': add_order,
+        'C': change_existing_order,
+        'D': delete_order,
+        'P': change_existing_order,
+        'M': delete_order,
+        'X': delete_order,
+        'H': hibernate_order,
+        'I': change_existing_order
+    }
+
+    value_action_code_to_action = {
+        'A': add_order_values,
+        'C': change_existing_order_values,
+        'D': delete_order_values,
+        'P': change_existing_order_values,
+        'M': delete_order_values,
+        'X': delete_order_values,
+        'H': hibernate_order_values,
+        'I': change_existing_order_values
+    }
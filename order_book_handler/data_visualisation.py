@@ -1,106 +1,317 @@
 import os
+import math
+import numpy as np
 import order_book_handler.order_book as ob
+import order_book_handler.feature_table as ft
+import order_book_handler.time_buckets as tb
+import order_book_handler.downsampling as ds
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
-from datetime import datetime, timedelta
-from typing import Dict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from typing import Dict, Iterable, List, Optional, Tuple
+
+figure_dpi = 300
+
+@dataclass(slots=True)
+class PlotSeries:
+    times : np.ndarray
+    values : np.ndarray
+    label : str
+    kind : str = 'line'
+    color : Optional[str] = None
+    marker : Optional[str] = None
+
+#Everything a worker needs to draw one delivery period: int64 ns UTC times and float values, no OrderBook
+@dataclass(slots=True)
+class FigurePanel:
+    figure_path : str
+    title : str
+    xlabel : str
+    ylabel : str
+    figsize : Tuple[float, float] = (12, 6)
+    series : List[PlotSeries] = field(default_factory=list)
+    hourly_ticks : bool = False
+    annotation : Optional[str] = None
+
+#Slices a time-indexed series to its final hours with a binary search on the sorted index
+def last_hours_of_series(
+    series: pd.Series,
+    hours: float
+) -> pd.Series:
+    if series.empty:
+        return series
+    start_time = series.index[-1] - pd.Timedelta(hours=hours)
+    return series.iloc[series.index.searchsorted(start_time, side='left'):]
+
+def series_times_to_nanoseconds(
+    series: pd.Series
+) -> np.ndarray:
+    return ft.to_nanoseconds(series.index.to_series())
+
+def figure_filename(
+    prefix: str,
+    delivery_start_time: str
+) -> str:
+    safe_filename = str(delivery_start_time).replace(':', '_').replace(' ', '_')
+    return f"{prefix}_{safe_filename}.png"
+
+def draw_panel(
+    axes,
+    panel: FigurePanel,
+    single_figure: bool = True
+):
+    for plot_series in panel.series:
+        times = plot_series.times.view('datetime64[ns]')
+        if plot_series.kind == 'step':
+            axes.step(times, plot_series.values, where='post', label=plot_series.label, color=plot_series.color)
+        else:
+            axes.plot(times, plot_series.values, label=plot_series.label, color=plot_series.color, marker=plot_series.marker)
+    if panel.hourly_ticks:
+        axes.xaxis.set_major_locator(mdates.HourLocator())
+        axes.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
+    if panel.annotation is not None:
+        #Placed in the figure corner for single figures, as before, and inside each panel of a grid
+        (axes.figure if single_figure else axes).text(
+            0.02, 0.95,
+            panel.annotation,
+            transform=axes.figure.transFigure if single_figure else axes.transAxes,
+            fontsize=10,
+            verticalalignment='top',
+            bbox=dict(facecolor='white', alpha=0.7, edgecolor='gray')
+        )
+    axes.set_xlabel(panel.xlabel)
+    axes.set_ylabel(panel.ylabel)
+    axes.set_title(panel.title)
+    axes.legend(loc='upper right' if panel.annotation is not None and not single_figure else 'best')
+    axes.tick_params(axis='x', labelrotation=45)
+
+#Explicit Figure on an Agg canvas, so workers never touch pyplot's global figure state
+def render_figure(
+    panel: FigurePanel,
+    dpi: int = figure_dpi
+) -> str:
+    figure = Figure(figsize=panel.figsize)
+    FigureCanvasAgg(figure)
+    draw_panel(figure.add_subplot(), panel)
+    figure.tight_layout()
+    figure.savefig(panel.figure_path, dpi=dpi, bbox_inches='tight')
+    return panel.figure_path
+
+def render_grid_figure(
+    panels: List[FigurePanel],
+    figure_path: str,
+    columns: int = 4,
+    dpi: int = 100
+) -> str:
+    rows = math.ceil(len(panels) / columns)
+    figure = Figure(figsize=(6 * columns, 3.5 * rows))
+    FigureCanvasAgg(figure)
+    for i, panel in enumerate(panels):
+        draw_panel(figure.add_subplot(rows, columns, i + 1), panel, single_figure=False)
+    figure.tight_layout()
+    figure.savefig(figure_path, dpi=dpi, bbox_inches='tight')
+    return figure_path
+
+def render_figures(
+    panels: List[FigurePanel],
+    workers: int = 1,
+    dpi: int = figure_dpi
+) -> List[str]:
+    if workers <= 1:
+        figure_paths = [render_figure(panel, dpi) for panel in panels]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            figure_paths = list(executor.map(partial(render_figure, dpi=dpi), panels))
+    for figure_path in figure_paths:
+        print(f"Saved figure: {figure_path}")
+    return figure_paths
+
+#One image per delivery period, or a single grid of every period when grid_columns is given
+def render_panels(
+    panels: List[FigurePanel],
+    output_filepath: str,
+    grid_filename: str,
+    workers: int = 1,
+    grid_columns: Optional[int] = None
+) -> List[str]:
+    if grid_columns is None:
+        return render_figures(panels, workers)
+    if not panels:
+        return []
+    figure_path = render_grid_figure(panels, os.path.join(output_filepath, grid_filename), grid_columns)
+    print(f"Saved figure: {figure_path}")
+    return [figure_path]
+
+#Same points as OrderBook.bid_ask_spread_over_time, for when only the features frame was kept
+def bid_ask_spread_changes(
+    features: pd.DataFrame
+) -> pd.Series:
+    spreads = features['bid_ask_spread']
+    values = spreads.to_numpy()
+    previous_values = np.concatenate(([ob.OrderBook.initial_feature_values[2]], values[:-1]))
+    return spreads[values != previous_values]
+
+def bas_5min_avg_panel(
+    delivery_start_time: str,
+    bucket_starts_ns: np.ndarray,
+    spreads: np.ndarray,
+    output_filepath: str,
+    time_weighted: bool = False
+) -> FigurePanel:
+    label = 'Bid-Ask Spread (5min Time-Weighted Avg)' if time_weighted else 'Bid-Ask Spread (5min Avg)'
+    return FigurePanel(
+        figure_path=os.path.join(output_filepath, figure_filename('trade_costs_5minavg', delivery_start_time)),
+        title='Bid-Ask Spread 5-Minute Average Over Time',
+        xlabel='Transaction Time',
+        ylabel=label,
+        series=[PlotSeries(bucket_starts_ns, spreads, label, marker='o')],
+        hourly_ticks=True
+    )
+
+#time_weighted plots each bucket's spread weighted by how long it held rather than one weight per change.
+#Books replayed with a 5min feature grid are read straight from the grid; otherwise it is computed from the changes.
+def bas_5min_avg_panels(
+    order_books: Dict[str, ob.OrderBook],
+    hours_before_end_of_trading_session_to_visualise: int,
+    output_filepath: str,
+    time_weighted: bool = False
+) -> List[FigurePanel]:
+    five_minutes = pd.Timedelta('5min').value
+    if time_weighted and order_books and all(
+        order_book.feature_grid is not None and order_book.feature_grid.bucket_width_ns == five_minutes
+        for order_book in order_books.values()
+    ):
+        panels = []
+        for delivery_start_time, order_book in order_books.items():
+            filtered = last_hours_of_series(
+                order_book.feature_grid_to_dataframe()['bid_ask_spread'].dropna(),
+                hours_before_end_of_trading_session_to_visualise
+            )
+            if filtered.empty:
+                print("No data in the selected interval to plot.")
+                continue
+            panels.append(bas_5min_avg_panel(delivery_start_time, series_times_to_nanoseconds(filtered), filtered.to_numpy(), output_filepath, time_weighted))
+        return panels
+
+    return bas_5min_avg_panels_from_spreads(
+        {delivery_start_time: order_book.bid_ask_spread_over_time for delivery_start_time, order_book in order_books.items()},
+        hours_before_end_of_trading_session_to_visualise,
+        output_filepath,
+        time_weighted
+    )
+
+def bas_5min_avg_panels_from_spreads(
+    spreads_by_delivery_start: Dict[str, pd.Series],
+    hours_before_end_of_trading_session_to_visualise: int,
+    output_filepath: str,
+    time_weighted: bool = False
+) -> List[FigurePanel]:
+    filtered_spreads = {}
+    for delivery_start_time, spreads in spreads_by_delivery_start.items():
+        filtered = last_hours_of_series(
+            spreads,
+            hours_before_end_of_trading_session_to_visualise
+        )
+        if filtered.empty:
+            print("No data in the selected interval to plot.")
+            continue
+        filtered_spreads[delivery_start_time] = filtered
+
+    bas_5min_avgs = dict(list(tb.aggregate_spreads(filtered_spreads, '5min').groupby('delivery_start', sort=False)))
+    spread_column = 'time_weighted_spread' if time_weighted else 'mean_spread'
+    return [
+        bas_5min_avg_panel(
+            delivery_start_time,
+            ft.to_nanoseconds(bas_5min_avgs[delivery_start_time]['bucket_start']),
+            bas_5min_avgs[delivery_start_time][spread_column].to_numpy(),
+            output_filepath,
+            time_weighted
+        )
+        for delivery_start_time in filtered_spreads.keys()
+    ]
 
 def visualise_bas_5min_avg_by_product(
     order_books: Dict[str, ob.OrderBook],
     hours_before_end_of_trading_session_to_visualise: int,
-    output_filepath: str
+    output_filepath: str,
+    workers: int = 1,
+    grid_columns: Optional[int] = None,
+    time_weighted: bool = False
     ):
     os.makedirs(output_filepath, exist_ok=True)
+    panels = bas_5min_avg_panels(order_books, hours_before_end_of_trading_session_to_visualise, output_filepath, time_weighted)
+    return render_panels(panels, output_filepath, 'bid_ask_spread_5min_avg_grid.png', workers, grid_columns)
+
+#The (time, value) pairs plt.step(where='post') draws, as arrays: each change is preceded by the previous value at its time
+def step_series(
+    times: np.ndarray,
+    values: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    if len(times) == 0:
+        return times.astype(np.int64), values.astype(np.float64)
+    return np.repeat(times, 2)[1:].astype(np.int64), np.repeat(values, 2)[:-1].astype(np.float64)
+
+#Change points are downsampled before the step is built, to about one bucket per horizontal pixel by default
+def bas_over_time_panels(
+    order_books: Dict[str, ob.OrderBook],
+    hours_before_end_of_trading_session_to_visualise: int,
+    output_filepath: str,
+    downsampling_method: Optional[str] = 'min_max',
+    max_points: Optional[int] = None
+) -> List[FigurePanel]:
+    panels = []
     for delivery_start_time, order_book in order_books.items():
-        latest_time = max(datetime.fromisoformat(t) for t in order_book.bid_ask_spread_over_time.keys())
-        start_time = latest_time - timedelta(hours=hours_before_end_of_trading_session_to_visualise)
-        filtered = {
-            t: v for t, v in order_book.bid_ask_spread_over_time.items()
-            if datetime.fromisoformat(t) >= start_time
-        }
-        if not filtered:
+        filtered = last_hours_of_series(
+            order_book.bid_ask_spread_over_time,
+            hours_before_end_of_trading_session_to_visualise
+        )
+        if filtered.empty:
             print("No data in the selected interval to plot.")
             continue
 
-        df = pd.DataFrame(
-            list(filtered.items()), columns=['time', 'bas']
+        panel = FigurePanel(
+            figure_path=os.path.join(output_filepath, figure_filename('trade_costs', delivery_start_time)),
+            title='Bid-Ask Spread Over Time (Step Plot)',
+            xlabel='Transaction Time',
+            ylabel='Bid-Ask Spread',
+            hourly_ticks=True
         )
-        df['time'] = pd.to_datetime(df['time'])
-        df = df.set_index('time').sort_index()
-        bas_5min_avg = df['bas'].resample('5min').mean()
-
-        plt.figure(figsize=(12, 6))
-        plt.gca().xaxis.set_major_locator(mdates.HourLocator())
-        plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
-
-        plt.plot(bas_5min_avg.index, bas_5min_avg.to_numpy(), label='Bid-Ask Spread (5min Avg)', marker='o')
-        plt.xlabel('Transaction Time')
-        plt.ylabel('Bid-Ask Spread (5min Avg)')
-        plt.title('Bid-Ask Spread 5-Minute Average Over Time')
-        plt.legend()
-        plt.xticks(rotation=45)
-        plt.tight_layout()
-        safe_filename = str(delivery_start_time).replace(':', '_').replace(' ', '_')
-        figure_path = os.path.join(output_filepath, f"trade_costs_5minavg_{safe_filename}.png")
-        plt.savefig(figure_path, dpi=300, bbox_inches='tight')
-        print(f"Saved figure: {figure_path}")
-        plt.close()
+        times = series_times_to_nanoseconds(filtered)
+        spreads = filtered.to_numpy(dtype=np.float64)
+        if downsampling_method is not None:
+            times, spreads = ds.downsample(times, spreads, downsampling_method, max_points or int(panel.figsize[0] * figure_dpi))
+        step_times, step_spreads = step_series(times, spreads)
+        panel.series.append(PlotSeries(step_times, step_spreads, 'Bid-Ask Spread', kind='step'))
+        panels.append(panel)
+    return panels
 
 def visualise_bas_over_time_by_product(
         order_books: Dict[str,ob.OrderBook],
         hours_before_end_of_trading_session_to_visualise : int,
-        output_filepath: str
+        output_filepath: str,
+        workers: int = 1,
+        grid_columns: Optional[int] = None,
+        downsampling_method: Optional[str] = 'min_max',
+        max_points: Optional[int] = None
     ):
     os.makedirs(output_filepath, exist_ok=True)
-    for delivery_start_time, order_book in order_books.items():
-        latest_time = max(datetime.fromisoformat(t) for t in order_book.bid_ask_spread_over_time.keys())
-        start_time = latest_time - timedelta(hours=hours_before_end_of_trading_session_to_visualise)
-        filtered = {
-            t: v for t, v in order_book.bid_ask_spread_over_time.items()
-            if datetime.fromisoformat(t) >= start_time
-        }
-        if not filtered:
-            print("No data in the selected interval to plot.")
-            return
-
-        times = sorted(filtered.keys(), key=lambda t: datetime.fromisoformat(t))
-        spreads = [filtered[t] for t in times]
-        times_dt = [datetime.fromisoformat(t) for t in times]
-
-        step_times = []
-        step_spreads = []
-        for i in range(len(times_dt)):
-            if i > 0:
-                step_times.append(times_dt[i])
-                step_spreads.append(spreads[i-1])
-            step_times.append(times_dt[i])
-            step_spreads.append(spreads[i])
-
-        plt.figure(figsize=(12, 6))
-        plt.gca().xaxis.set_major_locator(mdates.HourLocator())
-        plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
-
-        plt.step(step_times, step_spreads, where='post', label='Bid-Ask Spread')
-        plt.xlabel('Transaction Time')
-        plt.ylabel('Bid-Ask Spread')
-        plt.title('Bid-Ask Spread Over Time (Step Plot)')
-        plt.legend()
-        plt.xticks(rotation=45)
-        plt.tight_layout()
-        safe_filename = str(delivery_start_time).replace(':', '_').replace(' ', '_')
-        figure_path = os.path.join(output_filepath, f"trade_costs_{safe_filename}.png")
-        plt.savefig(figure_path, dpi=300, bbox_inches='tight')
-        print(f"Saved figure: {figure_path}")
-        plt.close()
+    panels = bas_over_time_panels(order_books, hours_before_end_of_trading_session_to_visualise, output_filepath, downsampling_method, max_points)
+    return render_panels(panels, output_filepath, 'bid_ask_spread_grid.png', workers, grid_columns)
 
-def visualise_buy_sell_trade_costs(
+def buy_sell_trade_costs_panels(
     implicit_buy_costs: Dict[str, pd.DataFrame],
     implicit_sell_costs: Dict[str, pd.DataFrame],
     hours_before_end_of_session_to_visualise: int,
     output_filepath: str
-):
-    os.makedirs(output_filepath, exist_ok=True)
+) -> List[FigurePanel]:
+    panels = []
+    panel_delivery_start_times = []
+    filtered_costs = {}
     for delivery_start_time, buy_costs_df in implicit_buy_costs.items():
         buy_costs_df = buy_costs_df.copy()
         sell_costs_df = implicit_sell_costs[delivery_start_time].copy()
@@ -111,68 +322,89 @@ def visualise_buy_sell_trade_costs(
         sell_costs_df.index = pd.to_datetime(sell_costs_df.index)
         max_time = buy_costs_df.index.max()
         min_time = max_time - pd.Timedelta(hours=hours_before_end_of_session_to_visualise)
-        buy_costs_filtered = buy_costs_df[buy_costs_df.index >= min_time]
-        sell_costs_filtered = sell_costs_df[sell_costs_df.index >= min_time]
+        buy_merged = buy_costs_df[buy_costs_df.index >= min_time]
+        sell_merged = sell_costs_df[sell_costs_df.index >= min_time]
         
-        plt.figure(figsize=(10, 5))
-        if not buy_costs_filtered.empty or not sell_costs_filtered.empty:
-            buy_merged = buy_costs_filtered.copy()
-            sell_merged = sell_costs_filtered.copy()
-            # Calculate total implicit trade cost and total trade cost for buys
-            buy_total_implicit_cost = (buy_merged['implicit_trade_cost'] * buy_merged['trade_volume']).sum() if not buy_merged.empty else 0
-            buy_total_trade_cost = (buy_merged['trade_price'] * buy_merged['trade_volume']).sum() if not buy_merged.empty else 0
-            buy_ratio = (buy_total_implicit_cost / buy_total_trade_cost) if buy_total_trade_cost > 0 else float('nan')
-
-            # Calculate total implicit trade cost and total trade cost for sells
-            sell_total_implicit_cost = (sell_merged['implicit_trade_cost'] * sell_merged['trade_volume']).sum() if not sell_merged.empty else 0
-            sell_total_trade_cost = (sell_merged['trade_price'] * sell_merged['trade_volume']).sum() if not sell_merged.empty else 0
-            sell_ratio = (sell_total_implicit_cost / sell_total_trade_cost) if sell_total_trade_cost > 0 else float('nan')
-
-            # Print ratios on the plot
-            plt.gcf().text(
-                0.02, 0.95,
-                f"Buy: total implicit/total = {buy_ratio:.4%}\nSell: total implicit/total = {sell_ratio:.4%}",
-                fontsize=10,
-                verticalalignment='top',
-                bbox=dict(facecolor='white', alpha=0.7, edgecolor='gray')
+        # Calculate total implicit trade cost and total trade cost for buys
+        buy_total_implicit_cost = (buy_merged['implicit_trade_cost'] * buy_merged['trade_volume']).sum() if not buy_merged.empty else 0
+        buy_total_trade_cost = (buy_merged['trade_price'] * buy_merged['trade_volume']).sum() if not buy_merged.empty else 0
+        buy_ratio = (buy_total_implicit_cost / buy_total_trade_cost) if buy_total_trade_cost > 0 else float('nan')
+
+        # Calculate total implicit trade cost and total trade cost for sells
+        sell_total_implicit_cost = (sell_merged['implicit_trade_cost'] * sell_merged['trade_volume']).sum() if not sell_merged.empty else 0
+        sell_total_trade_cost = (sell_merged['trade_price'] * sell_merged['trade_volume']).sum() if not sell_merged.empty else 0
+        sell_ratio = (sell_total_implicit_cost / sell_total_trade_cost) if sell_total_trade_cost > 0 else float('nan')
+
+        filtered_costs[('buy', delivery_start_time)] = buy_merged
+        filtered_costs[('sell', delivery_start_time)] = sell_merged
+        panels.append(FigurePanel(
+            figure_path=os.path.join(output_filepath, figure_filename('trade_costs', delivery_start_time)),
+            title=f"Buy/Sell Implicit Trade Costs - Delivery Start: {delivery_start_time}",
+            xlabel="Trade Execution Time",
+            ylabel="VWAP Implicit Realtive Trade Cost (5min, %)",
+            figsize=(10, 5),
+            annotation=f"Buy: total implicit/total = {buy_ratio:.4%}\nSell: total implicit/total = {sell_ratio:.4%}"
+        ))
+        panel_delivery_start_times.append(delivery_start_time)
+
+    #Every period and both sides in one bucketed pass
+    vwaps = dict(list(tb.aggregate_trades(filtered_costs, '5min', key_names=('side', 'delivery_start')).groupby(['side', 'delivery_start'], sort=False)))
+    for panel, delivery_start_time in zip(panels, panel_delivery_start_times):
+        for side, side_label, color in (('buy', 'Buy', 'green'), ('sell', 'Sell', 'red')):
+            vwap = vwaps.get((side, delivery_start_time))
+            if vwap is None:
+                continue
+            panel.series.append(PlotSeries(ft.to_nanoseconds(vwap['bucket_start']), vwap['vwap'].to_numpy(), f"{side_label} VWAP (5min)", color=color, marker='o'))
+    return panels
+
+def visualise_buy_sell_trade_costs(
+    implicit_buy_costs: Dict[str, pd.DataFrame],
+    implicit_sell_costs: Dict[str, pd.DataFrame],
+    hours_before_end_of_session_to_visualise: int,
+    output_filepath: str,
+    workers: int = 1,
+    grid_columns: Optional[int] = None
+):
+    os.makedirs(output_filepath, exist_ok=True)
+    panels = buy_sell_trade_costs_panels(implicit_buy_costs, implicit_sell_costs, hours_before_end_of_session_to_visualise, output_filepath)
+    return render_panels(panels, output_filepath, 'buy_sell_trade_costs_grid.png', workers, grid_columns)
+
+#Draws each period's 5-minute spread and buy/sell trade cost figures as it arrives from
+#tcr.stream_implicit_trade_costs_by_side, so no more than the periods being rendered are held
+def visualise_delivery_period_stream(
+    cost_stream: Iterable[Tuple[str, pd.DataFrame, pd.DataFrame, pd.DataFrame]],
+    hours_before_end_of_session_to_visualise: int,
+    output_filepath: str,
+    workers: int = 1
+) -> List[str]:
+    os.makedirs(output_filepath, exist_ok=True)
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    figure_paths = []
+    try:
+        for delivery_start_time, features, implicit_buy_costs, implicit_sell_costs in cost_stream:
+            panels = bas_5min_avg_panels_from_spreads(
+                {delivery_start_time: bid_ask_spread_changes(features)},
+                hours_before_end_of_session_to_visualise,
+                output_filepath
             )
-            if not buy_merged.empty:
-                buy_merged['trade_volume'] = buy_merged['trade_volume'] if 'trade_volume' in buy_merged else 1
-                buy_vwap = buy_merged.resample('5min').apply(
-                    lambda x: (x['implicit_trade_cost'] * x['trade_volume']).sum() / x['trade_volume'].sum()
-                    if x['trade_volume'].sum() > 0 else float('nan')
-                )
-                plt.plot(
-                    buy_vwap.index,
-                    buy_vwap.values,
-                    label='Buy VWAP (5min)',
-                    color='green',
-                    marker='o'
-                )
-            if not sell_merged.empty:
-                sell_merged['trade_volume'] = sell_merged['trade_volume'] if 'trade_volume' in sell_merged else 1
-                sell_vwap = sell_merged.resample('5min').apply(
-                    lambda x: (x['implicit_trade_cost'] * x['trade_volume']).sum() / x['trade_volume'].sum()
-                    if x['trade_volume'].sum() > 0 else float('nan')
-                )
-                plt.plot(
-                    sell_vwap.index,
-                    sell_vwap.values,
-                    label='Sell VWAP (5min)',
-                    color='red',
-                    marker='o'
-                )
-            plt.ylabel("VWAP Implicit Realtive Trade Cost (5min, %)")
-            plt.xlabel("Trade Execution Time")
-            plt.title(f"Buy/Sell Implicit Trade Costs - Delivery Start: {delivery_start_time}")
-            plt.legend()
-            plt.xticks(rotation=45)
-            plt.tight_layout()
-            safe_filename = str(delivery_start_time).replace(':', '_').replace(' ', '_')
-            figure_path = os.path.join(output_filepath, f"trade_costs_{safe_filename}.png")
-            plt.savefig(figure_path, dpi=300, bbox_inches='tight')
-            print(f"Saved figure: {figure_path}")
-            plt.close()
+            panels += buy_sell_trade_costs_panels(
+                {delivery_start_time: implicit_buy_costs},
+                {delivery_start_time: implicit_sell_costs},
+                hours_before_end_of_session_to_visualise,
+                output_filepath
+            )
+            del features
+            if executor is None:
+                figure_paths += [render_figure(panel) for panel in panels]
+            else:
+                figure_paths += [executor.submit(render_figure, panel) for panel in panels]
+        figure_paths = [figure_path if isinstance(figure_path, str) else figure_path.result() for figure_path in figure_paths]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    for figure_path in figure_paths:
+        print(f"Saved figure: {figure_path}")
+    return figure_paths
 
 def visualise_trade_costs_by_product_by_day(
     implicit_trade_costs: Dict[str, pd.DataFrame],
@@ -180,6 +412,8 @@ def visualise_trade_costs_by_product_by_day(
     hours_before_end_of_session_to_visualise: int,
     output_filepath: str
 ):
+    merged_by_delivery_start_time = {}
+    tick_times_by_delivery_start_time = {}
     for delivery_start_time, trade_costs_df in implicit_trade_costs.items():
         trade_costs_df = trade_costs_df.copy()
         volumes_df = trade_volumes[delivery_start_time].copy()
@@ -190,13 +424,16 @@ def visualise_trade_costs_by_product_by_day(
         trade_costs_filtered = trade_costs_df[trade_costs_df.index >= min_time]
         volumes_filtered = volumes_df[volumes_df.index >= min_time]
         interval = pd.Timedelta(minutes=15)
-        tick_times = pd.date_range(start=trade_costs_filtered.index.min(), end=trade_costs_filtered.index.max(), freq=interval)
-        merged = trade_costs_filtered.join(volumes_filtered, how='inner')
-        resampled_vwap = merged.resample('5min').apply(
-            lambda x: (x['implicit_trade_cost'] * x['trade_volume']).sum() / x['trade_volume'].sum()
-            if x['trade_volume'].sum() > 0 else float('nan')
-        )
-        resampled_volume = merged['trade_volume'].resample('5min').sum()
+        tick_times_by_delivery_start_time[delivery_start_time] = pd.date_range(start=trade_costs_filtered.index.min(), end=trade_costs_filtered.index.max(), freq=interval)
+        merged_by_delivery_start_time[delivery_start_time] = trade_costs_filtered.join(volumes_filtered, how='inner')
+    
+    buckets_by_delivery_start_time = dict(list(tb.aggregate_trades(merged_by_delivery_start_time, '5min').groupby('delivery_start', sort=False)))
+    for delivery_start_time, merged in merged_by_delivery_start_time.items():
+        tick_times = tick_times_by_delivery_start_time[delivery_start_time]
+        buckets = buckets_by_delivery_start_time.get(delivery_start_time)
+        if buckets is not None:
+            resampled_vwap = pd.Series(buckets['vwap'].to_numpy(), index=pd.DatetimeIndex(buckets['bucket_start']))
+            resampled_volume = pd.Series(buckets['volume'].to_numpy(), index=pd.DatetimeIndex(buckets['bucket_start']))
 
         fig, ax1 = plt.subplots(figsize=(10, 5))
         if not merged.empty:
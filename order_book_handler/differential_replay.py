@@ -0,0 +1,454 @@
+import os
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+import order_book_handler.order_book as ob
+import order_book_handler.baseline_order_book as bob
+import order_book_handler.order_book_reconstructor as ob_reconstruction
+import order_book_handler.replay_engine as replay
+import order_book_handler.synthetic_data as sd
+import order_book_handler.time_buckets as tb
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+#An engine turns the orders of one delivery period (as read by ob_reconstruction.read_orders) into a finished book
+Engine = Callable[[pd.DataFrame], Union[ob.OrderBook, bob.BaselineOrderBook]]
+
+#Only what the original OrderBook kept can be compared with it: the change series of each feature and the orders left
+compared_features = ob.OrderBook.feature_columns
+
+#The frozen original replay, so a change to the shared OrderBook code cannot also move the reference
+def reference_engine(
+    orders_one_delivery_period: pd.DataFrame
+) -> bob.BaselineOrderBook:
+    return bob.reconstruct_baseline_order_book_one_delivery_period(orders_one_delivery_period)
+
+def groups_engine(
+    orders_one_delivery_period: pd.DataFrame
+) -> ob.OrderBook:
+    return ob_reconstruction.reconstruct_order_book_one_delivery_period_by_groups(orders_one_delivery_period)
+
+def replay_engine(
+    orders_one_delivery_period: pd.DataFrame,
+    compact_orders: bool = False
+) -> ob.OrderBook:
+    encoded_orders = replay.encode_orders_by_keys(orders_one_delivery_period, ()).get(())
+    if encoded_orders is None:
+        return ob.OrderBook()
+    return replay.replay_delivery_period(encoded_orders, compact_orders=compact_orders)
+
+def compact_replay_engine(
+    orders_one_delivery_period: pd.DataFrame
+) -> ob.OrderBook:
+    return replay_engine(orders_one_delivery_period, compact_orders=True)
+
+engines = {
+    'groups': groups_engine,
+    'replay': replay_engine,
+    'compact': compact_replay_engine
+}
+
+#table is the feature whose change series diverges at row, or 'exception' when one side raised (or both raised
+#differently); error then describes what was raised and row is None
+@dataclass(slots=True)
+class Divergence:
+    table : str
+    row : Optional[int]
+    transaction_time : Optional[int]
+    reference_row : Optional[Tuple[float, ...]]
+    engine_row : Optional[Tuple[float, ...]]
+    error : Optional[str] = None
+
+@dataclass(slots=True)
+class DifferentialResult:
+    engine_name : str
+    delivery_start : str
+    events : int
+    reference_seconds : float
+    engine_seconds : float
+    divergence : Optional[Divergence] = None
+    state_differences : Dict[str, Tuple] = field(default_factory=dict)
+    repro_filepath : Optional[str] = None
+
+    @property
+    def matches(
+        self
+    ) -> bool:
+        return self.divergence is None and not self.state_differences
+
+    #Engine events per second relative to the reference, so values above 1 are faster
+    @property
+    def relative_throughput(
+        self
+    ) -> Optional[float]:
+        return self.reference_seconds / self.engine_seconds if self.engine_seconds > 0 else None
+
+#The baseline keeps each feature as {str(transaction_time): value}, the engines as a feature table
+def feature_changes(
+    order_book: Union[ob.OrderBook, bob.BaselineOrderBook],
+    column: str
+) -> pd.Series:
+    values_over_time = getattr(order_book, f"{column}_over_time")
+    return bob.feature_changes(values_over_time, column) if isinstance(values_over_time, dict) else values_over_time
+
+#First change at which two change series differ in time or value (NaN equal to NaN), including one running out of changes
+def first_divergent_row(
+    reference_changes: pd.Series,
+    engine_changes: pd.Series
+) -> Optional[int]:
+    common_rows = min(len(reference_changes), len(engine_changes))
+    reference_values = reference_changes.to_numpy(dtype=np.float64)[:common_rows]
+    engine_values = engine_changes.to_numpy(dtype=np.float64)[:common_rows]
+    same_values = (reference_values == engine_values) | (np.isnan(reference_values) & np.isnan(engine_values))
+    differs = (reference_changes.index.asi8[:common_rows] != engine_changes.index.asi8[:common_rows]) | ~same_values
+    if differs.any():
+        return int(np.argmax(differs))
+    if len(reference_changes) != len(engine_changes):
+        return common_rows
+    return None
+
+def change_at(
+    changes: pd.Series,
+    row: int
+) -> Tuple[Optional[int], Optional[Tuple[float, ...]]]:
+    if row >= len(changes):
+        return None, None
+    return int(changes.index.asi8[row]), (float(changes.iloc[row]),)
+
+#The earliest divergence across the feature change series, by transaction time
+def first_divergence(
+    reference_book: bob.BaselineOrderBook,
+    engine_book: ob.OrderBook
+) -> Optional[Divergence]:
+    divergences = []
+    for column in compared_features:
+        reference_changes = feature_changes(reference_book, column)
+        engine_changes = feature_changes(engine_book, column)
+        row = first_divergent_row(reference_changes, engine_changes)
+        if row is None:
+            continue
+        reference_time, reference_row = change_at(reference_changes, row)
+        engine_time, engine_row = change_at(engine_changes, row)
+        transaction_times = [time for time in (reference_time, engine_time) if time is not None]
+        divergences.append(Divergence(column, row, min(transaction_times), reference_row, engine_row))
+    return min(divergences, key=lambda divergence: divergence.transaction_time) if divergences else None
+
+#NaN prices and volumes become None so that equal orders compare equal
+def order_values(
+    orders_by_initial_id
+) -> Dict[int, Tuple]:
+    return {
+        int(initial_id): tuple(None if value != value else value for value in (order.price, order.available_volume))
+        for initial_id, order in orders_by_initial_id.items()
+    }
+
+#What is left resting or hibernated once the period is replayed; catches divergences that never reach a feature.
+#The baseline keeps no running hibernated volume, so the engine's is checked against the sum of the baseline's orders.
+def state_differences(
+    reference_book: bob.BaselineOrderBook,
+    engine_book: ob.OrderBook
+) -> Dict[str, Tuple]:
+    differences = {}
+    for side in replay.SIDES:
+        for state_name, orders_by_side in (('resting', 'orders'), ('hibernated', 'hibernated_orders')):
+            reference_orders = order_values(getattr(reference_book, orders_by_side)[side])
+            engine_orders = order_values(getattr(engine_book, orders_by_side)[side])
+            if reference_orders != engine_orders:
+                differing_ids = sorted(
+                    initial_id for initial_id in reference_orders.keys() | engine_orders.keys()
+                    if reference_orders.get(initial_id) != engine_orders.get(initial_id)
+                )
+                differences[f"{state_name}_{side.lower()}_orders"] = (len(reference_orders), len(engine_orders), differing_ids[:10])
+        reference_hibernated_volume = sum(order.available_volume for order in reference_book.hibernated_orders[side].values())
+        if not np.isclose(reference_hibernated_volume, engine_book.hibernated_volume[side]):
+            differences[f"hibernated_{side.lower()}_volume"] = (reference_hibernated_volume, engine_book.hibernated_volume[side])
+    return differences
+
+def describe_error(
+    error: Optional[Exception]
+) -> Optional[str]:
+    return None if error is None else f"{type(error).__name__}: {error}"
+
+#An engine that raises is a divergence like any other, so exceptions are returned rather than raised
+def timed_replay(
+    engine: Engine,
+    orders_one_delivery_period: pd.DataFrame
+) -> Tuple[Optional[Union[ob.OrderBook, bob.BaselineOrderBook]], float, Optional[Exception]]:
+    start_time = perf_counter()
+    try:
+        order_book, error = engine(orders_one_delivery_period), None
+    except Exception as raised:
+        order_book, error = None, raised
+    return order_book, perf_counter() - start_time, error
+
+#First transaction time whose events make the engine raise, found by replaying ever shorter prefixes (a binary search)
+def first_failing_transaction_time(
+    engine: Engine,
+    orders_one_delivery_period: pd.DataFrame
+) -> Optional[int]:
+    transaction_times = np.unique(orders_one_delivery_period['TransactionTime'].to_numpy(dtype='datetime64[ns]').view(np.int64))
+    if len(transaction_times) == 0:
+        return None
+    low, high = 0, len(transaction_times) - 1
+    while low < high:
+        middle = (low + high) // 2
+        prefix = orders_one_delivery_period[orders_one_delivery_period['TransactionTime'] <= pd.Timestamp(int(transaction_times[middle]), tz='UTC')]
+        if timed_replay(engine, prefix)[2] is None:
+            low = middle + 1
+        else:
+            high = middle
+    return int(transaction_times[low])
+
+#Both sides raising the same exception type counts as agreeing; raising on one side only, or differently, as diverging
+def exception_divergence(
+    engine: Engine,
+    orders_one_delivery_period: pd.DataFrame,
+    reference: Engine,
+    reference_error: Optional[Exception],
+    engine_error: Optional[Exception]
+) -> Optional[Divergence]:
+    if type(reference_error) is type(engine_error):
+        return None
+    failing_times = [
+        first_failing_transaction_time(failing_engine, orders_one_delivery_period)
+        for failing_engine, error in ((reference, reference_error), (engine, engine_error)) if error is not None
+    ]
+    failing_times = [failing_time for failing_time in failing_times if failing_time is not None]
+    errors = [f"{name} raised {describe_error(error)}" for name, error in (('reference', reference_error), ('engine', engine_error)) if error is not None]
+    return Divergence('exception', None, min(failing_times) if failing_times else None, None, None, '; '.join(errors))
+
+def diverges(
+    engine: Engine,
+    orders_one_delivery_period: pd.DataFrame,
+    reference: Engine = reference_engine
+) -> bool:
+    reference_book, _, reference_error = timed_replay(reference, orders_one_delivery_period)
+    engine_book, _, engine_error = timed_replay(engine, orders_one_delivery_period)
+    if reference_error is not None or engine_error is not None:
+        return type(reference_error) is not type(engine_error)
+    return first_divergence(reference_book, engine_book) is not None or bool(state_differences(reference_book, engine_book))
+
+#Cuts the events after the divergent transaction time, then removes whole orders (every event of an InitialId) in
+#shrinking chunks while the engines still disagree, as in delta debugging. Stops after max_checks replays of each engine.
+def minimise_divergent_events(
+    engine: Engine,
+    orders_one_delivery_period: pd.DataFrame,
+    divergent_transaction_time: Optional[int] = None,
+    reference: Engine = reference_engine,
+    max_checks: int = 200
+) -> pd.DataFrame:
+    orders = orders_one_delivery_period
+    if divergent_transaction_time is not None:
+        truncated = orders[orders['TransactionTime'] <= pd.Timestamp(divergent_transaction_time, tz='UTC')]
+        if diverges(engine, truncated, reference):
+            orders = truncated
+
+    initial_ids = pd.unique(orders['InitialId'])
+    chunks = 2
+    checks = 0
+    while len(initial_ids) >= 2 and checks < max_checks:
+        chunk_bounds = np.linspace(0, len(initial_ids), min(chunks, len(initial_ids)) + 1).astype(np.int64)
+        reduced = False
+        for start, stop in zip(chunk_bounds[:-1], chunk_bounds[1:]):
+            if checks >= max_checks:
+                break
+            remaining_ids = np.concatenate((initial_ids[:start], initial_ids[stop:]))
+            candidate = orders[orders['InitialId'].isin(remaining_ids)]
+            checks += 1
+            if diverges(engine, candidate, reference):
+                orders, initial_ids = candidate, remaining_ids
+                chunks = max(chunks - 1, 2)
+                reduced = True
+                break
+        if not reduced:
+            if chunks >= len(initial_ids):
+                break
+            chunks = min(chunks * 2, len(initial_ids))
+    print(f"Minimised to {len(orders)} events of {len(initial_ids)} orders after {checks} checks")
+    return orders
+
+#Written in the EPEX layout (one line before the header), so it reads back with ob_reconstruction.read_orders
+def write_repro_slice(
+    orders: pd.DataFrame,
+    output_filepath: str,
+    description: str
+) -> str:
+    os.makedirs(os.path.dirname(os.path.abspath(output_filepath)), exist_ok=True)
+    repro = orders.copy()
+    for column in ('TransactionTime', 'DeliveryStart'):
+        if pd.api.types.is_datetime64_any_dtype(repro[column]):
+            timestamps_ns = pd.Series(repro[column].dt.tz_convert('UTC').dt.tz_localize(None).to_numpy(dtype='datetime64[ns]').view(np.int64))
+            repro[column] = sd.format_timestamps(timestamps_ns, 'ms' if (timestamps_ns % 1_000_000 == 0).all() else 'ns')
+    sd.write_epex_csv(repro, output_filepath, description)
+    print(f"Saved reproducing events: {output_filepath}")
+    return output_filepath
+
+#The reference is replayed once and each engine diffed against it
+def compare_engines_one_delivery_period(
+    engines_to_compare: Dict[str, Engine],
+    orders_one_delivery_period: pd.DataFrame,
+    delivery_start: str,
+    reference: Engine = reference_engine,
+    repro_directory: Optional[str] = None
+) -> List[DifferentialResult]:
+    reference_book, reference_seconds, reference_error = timed_replay(reference, orders_one_delivery_period)
+    results = []
+    for engine_name, engine in engines_to_compare.items():
+        engine_book, engine_seconds, engine_error = timed_replay(engine, orders_one_delivery_period)
+        result = DifferentialResult(
+            engine_name=engine_name,
+            delivery_start=delivery_start,
+            events=len(orders_one_delivery_period),
+            reference_seconds=reference_seconds,
+            engine_seconds=engine_seconds
+        )
+        if reference_error is not None or engine_error is not None:
+            result.divergence = exception_divergence(engine, orders_one_delivery_period, reference, reference_error, engine_error)
+        else:
+            result.divergence = first_divergence(reference_book, engine_book)
+            result.state_differences = state_differences(reference_book, engine_book)
+        results.append(result)
+        if result.matches:
+            continue
+
+        divergent_time = result.divergence.transaction_time if result.divergence is not None else None
+        error = f" ({result.divergence.error})" if result.divergence is not None and result.divergence.error is not None else ''
+        print(f"{engine_name} diverges from the reference for {delivery_start} at {pd.Timestamp(divergent_time, tz='UTC') if divergent_time is not None else 'the end of the period'}{error}")
+        if repro_directory is not None:
+            repro_orders = minimise_divergent_events(engine, orders_one_delivery_period, divergent_time, reference)
+            result.repro_filepath = write_repro_slice(
+                repro_orders,
+                os.path.join(repro_directory, f"{engine_name}_{delivery_start.replace(':', '_')}_repro.csv"),
+                f"Events on which {engine_name} diverges from the reference replay, delivery start {delivery_start}"
+            )
+    return results
+
+def results_to_dataframe(
+    results: List[DifferentialResult]
+) -> pd.DataFrame:
+    return pd.DataFrame([
+        {
+            'engine': result.engine_name,
+            'delivery_start': result.delivery_start,
+            'events': result.events,
+            'matches': result.matches,
+            'divergent_table': result.divergence.table if result.divergence is not None else None,
+            'divergent_row': result.divergence.row if result.divergence is not None else None,
+            'divergent_transaction_time': pd.Timestamp(result.divergence.transaction_time, tz='UTC') if result.divergence is not None and result.divergence.transaction_time is not None else pd.NaT,
+            'error': result.divergence.error if result.divergence is not None else None,
+            'state_differences': '; '.join(f"{name}: {values}" for name, values in result.state_differences.items()),
+            'reference_seconds': result.reference_seconds,
+            'engine_seconds': result.engine_seconds,
+            'relative_throughput': result.relative_throughput,
+            'repro_filepath': result.repro_filepath
+        }
+        for result in results
+    ])
+
+#Replays every delivery period of one product with the reference and each engine and diffs the books
+def run_differential_replay(
+    orders_csv_filepath: str,
+    product_name: str,
+    engines_to_compare: Optional[Dict[str, Engine]] = None,
+    delivery_starts: Optional[List[str]] = None,
+    repro_directory: Optional[str] = None,
+    cache_directory: Optional[str] = None
+) -> pd.DataFrame:
+    engines_to_compare = engines if engines_to_compare is None else engines_to_compare
+    orders = ob_reconstruction.read_orders(orders_csv_filepath, product_name, cache_directory, delivery_starts)
+    results = []
+    for delivery_start, orders_one_delivery_period in orders.groupby('DeliveryStart', sort=True):
+        results += compare_engines_one_delivery_period(engines_to_compare, orders_one_delivery_period, delivery_start, repro_directory=repro_directory)
+
+    results = results_to_dataframe(results)
+    for engine_name, engine_results in results.groupby('engine', sort=False):
+        throughput = engine_results['reference_seconds'].sum() / engine_results['engine_seconds'].sum()
+        print(f"{engine_name}: {int(engine_results['matches'].sum())} of {len(engine_results)} delivery periods match the reference, {throughput:.1f}x its throughput")
+    return results
+
+#The time-weighted spread a book accumulates on its feature grid against the one aggregate_spreads computes from the
+#spread's changes, held to the same end; returns the first bucket where they disagree
+def time_weighted_spread_divergence(
+    order_book: ob.OrderBook,
+    delivery_start: str,
+    tolerance: float = 1e-9
+) -> Optional[pd.Timestamp]:
+    grid = order_book.feature_grid_to_dataframe()['bid_ask_spread']
+    if order_book.feature_grid.last_time is None:
+        return None
+    from_changes = tb.aggregate_spreads(
+        {delivery_start: order_book.bid_ask_spread_over_time},
+        pd.Timedelta(order_book.feature_grid.bucket_width_ns),
+        end_times={delivery_start: pd.Timestamp(order_book.feature_grid.last_time, tz='UTC')},
+        fill_empty_buckets=False
+    ).set_index('bucket_start')['time_weighted_spread'].reindex(grid.index)
+    agrees = np.isclose(grid.to_numpy(), from_changes.to_numpy(), rtol=tolerance, atol=tolerance, equal_nan=True)
+    return None if agrees.all() else grid.index[int(np.argmin(agrees))]
+
+def check_time_weighted_spreads(
+    orders_csv_filepath: str,
+    product_name: str,
+    bucket_width: str = '5min',
+    delivery_starts: Optional[List[str]] = None,
+    cache_directory: Optional[str] = None
+) -> Dict[str, Optional[pd.Timestamp]]:
+    encoded_orders_by_delivery_start = replay.encode_orders_by_delivery_start(ob_reconstruction.read_orders(orders_csv_filepath, product_name, cache_directory, delivery_starts))
+    divergent_buckets = {}
+    for delivery_start, encoded_orders in encoded_orders_by_delivery_start.items():
+        order_book = replay.replay_delivery_period(encoded_orders, feature_grid_width=bucket_width)
+        divergent_buckets[delivery_start] = time_weighted_spread_divergence(order_book, delivery_start)
+        if divergent_buckets[delivery_start] is not None:
+            print(f"Feature grid and spread changes give different time-weighted spreads for {delivery_start} from {divergent_buckets[delivery_start]}")
+    matching = sum(divergent_bucket is None for divergent_bucket in divergent_buckets.values())
+    print(f"feature grid: {matching} of {len(divergent_buckets)} delivery periods match the time-weighted spread from changes")
+    return divergent_buckets
+
+def run_synthetic_differential_replay(
+    config: sd.SyntheticMarketConfig,
+    data_directory: str,
+    engines_to_compare: Optional[Dict[str, Engine]] = None,
+    repro_directory: Optional[str] = None
+) -> pd.DataFrame:
+    orders_csv_filepath, _ = sd.write_synthetic_day(data_directory, config)
+    return run_differential_replay(orders_csv_filepath, config.product_name, engines_to_compare, repro_directory=repro_directory)
+
+def main():
+    parser = argparse.ArgumentParser(description='Diff the replay engines against the frozen original OrderBook replay, delivery period by delivery period.')
+    parser.add_argument('--output', help='CSV file to write one row per engine and delivery period to')
+    parser.add_argument('--orders', help='Continuous_Orders CSV; synthetic data is generated when omitted')
+    parser.add_argument('--product', default='GB_Half_Hour_Power')
+    parser.add_argument('--engines', default=','.join(engines), help=f"Comma separated, from {', '.join(engines)}")
+    parser.add_argument('--delivery-start', action='append', help='Only compare these delivery periods, e.g. 2024-01-26T08:30:00Z')
+    parser.add_argument('--repro-directory', help='Where minimised reproducing events are written for diverging periods')
+    parser.add_argument('--cache-directory')
+    parser.add_argument('--feature-grid-width', default='5min', help='Bucket width at which the feature grid is checked against the spread changes')
+    parser.add_argument('--data-directory', help='Where synthetic files are written', default=os.path.join(tempfile.gettempdir(), 'epex_synthetic'))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--delivery-periods', type=int, default=4)
+    parser.add_argument('--events-per-period', type=int, default=2_000)
+    parser.add_argument('--crossed-book-probability', type=float, default=0.05)
+    arguments = parser.parse_args()
+
+    engines_to_compare = {engine_name: engines[engine_name] for engine_name in arguments.engines.split(',')}
+    orders_csv_filepath = arguments.orders
+    if orders_csv_filepath is None:
+        config = sd.SyntheticMarketConfig(
+            seed=arguments.seed,
+            product_name=arguments.product,
+            number_of_delivery_periods=arguments.delivery_periods,
+            events_per_period=arguments.events_per_period,
+            crossed_book_probability=arguments.crossed_book_probability
+        )
+        orders_csv_filepath, _ = sd.write_synthetic_day(arguments.data_directory, config)
+    results = run_differential_replay(orders_csv_filepath, arguments.product, engines_to_compare, arguments.delivery_start, arguments.repro_directory, arguments.cache_directory)
+    divergent_buckets = check_time_weighted_spreads(orders_csv_filepath, arguments.product, arguments.feature_grid_width, arguments.delivery_start, arguments.cache_directory)
+
+    if arguments.output is not None:
+        results.to_csv(arguments.output, index=False)
+    if not results['matches'].all() or any(divergent_bucket is not None for divergent_bucket in divergent_buckets.values()):
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import numpy as np
+from typing import Tuple
+
+downsampling_methods = ('min_max', 'lttb')
+
+#Keeps the first, last, lowest and highest point of each of `buckets` equal-width time buckets, in time order,
+#so every spike survives however many points are dropped. Suited to step series such as the spread.
+def min_max_downsample(
+    times: np.ndarray,
+    values: np.ndarray,
+    buckets: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    if len(times) <= 4 * buckets or buckets < 1:
+        return times, values
+    span = int(times[-1] - times[0]) + 1
+    bucket_codes = ((times - times[0]).astype(np.float64) * buckets / span).astype(np.int64)
+
+    bucket_starts = np.flatnonzero(np.concatenate(([True], bucket_codes[1:] != bucket_codes[:-1])))
+    bucket_ends = np.append(bucket_starts[1:], len(times)) - 1
+    #Sorted by bucket then value, the first row of each bucket is its minimum and the last its maximum
+    by_value = np.lexsort((values, bucket_codes))
+    keep = np.unique(np.concatenate((bucket_starts, bucket_ends, by_value[bucket_starts], by_value[bucket_ends])))
+    return times[keep], values[keep]
+
+#Largest-Triangle-Three-Buckets: keeps `points` points, choosing in each bucket the one forming the largest triangle
+#with the point kept before it and the mean of the next bucket
+def lttb_downsample(
+    times: np.ndarray,
+    values: np.ndarray,
+    points: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    if len(times) <= points or points < 3:
+        return times, values
+    x = (times - times[0]).astype(np.float64)
+    y = values.astype(np.float64)
+    bucket_size = (len(times) - 2) / (points - 2)
+    bucket_bounds = (np.arange(points - 1) * bucket_size).astype(np.int64) + 1
+    bucket_bounds[-1] = len(times) - 1
+
+    keep = np.empty(points, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = len(times) - 1
+    previous = 0
+    for bucket in range(points - 2):
+        start, end = bucket_bounds[bucket], bucket_bounds[bucket + 1]
+        next_end = bucket_bounds[bucket + 2] if bucket + 2 < len(bucket_bounds) else len(times)
+        next_x = x[end:next_end].mean()
+        next_y = y[end:next_end].mean()
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous]) - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        keep[bucket + 1] = previous
+    return times[keep], values[keep]
+
+def downsample(
+    times: np.ndarray,
+    values: np.ndarray,
+    method: str,
+    points: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    if method == 'min_max':
+        return min_max_downsample(times, values, points)
+    if method == 'lttb':
+        return lttb_downsample(times, values, points)
+    raise ValueError(f"Unknown downsampling method {method}, expected one of {downsampling_methods}.")
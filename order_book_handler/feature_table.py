@@ -0,0 +1,269 @@
+import numpy as np
+import pandas as pd
+from typing import Sequence, Tuple
+
+def to_nanoseconds(
+    timestamps: pd.Series
+) -> np.ndarray:
+    if pd.api.types.is_integer_dtype(timestamps.dtype):
+        return timestamps.to_numpy(dtype=np.int64)
+    return pd.to_datetime(timestamps, utc=True).dt.as_unit('ns').to_numpy(dtype=np.int64)
+
+#Append-only table of float64 feature columns against int64 nanosecond UTC timestamps.
+#Views returned by timestamps/column/to_dataframe share memory with the table and stay valid until it next grows.
+class FeatureTable:
+    def __init__(
+        self,
+        columns: Sequence[str],
+        initial_capacity: int = 1024
+    ):
+        self.columns = tuple(columns)
+        self.column_index = {column: i for i, column in enumerate(self.columns)}
+        self._timestamps = np.empty(initial_capacity, dtype=np.int64)
+        self._values = np.empty((len(self.columns), initial_capacity), dtype=np.float64)
+        self.size = 0
+
+    def __len__(
+        self
+    ) -> int:
+        return self.size
+
+    def __getstate__(
+        self
+    ):
+        return self.columns, self.timestamps.copy(), self.values.copy()
+
+    def __setstate__(
+        self,
+        state
+    ):
+        columns, timestamps, values = state
+        self.__init__(columns, max(len(timestamps), 1))
+        self._timestamps[:len(timestamps)] = timestamps
+        self._values[:, :len(timestamps)] = values
+        self.size = len(timestamps)
+
+    def append(
+        self,
+        timestamp: int,
+        values: Tuple[float, ...]
+    ):
+        if self.size == len(self._timestamps):
+            self._grow()
+        self._timestamps[self.size] = timestamp
+        self._values[:, self.size] = values
+        self.size += 1
+
+    def _grow(
+        self
+    ):
+        capacity = 2 * len(self._timestamps)
+        timestamps = np.empty(capacity, dtype=np.int64)
+        timestamps[:self.size] = self._timestamps[:self.size]
+        values = np.empty((len(self.columns), capacity), dtype=np.float64)
+        values[:, :self.size] = self._values[:, :self.size]
+        self._timestamps = timestamps
+        self._values = values
+
+    @property
+    def timestamps(
+        self
+    ) -> np.ndarray:
+        return self._timestamps[:self.size]
+
+    @property
+    def values(
+        self
+    ) -> np.ndarray:
+        return self._values[:, :self.size]
+
+    def column(
+        self,
+        column: str
+    ) -> np.ndarray:
+        return self._values[self.column_index[column], :self.size]
+
+    def index_range(
+        self,
+        start: int,
+        stop: int
+    ) -> Tuple[int, int]:
+        timestamps = self.timestamps
+        return int(np.searchsorted(timestamps, start, side='left')), int(np.searchsorted(timestamps, stop, side='left'))
+
+    #Row of the last update strictly before each query time, -1 where there is none
+    def rows_before(
+        self,
+        query_timestamps: np.ndarray
+    ) -> np.ndarray:
+        return np.searchsorted(self.timestamps, query_timestamps, side='left') - 1
+
+    def to_dataframe(
+        self
+    ) -> pd.DataFrame:
+        features = pd.DataFrame(
+            self.values.T,
+            index=pd.DatetimeIndex(self.timestamps.view('datetime64[ns]'), name='transaction_time').tz_localize('UTC'),
+            columns=list(self.columns),
+            copy=False
+        )
+        return features
+
+    #Rows where the column differs from the one before it, i.e. the points at which that feature changed
+    def changes(
+        self,
+        column: str,
+        initial_value: float
+    ) -> pd.Series:
+        values = self.column(column)
+        changed = np.empty(len(values), dtype=bool)
+        if len(values) > 0:
+            changed[0] = values[0] != initial_value
+            changed[1:] = values[1:] != values[:-1]
+        return pd.Series(
+            values[changed],
+            index=pd.DatetimeIndex(self.timestamps[changed].view('datetime64[ns]'), name='transaction_time').tz_localize('UTC'),
+            name=column
+        )
+
+#Time-weighted integrals of feature columns on a fixed grid of bucket_width_ns buckets aligned to midnight UTC.
+#Each value is held from its update time until the next update (or advance_to), so an update costs O(1) however long the hold.
+#Time a column spends at NaN (e.g. the spread of a one-sided book) is left out of both its integral and its duration.
+class FeatureGrid:
+    def __init__(
+        self,
+        columns: Sequence[str],
+        bucket_width_ns: int,
+        initial_capacity: int = 64
+    ):
+        self.columns = tuple(columns)
+        self.bucket_width_ns = int(bucket_width_ns)
+        self._integrals = np.zeros((len(self.columns), initial_capacity), dtype=np.float64)
+        self._durations = np.zeros(initial_capacity, dtype=np.int64)
+        self._valid_durations = np.zeros((len(self.columns), initial_capacity), dtype=np.int64)
+        self.first_bucket = None
+        self.buckets_flushed = 0
+        self.current_bucket = None
+        self.current_integrals = [0.0] * len(self.columns)
+        self.current_valid_durations = [0] * len(self.columns)
+        self.current_duration = 0
+        self.last_time = None
+        self.last_values = None
+
+    def update(
+        self,
+        transaction_time: int,
+        values: Tuple[float, ...]
+    ):
+        if self.last_time is None:
+            self.first_bucket = self.current_bucket = transaction_time // self.bucket_width_ns
+            self.last_time = transaction_time
+        else:
+            self.advance_to(transaction_time)
+        self.last_values = values
+
+    #Holds the last values up to transaction_time without changing them
+    def advance_to(
+        self,
+        transaction_time: int
+    ):
+        if self.last_time is None or transaction_time <= self.last_time:
+            return
+        bucket = transaction_time // self.bucket_width_ns
+        if bucket == self.current_bucket:
+            self.hold(transaction_time - self.last_time)
+            self.last_time = transaction_time
+            return
+
+        self.hold((self.current_bucket + 1) * self.bucket_width_ns - self.last_time)
+        self.flush_current_bucket()
+        full_buckets = bucket - self.current_bucket - 1
+        if full_buckets > 0:
+            start = self.current_bucket + 1 - self.first_bucket
+            self.reserve(start + full_buckets)
+            last_values = np.array(self.last_values, dtype=np.float64)[:, None]
+            valid = ~np.isnan(last_values)
+            self._integrals[:, start:start + full_buckets] = np.where(valid, last_values * self.bucket_width_ns, 0.0)
+            self._valid_durations[:, start:start + full_buckets] = np.where(valid, self.bucket_width_ns, 0)
+            self._durations[start:start + full_buckets] = self.bucket_width_ns
+            self.buckets_flushed = start + full_buckets
+        self.current_bucket = bucket
+        self.current_integrals = [0.0] * len(self.columns)
+        self.current_valid_durations = [0] * len(self.columns)
+        self.current_duration = 0
+        self.hold(transaction_time - bucket * self.bucket_width_ns)
+        self.last_time = transaction_time
+
+    def hold(
+        self,
+        duration: int
+    ):
+        self.current_duration += duration
+        self.current_integrals = [
+            integral + value * duration if value == value else integral
+            for integral, value in zip(self.current_integrals, self.last_values)
+        ]
+        self.current_valid_durations = [
+            valid_duration + duration if value == value else valid_duration
+            for valid_duration, value in zip(self.current_valid_durations, self.last_values)
+        ]
+
+    def flush_current_bucket(
+        self
+    ):
+        index = self.current_bucket - self.first_bucket
+        self.reserve(index + 1)
+        self._integrals[:, index] = self.current_integrals
+        self._valid_durations[:, index] = self.current_valid_durations
+        self._durations[index] = self.current_duration
+        self.buckets_flushed = index + 1
+
+    def reserve(
+        self,
+        buckets: int
+    ):
+        if buckets <= len(self._durations):
+            return
+        capacity = max(buckets, 2 * len(self._durations))
+        integrals = np.zeros((len(self.columns), capacity), dtype=np.float64)
+        integrals[:, :self.buckets_flushed] = self._integrals[:, :self.buckets_flushed]
+        valid_durations = np.zeros((len(self.columns), capacity), dtype=np.int64)
+        valid_durations[:, :self.buckets_flushed] = self._valid_durations[:, :self.buckets_flushed]
+        durations = np.zeros(capacity, dtype=np.int64)
+        durations[:self.buckets_flushed] = self._durations[:self.buckets_flushed]
+        self._integrals = integrals
+        self._valid_durations = valid_durations
+        self._durations = durations
+
+    #Time-weighted mean of each column per bucket over the time it was not NaN, and the seconds of the bucket the grid covers;
+    #NaN where a column had no value in the bucket
+    def to_dataframe(
+        self
+    ) -> pd.DataFrame:
+        if self.first_bucket is None:
+            return pd.DataFrame(
+                columns=list(self.columns) + ['covered_seconds'],
+                index=pd.DatetimeIndex([], dtype='datetime64[ns, UTC]', name='bucket_start'),
+                dtype=np.float64
+            )
+        bucket_count = self.current_bucket - self.first_bucket + 1
+        integrals = np.zeros((len(self.columns), bucket_count), dtype=np.float64)
+        integrals[:, :self.buckets_flushed] = self._integrals[:, :self.buckets_flushed]
+        integrals[:, bucket_count - 1] = self.current_integrals
+        valid_durations = np.zeros((len(self.columns), bucket_count), dtype=np.int64)
+        valid_durations[:, :self.buckets_flushed] = self._valid_durations[:, :self.buckets_flushed]
+        valid_durations[:, bucket_count - 1] = self.current_valid_durations
+        durations = np.zeros(bucket_count, dtype=np.int64)
+        durations[:self.buckets_flushed] = self._durations[:self.buckets_flushed]
+        durations[bucket_count - 1] = self.current_duration
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = np.where(valid_durations > 0, integrals / valid_durations, np.nan)
+        bucket_starts = (np.arange(self.first_bucket, self.current_bucket + 1, dtype=np.int64) * self.bucket_width_ns).view('datetime64[ns]')
+        grid = pd.DataFrame(
+            means.T,
+            index=pd.DatetimeIndex(bucket_starts, name='bucket_start').tz_localize('UTC'),
+            columns=list(self.columns)
+        )
+        grid['covered_seconds'] = durations / 1e9
+        return grid
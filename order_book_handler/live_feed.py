@@ -0,0 +1,289 @@
+import csv
+import asyncio
+import numpy as np
+import pandas as pd
+import order_book_handler.order_book as ob
+import order_book_handler.order as o
+from collections import deque
+from dataclasses import dataclass
+from time import perf_counter_ns
+from typing import AsyncIterator, Deque, Dict, List, Optional, Sequence, Tuple
+
+@dataclass(slots=True)
+class OrderEvent:
+    initial_id : int
+    side : str
+    action_code : str
+    price : float
+    volume : float
+    received_at_ns : int
+
+@dataclass(slots=True)
+class FeatureUpdate:
+    delivery_start : str
+    transaction_time : int
+    best_bid : float
+    best_ask : float
+    bid_ask_spread : float
+    mid_price : float
+    relative_bid_ask_spread : float
+
+#Events for a delivery period are buffered until the feed's transaction time moves on, then applied as one group,
+#in the same InitialId order and with the same recalculation check as the replay engine. Events the book cannot apply
+#(e.g. deleting an order placed before the feed was joined) are counted and logged rather than stopping the feed.
+class LiveOrderBooks:
+    def __init__(
+        self,
+        product_name: str,
+        latency_sample_size: int = 100_000
+    ):
+        self.product_name = product_name
+        self.order_books : Dict[str, ob.OrderBook] = {}
+        self.pending_events : Dict[str, Tuple[int, List[OrderEvent]]] = {}
+        self.subscribers : List[asyncio.Queue] = []
+        self.latencies_ns : Deque[int] = deque(maxlen=latency_sample_size)
+        self.events_processed = 0
+        self.events_failed = 0
+        self.latest_transaction_time = None
+
+    def subscribe(
+        self
+    ) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        self.subscribers.append(queue)
+        return queue
+
+    def unsubscribe(
+        self,
+        queue: asyncio.Queue
+    ):
+        self.subscribers.remove(queue)
+
+    def add_event(
+        self,
+        row: Dict[str, str],
+        received_at_ns: int
+    ):
+        if row['Product'] != self.product_name:
+            return
+        delivery_start = row['DeliveryStart']
+        transaction_time = pd.Timestamp(row['TransactionTime']).value
+        #The feed is in transaction time order, so every period still waiting on an older time is complete
+        if self.latest_transaction_time is None or transaction_time > self.latest_transaction_time:
+            self.flush_older_than(transaction_time)
+            self.latest_transaction_time = transaction_time
+        pending = self.pending_events.get(delivery_start)
+        if pending is not None and pending[0] != transaction_time:
+            self.flush(delivery_start)
+            pending = None
+        if pending is None:
+            pending = (transaction_time, [])
+            self.pending_events[delivery_start] = pending
+        pending[1].append(OrderEvent(
+            initial_id=int(row['InitialId']),
+            side=row['Side'],
+            action_code=row['ActionCode'],
+            price=float(row['Price']) if row['Price'] else float('nan'),
+            volume=float(row['Volume']) if row['Volume'] else float('nan'),
+            received_at_ns=received_at_ns
+        ))
+
+    def flush(
+        self,
+        delivery_start: str
+    ):
+        transaction_time, events = self.pending_events.pop(delivery_start)
+        order_book = self.order_books.get(delivery_start)
+        if order_book is None:
+            order_book = ob.OrderBook()
+            self.order_books[delivery_start] = order_book
+        feature_updates_before = order_book.feature_updates
+
+        buy_prices = []
+        sell_prices = []
+        side_by_initial_id = {}
+        events_failed = 0
+        for event in sorted(events, key=lambda event: event.initial_id):
+            side = side_by_initial_id.setdefault(event.initial_id, event.side)
+            try:
+                order_book.action_code_to_action[event.action_code](
+                    order_book,
+                    o.Order(initial_id=event.initial_id, price=event.price, available_volume=event.volume),
+                    side
+                )
+            except Exception as error:
+                self.record_failed_event(error, f"{delivery_start} {event}")
+                events_failed += 1
+                continue
+            (buy_prices if side == 'BUY' else sell_prices).append(event.price)
+
+        # np.max/np.min propagate NaN prices exactly as the replay engine's reduceat does
+        highest_buy_price = np.max(buy_prices, initial=-np.inf)
+        lowest_sell_price = np.min(sell_prices, initial=np.inf)
+        if order_book.current_best_bid <= highest_buy_price or order_book.current_best_ask >= lowest_sell_price:
+            order_book.calculate_order_book_features(transaction_time)
+            order_book.recalculations_triggered += 1
+        else:
+            order_book.recalculations_skipped += 1
+
+        processed_at_ns = perf_counter_ns()
+        self.latencies_ns.extend(processed_at_ns - event.received_at_ns for event in events)
+        self.events_processed += len(events) - events_failed
+
+        if order_book.feature_updates > feature_updates_before:
+            self.publish(FeatureUpdate(
+                delivery_start,
+                transaction_time,
+                order_book.current_best_bid,
+                order_book.current_best_ask,
+                order_book.current_bid_ask_spread,
+                order_book.current_mid_price,
+                order_book.current_relative_bid_ask_spread
+            ))
+
+    def flush_older_than(
+        self,
+        transaction_time: int
+    ):
+        for delivery_start, (pending_transaction_time, _) in list(self.pending_events.items()):
+            if pending_transaction_time < transaction_time:
+                self.flush(delivery_start)
+
+    def flush_all(
+        self
+    ):
+        for delivery_start in list(self.pending_events.keys()):
+            self.flush(delivery_start)
+
+    def record_failed_event(
+        self,
+        error: Exception,
+        event_description: str
+    ):
+        self.events_failed += 1
+        print(f"Skipped live event ({type(error).__name__}: {error}): {event_description}")
+
+    def publish(
+        self,
+        update: FeatureUpdate
+    ):
+        for queue in self.subscribers:
+            queue.put_nowait(update)
+
+    def latency_percentiles(
+        self,
+        percentiles: Sequence[float] = (50, 90, 99, 99.9)
+    ) -> Dict[str, float]:
+        if not self.latencies_ns:
+            return {}
+        values = np.percentile(np.fromiter(self.latencies_ns, dtype=np.int64, count=len(self.latencies_ns)), percentiles)
+        return {f"p{percentile:g}_us": value / 1000 for percentile, value in zip(percentiles, values)}
+
+async def tail_csv_file(
+    filepath: str,
+    poll_interval: float = 0.1,
+    stop_event: Optional[asyncio.Event] = None
+) -> AsyncIterator[str]:
+    with open(filepath, newline='') as file:
+        partial_line = ''
+        while stop_event is None or not stop_event.is_set():
+            line = file.readline()
+            if not line:
+                await asyncio.sleep(poll_interval)
+                continue
+            partial_line += line
+            if partial_line.endswith('\n'):
+                yield partial_line
+                partial_line = ''
+
+async def read_socket_lines(
+    host: str,
+    port: int
+) -> AsyncIterator[str]:
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            yield line.decode()
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+#Stand-in for the live feed: streams an orders CSV to every client that connects, optionally at a fixed event rate
+async def serve_csv_replay(
+    orders_csv_filepath: str,
+    host: str = '127.0.0.1',
+    port: int = 0,
+    events_per_second: Optional[float] = None
+) -> asyncio.AbstractServer:
+    async def stream_file(
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter
+    ):
+        with open(orders_csv_filepath, 'rb') as file:
+            for line in file:
+                writer.write(line)
+                if events_per_second is not None:
+                    await writer.drain()
+                    await asyncio.sleep(1 / events_per_second)
+        await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+
+    return await asyncio.start_server(stream_file, host, port)
+
+async def consume_order_events(
+    lines: AsyncIterator[str],
+    live_order_books: LiveOrderBooks,
+    flush_after_seconds: float = 1.0,
+    max_queued_lines: int = 10_000
+):
+    #Bounded so a fast source is held back by the socket/file rather than buffering without limit; queueing time counts towards latency
+    line_queue = asyncio.Queue(maxsize=max_queued_lines)
+
+    async def read_lines():
+        async for line in lines:
+            await line_queue.put((line, perf_counter_ns()))
+        await line_queue.put(None)
+
+    reader_task = asyncio.create_task(read_lines())
+    header = None
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(line_queue.get(), timeout=flush_after_seconds)
+            except asyncio.TimeoutError:
+                live_order_books.flush_all()
+                continue
+            if item is None:
+                break
+
+            line, received_at_ns = item
+            values = next(csv.reader([line]), None)
+            if not values:
+                continue
+            #The EPEX files carry one line before the header (read_csv(header=1) elsewhere), so wait for the real header
+            if header is None:
+                if 'InitialId' in values:
+                    header = values
+                continue
+            try:
+                live_order_books.add_event(dict(zip(header, values)), received_at_ns)
+            except Exception as error:
+                live_order_books.record_failed_event(error, line.strip())
+    finally:
+        reader_task.cancel()
+        live_order_books.flush_all()
+
+async def run_live_feed(
+    lines: AsyncIterator[str],
+    product_name: str,
+    flush_after_seconds: float = 1.0
+) -> LiveOrderBooks:
+    live_order_books = LiveOrderBooks(product_name)
+    await consume_order_events(lines, live_order_books, flush_after_seconds)
+    print(f"Processed {live_order_books.events_processed} live events ({live_order_books.events_failed} skipped) across {len(live_order_books.order_books)} delivery periods")
+    print(f"Event latency (us): {live_order_books.latency_percentiles()}")
+    return live_order_books
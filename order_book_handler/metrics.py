@@ -0,0 +1,158 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+import order_book_handler.order_book as ob
+import order_book_handler.replay_engine as replay
+from contextlib import contextmanager, nullcontext
+from dataclasses import asdict, dataclass
+from time import perf_counter
+from typing import Dict, Optional
+
+@dataclass(slots=True)
+class DeliveryPeriodMetrics:
+    delivery_start : str
+    wall_time_seconds : float
+    events : int
+    transaction_times : int
+    events_by_action_code : Dict[str, int]
+    recalculations_triggered : int
+    recalculations_skipped : int
+    feature_updates : int
+    crossed_books_resolved : int
+    crossed_levels_skipped : int
+    unresolved_crossed_books : int
+    open_orders : int
+    hibernated_orders : int
+    product : Optional[str] = None
+
+#Built where the book lives, so a worker can send back this summary instead of the book itself
+def delivery_period_metrics(
+    delivery_start_time: str,
+    encoded_orders: replay.EncodedOrders,
+    order_book: ob.OrderBook,
+    wall_time_seconds: float,
+    product_name: Optional[str] = None
+) -> DeliveryPeriodMetrics:
+    action_code_counts = np.bincount(encoded_orders.action_codes, minlength=len(replay.ACTION_CODES)).tolist()
+    return DeliveryPeriodMetrics(
+        delivery_start=delivery_start_time,
+        wall_time_seconds=wall_time_seconds,
+        events=len(encoded_orders),
+        transaction_times=len(encoded_orders.transaction_times),
+        events_by_action_code=dict(zip(replay.ACTION_CODES, action_code_counts)),
+        recalculations_triggered=order_book.recalculations_triggered,
+        recalculations_skipped=order_book.recalculations_skipped,
+        feature_updates=order_book.feature_updates,
+        crossed_books_resolved=len(order_book.crossed_levels_skipped),
+        crossed_levels_skipped=int(order_book.crossed_levels_skipped.column('levels_skipped').sum()),
+        unresolved_crossed_books=order_book.unresolved_crossed_books,
+        open_orders=len(order_book.orders['BUY']) + len(order_book.orders['SELL']),
+        hibernated_orders=len(order_book.hibernated_orders['BUY']) + len(order_book.hibernated_orders['SELL']),
+        product=product_name
+    )
+
+#Everything is recorded once per stage or per delivery period from state the replay keeps anyway, so nothing is added per event
+class ReconstructionMetrics:
+    def __init__(
+        self,
+        enabled: bool = True
+    ):
+        self.enabled = enabled
+        self.stage_wall_times : Dict[str, float] = {}
+        self.stage_calls : Dict[str, int] = {}
+        self.counters : Dict[str, int] = {}
+        self.delivery_periods : Dict[str, DeliveryPeriodMetrics] = {}
+
+    @contextmanager
+    def stage(
+        self,
+        stage_name: str
+    ):
+        if not self.enabled:
+            yield
+            return
+        start_time = perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_wall_times[stage_name] = self.stage_wall_times.get(stage_name, 0.0) + perf_counter() - start_time
+            self.stage_calls[stage_name] = self.stage_calls.get(stage_name, 0) + 1
+
+    def increment(
+        self,
+        counter_name: str,
+        value: int = 1
+    ):
+        if self.enabled:
+            self.counters[counter_name] = self.counters.get(counter_name, 0) + value
+
+    def record_delivery_period(
+        self,
+        delivery_start_time: str,
+        encoded_orders: replay.EncodedOrders,
+        order_book: ob.OrderBook,
+        wall_time_seconds: float,
+        product_name: Optional[str] = None
+    ):
+        if self.enabled:
+            self.add_delivery_period(delivery_period_metrics(delivery_start_time, encoded_orders, order_book, wall_time_seconds, product_name))
+
+    def add_delivery_period(
+        self,
+        period_metrics: DeliveryPeriodMetrics
+    ):
+        if not self.enabled:
+            return
+        key = period_metrics.delivery_start if period_metrics.product is None else (period_metrics.product, period_metrics.delivery_start)
+        self.delivery_periods[key] = period_metrics
+
+    def to_dict(
+        self
+    ) -> Dict:
+        return {
+            'stages': {
+                stage_name: {'wall_time_seconds': wall_time, 'calls': self.stage_calls[stage_name]}
+                for stage_name, wall_time in self.stage_wall_times.items()
+            },
+            'counters': dict(self.counters),
+            'delivery_periods': [asdict(period_metrics) for period_metrics in self.delivery_periods.values()]
+        }
+
+    def delivery_periods_to_dataframe(
+        self
+    ) -> pd.DataFrame:
+        rows = []
+        for period_metrics in self.delivery_periods.values():
+            row = asdict(period_metrics)
+            for action_code, count in row.pop('events_by_action_code').items():
+                row[f"events_{action_code}"] = count
+            rows.append(row)
+        if not rows:
+            return pd.DataFrame()
+        delivery_periods = pd.DataFrame(rows)
+        if delivery_periods['product'].isna().all():
+            return delivery_periods.drop(columns='product').set_index('delivery_start')
+        return delivery_periods.set_index(['product', 'delivery_start'])
+
+    def save_json(
+        self,
+        output_filepath: str
+    ):
+        os.makedirs(os.path.dirname(os.path.abspath(output_filepath)), exist_ok=True)
+        with open(output_filepath, 'w') as output_file:
+            json.dump(self.to_dict(), output_file, indent=2)
+
+    def save_csv(
+        self,
+        output_filepath: str
+    ):
+        os.makedirs(os.path.dirname(os.path.abspath(output_filepath)), exist_ok=True)
+        self.delivery_periods_to_dataframe().to_csv(output_filepath)
+
+#Lets callers time a stage without checking whether they were given a metrics object
+def stage(
+    metrics: Optional[ReconstructionMetrics],
+    stage_name: str
+):
+    return metrics.stage(stage_name) if metrics is not None else nullcontext()
@@ -1,12 +1,21 @@
 import pandas as pd
 import numpy as np
 import order_book_handler.order as order
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
+import order_book_handler.price_levels as pl
+import order_book_handler.feature_table as ft
+from typing import Optional, Tuple
 
 class OrderBook:
+    feature_columns = ('best_bid', 'best_ask', 'bid_ask_spread', 'mid_price', 'relative_bid_ask_spread')
+    #TODO - issues with some of these numbers being negative
+    initial_feature_values = (-10000, 10000, 20000, 100000, 0)
+    
     def __init__(
-        self
+        self,
+        depth_levels: int = 0,
+        depth_price_band: Optional[float] = None,
+        feature_grid_width: Optional[str] = None,
+        record_feature_changes: bool = True
     ):
         self.orders = {
             'BUY': {},
@@ -17,37 +26,145 @@ class OrderBook:
             'BUY': {},
             'SELL': {}
         }
-        #TODO - issues with some of these numbers being negative
-        self.current_best_bid = -10000
-        self.current_best_ask = 10000
-        self.current_bid_ask_spread = 20000
-        self.current_mid_price = 100000
-        self.current_relative_bid_ask_spread = 0
         
-        self.best_bid_over_time = {}
-        self.best_ask_over_time = {}
-        self.bid_ask_spread_over_time = {}
-        self.mid_price_over_time = {}
-        self.relative_bid_ask_spread_over_time = {}
+        self.price_levels = {
+            'BUY': pl.PriceLevels(depth_levels, best_is_highest=True),
+            'SELL': pl.PriceLevels(depth_levels, best_is_highest=False)
+        }
+        
+        self.hibernated_volume = {
+            'BUY': 0.0,
+            'SELL': 0.0
+        }
+        (
+            self.current_best_bid,
+            self.current_best_ask,
+            self.current_bid_ask_spread,
+            self.current_mid_price,
+            self.current_relative_bid_ask_spread
+        ) = self.initial_feature_values
+        
+        self.features = ft.FeatureTable(self.feature_columns)
+        
+        self.crossed_levels_skipped = ft.FeatureTable(('levels_skipped',), initial_capacity=64)
+        self.unresolved_crossed_books = 0
+        self.recalculations_triggered = 0
+        self.recalculations_skipped = 0
+        #Counted whether or not the changes are recorded, so a book built without the change table still knows it has a mid price
+        self.feature_updates = 0
+        
+        self.depth_levels = depth_levels
+        self.depth_price_band = depth_price_band
+        self.depth = None
+        if depth_levels > 0 or depth_price_band is not None:
+            self.depth = ft.FeatureTable(self.depth_columns())
+        
+        #With a grid width the features are also integrated over time onto that grid as they change;
+        #without record_feature_changes only the grid is kept
+        self.record_feature_changes = record_feature_changes
+        self.feature_grid = None
+        if feature_grid_width is not None:
+            self.feature_grid = ft.FeatureGrid(self.feature_columns, pd.Timedelta(feature_grid_width).value)
+    
+    @property
+    def best_bid_over_time(
+        self
+    ) -> pd.Series:
+        return self.features.changes('best_bid', self.initial_feature_values[0])
+    
+    @property
+    def best_ask_over_time(
+        self
+    ) -> pd.Series:
+        return self.features.changes('best_ask', self.initial_feature_values[1])
+    
+    @property
+    def bid_ask_spread_over_time(
+        self
+    ) -> pd.Series:
+        return self.features.changes('bid_ask_spread', self.initial_feature_values[2])
+    
+    @property
+    def mid_price_over_time(
+        self
+    ) -> pd.Series:
+        return self.features.changes('mid_price', self.initial_feature_values[3])
+    
+    @property
+    def relative_bid_ask_spread_over_time(
+        self
+    ) -> pd.Series:
+        return self.features.changes('relative_bid_ask_spread', self.initial_feature_values[4])
     
     def calculate_order_book_features(
         self,
-        transaction_time: str
+        transaction_time: int
     ) -> None:
-        bids_df = pd.DataFrame.from_dict(self.orders['BUY'], orient='index')
-        asks_df = pd.DataFrame.from_dict(self.orders['SELL'], orient='index')
-        
-        no_bids = bids_df.empty == True
-        no_asks = asks_df.empty == True
+        no_bids = len(self.price_levels['BUY']) == 0
+        no_asks = len(self.price_levels['SELL']) == 0
         
         if no_bids or no_asks:
             return
         
-        self.recalculate_order_book_features(
-            bids_df,
-            asks_df,
-            transaction_time
-        )
+        self.recalculate_order_book_features(transaction_time)
+    
+    def features_to_dataframe(
+        self
+    ) -> pd.DataFrame:
+        return self.features.to_dataframe()
+    
+    def feature_grid_to_dataframe(
+        self
+    ) -> pd.DataFrame:
+        if self.feature_grid is None:
+            raise ValueError("Order book was built without a feature grid width.")
+        return self.feature_grid.to_dataframe()
+    
+    def depth_columns(
+        self
+    ) -> Tuple[str, ...]:
+        columns = [f"bid_volume_level_{level}" for level in range(1, self.depth_levels + 1)]
+        columns += [f"ask_volume_level_{level}" for level in range(1, self.depth_levels + 1)]
+        if self.depth_levels > 0:
+            columns.append('imbalance')
+        if self.depth_price_band is not None:
+            columns += ['bid_depth_within_band', 'ask_depth_within_band', 'imbalance_within_band']
+        return tuple(columns) + ('bid_volume', 'ask_volume', 'hibernated_bid_volume', 'hibernated_ask_volume')
+    
+    #Reads depth off the running totals of the price levels; hibernated volume is reported separately from live depth
+    def record_depth_features(
+        self,
+        transaction_time: int
+    ):
+        bid_levels = self.price_levels['BUY']
+        ask_levels = self.price_levels['SELL']
+        bid_volumes = bid_levels.highest_level_volumes(self.depth_levels)
+        ask_volumes = ask_levels.lowest_level_volumes(self.depth_levels)
+        depth_values = bid_volumes + ask_volumes
+        if self.depth_levels > 0:
+            depth_values.append(self.volume_imbalance(bid_levels.top_levels_volume, ask_levels.top_levels_volume))
+        if self.depth_price_band is not None:
+            if self.feature_updates > 0:
+                bid_depth = bid_levels.band_volume(self.current_mid_price - self.depth_price_band, self.current_mid_price)
+                ask_depth = ask_levels.band_volume(self.current_mid_price, self.current_mid_price + self.depth_price_band)
+                depth_values += [bid_depth, ask_depth, self.volume_imbalance(bid_depth, ask_depth)]
+            else:
+                depth_values += [np.nan, np.nan, np.nan]
+        depth_values += [
+            bid_levels.total_volume,
+            ask_levels.total_volume,
+            self.hibernated_volume['BUY'],
+            self.hibernated_volume['SELL']
+        ]
+        self.depth.append(transaction_time, tuple(depth_values))
+    
+    def volume_imbalance(
+        self,
+        bid_volume: float,
+        ask_volume: float
+    ) -> float:
+        total_volume = bid_volume + ask_volume
+        return (bid_volume - ask_volume) / total_volume if total_volume > 0 else np.nan
     
     def add_order(
         self,
@@ -58,9 +175,11 @@ class OrderBook:
             raise ValueError(f"Order with initial_id {order.initial_id} already exists in {order_side} orders.")
         else:
             self.orders[order_side][order.initial_id] = order
+            self.price_levels[order_side].add(order.price, order.initial_id, order.available_volume)
         
         try:
-            del self.hibernated_orders[order_side][order.initial_id]
+            hibernated_order = self.hibernated_orders[order_side].pop(order.initial_id)
+            self.hibernated_volume[order_side] -= hibernated_order.available_volume
         except KeyError:
             return
     
@@ -73,9 +192,13 @@ class OrderBook:
             raise ValueError(f"Order with initial_id {order.initial_id} does not exist in {order_side} orders.")
         else:
             if self.hibernated_orders[order_side].get(order.initial_id) is not None:
+                self.hibernated_volume[order_side] += order.available_volume - self.hibernated_orders[order_side][order.initial_id].available_volume
                 self.hibernated_orders[order_side][order.initial_id] = order
             else:
+                existing_order = self.orders[order_side][order.initial_id]
+                self.price_levels[order_side].remove(existing_order.price, existing_order.initial_id)
                 self.orders[order_side][order.initial_id] = order
+                self.price_levels[order_side].add(order.price, order.initial_id, order.available_volume)
     
     def delete_order(
         self,
@@ -83,10 +206,12 @@ class OrderBook:
         order_side: str
     ):
         try:
-            del self.orders[order_side][order.initial_id]
+            existing_order = self.orders[order_side].pop(order.initial_id)
+            self.price_levels[order_side].remove(existing_order.price, existing_order.initial_id)
         except KeyError:
             try:
-                del self.hibernated_orders[order_side][order.initial_id]
+                hibernated_order = self.hibernated_orders[order_side].pop(order.initial_id)
+                self.hibernated_volume[order_side] -= hibernated_order.available_volume
             except KeyError:
                 raise KeyError(f"Order with initial_id {order.initial_id} does not exist in {order_side} orders.")
             
@@ -96,30 +221,25 @@ class OrderBook:
         order_side: str
     ):
         try:
-            del self.orders[order_side][order.initial_id]
+            existing_order = self.orders[order_side].pop(order.initial_id)
+            self.price_levels[order_side].remove(existing_order.price, existing_order.initial_id)
             self.hibernated_orders[order_side][order.initial_id] = order
+            self.hibernated_volume[order_side] += order.available_volume
         except KeyError:
             raise KeyError(f"Order with initial_id {order.initial_id} does not exist in {order_side} orders.")
       
     def recalculate_order_book_features(
         self,
-        bids_df: pd.DataFrame,
-        asks_df: pd.DataFrame,
-        transaction_time: str
+        transaction_time: int
     ):  
-        best_bid = bids_df['price'].max()
-        best_ask = asks_df['price'].min()
+        best_bid = self.price_levels['BUY'].highest_price()
+        best_ask = self.price_levels['SELL'].lowest_price()
         
         if best_bid >= best_ask:
-            n = 2
-            if best_bid != self.current_best_bid:
-                while best_bid >= best_ask:
-                    n += 1
-                    best_bid = bids_df['price'].nlargest(n).iloc[1]
-            else:
-                while best_ask <= best_bid:
-                    n += 1
-                    best_ask = asks_df['price'].nsmallest(n).iloc[1]
+            uncrossed_prices = self.resolve_crossed_book(best_bid, best_ask, transaction_time)
+            if uncrossed_prices is None:
+                return
+            best_bid, best_ask = uncrossed_prices
         
         self.update_all_order_book_features(
             best_bid,
@@ -127,34 +247,52 @@ class OrderBook:
             transaction_time
         )
     
+    #Drops the crossing levels from whichever side moved, using a single search of the sorted levels
+    def resolve_crossed_book(
+        self,
+        best_bid: float,
+        best_ask: float,
+        transaction_time: int
+    ) -> Optional[Tuple[float, float]]:
+        if best_bid != self.current_best_bid:
+            first_uncrossed_level = self.price_levels['BUY'].highest_price_below(best_ask)
+        else:
+            first_uncrossed_level = self.price_levels['SELL'].lowest_price_above(best_bid)
+        
+        if first_uncrossed_level is None:
+            self.unresolved_crossed_books += 1
+            return None
+        
+        uncrossed_price, levels_skipped = first_uncrossed_level
+        self.crossed_levels_skipped.append(transaction_time, (levels_skipped,))
+        if best_bid != self.current_best_bid:
+            return uncrossed_price, best_ask
+        return best_bid, uncrossed_price
+    
     def update_all_order_book_features(
         self,
         best_bid: float,
         best_ask: float,
-        transaction_time: str
+        transaction_time: int
     ):
         bid_ask_spread = best_ask - best_bid
         mid_price = (best_ask + best_bid) / 2
-        relative_bid_ask_spread_over_time = 100 * bid_ask_spread / mid_price if mid_price != 0 else 0
+        relative_bid_ask_spread = 100 * bid_ask_spread / mid_price if mid_price != 0 else 0
         
-        self.current_best_bid = self.update_order_book_feature(best_bid, self.current_best_bid, self.best_bid_over_time, transaction_time)
-        self.current_best_ask = self.update_order_book_feature(best_ask, self.current_best_ask, self.best_ask_over_time, transaction_time)
-        self.current_bid_ask_spread = self.update_order_book_feature(bid_ask_spread, self.current_bid_ask_spread, self.bid_ask_spread_over_time, transaction_time)
-        self.current_mid_price = self.update_order_book_feature(mid_price, self.current_mid_price, self.mid_price_over_time, transaction_time)
-        self.current_relative_bid_ask_spread = self.update_order_book_feature(relative_bid_ask_spread_over_time, self.current_relative_bid_ask_spread, self.relative_bid_ask_spread_over_time, transaction_time)
-    
-    def update_order_book_feature(
-        self,
-        new_value: float,
-        value_to_update: float,
-        values_over_time_to_update: dict,
-        transaction_time: str
-    ) -> float:
-        if new_value != value_to_update:
-            values_over_time_to_update[transaction_time] = new_value
-            return new_value
-
-        return value_to_update
+        feature_values = (best_bid, best_ask, bid_ask_spread, mid_price, relative_bid_ask_spread)
+        if feature_values != (self.current_best_bid, self.current_best_ask, self.current_bid_ask_spread, self.current_mid_price, self.current_relative_bid_ask_spread):
+            self.feature_updates += 1
+            if self.record_feature_changes:
+                self.features.append(transaction_time, feature_values)
+            if self.feature_grid is not None:
+                self.feature_grid.update(transaction_time, feature_values)
+            (
+                self.current_best_bid,
+                self.current_best_ask,
+                self.current_bid_ask_spread,
+                self.current_mid_price,
+                self.current_relative_bid_ask_spread
+            ) = feature_values
             
     action_code_to_action = {
         'A': add_order,
@@ -1,65 +1,292 @@
 import pandas as pd
 import order_book_handler.order_book as ob
 import order_book_handler.order as o
-from time import time
-from typing import Dict
+import order_book_handler.replay_engine as replay
+import order_book_handler.columnar_cache as cc
+import order_book_handler.metrics as om
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from time import perf_counter, time
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 
 hours_before_end_of_session_to_visualise = 5
 
+def read_orders(
+    orders_csv_filepath : str,
+    product_name : str,
+    cache_directory : Optional[str] = None,
+    delivery_starts : Optional[List[str]] = None
+) -> pd.DataFrame:
+    return cc.read_epex_csv(
+        orders_csv_filepath,
+        product_name,
+        ['InitialId', 'Side', 'Product', 'DeliveryStart', 'ActionCode', 'TransactionTime', 'Price', 'Volume'],
+        cache_directory,
+        parse_dates=['TransactionTime'],
+        delivery_starts=delivery_starts
+    )
+
 def reconstruct_order_book_one_product_one_day(
     orders_csv_filepath : str,
-    product_name : str
+    product_name : str,
+    workers : int = 1,
+    cache_directory : Optional[str] = None,
+    depth_levels : int = 0,
+    depth_price_band : Optional[float] = None,
+    metrics : Optional[om.ReconstructionMetrics] = None,
+    compact_orders : bool = False,
+    feature_grid_width : Optional[str] = None,
+    record_feature_changes : bool = True
 ) -> Dict[str, ob.OrderBook]:
-    orders = pd.read_csv(
-        orders_csv_filepath, 
-        header=1,
-        usecols=['InitialId', 'Side', 'Product', 'DeliveryStart', 'ActionCode', 'TransactionTime', 'Price', 'Volume']
-    )
-    orders = orders[orders['Product'] == product_name]
+    with om.stage(metrics, 'read_orders'):
+        orders = read_orders(orders_csv_filepath, product_name, cache_directory)
+    with om.stage(metrics, 'encode_orders'):
+        encoded_orders_by_delivery_start = replay.encode_orders_by_delivery_start(orders)
+    del orders
+    
+    with om.stage(metrics, 'replay'):
+        order_books_and_wall_times = replay_encoded_delivery_periods(encoded_orders_by_delivery_start, workers, depth_levels, depth_price_band, compact_orders, feature_grid_width, record_feature_changes)
+    
     order_book_by_delivery_start_time = {}
-    orders_by_settlement_period = orders.groupby('DeliveryStart')
-    for delivery_start_time, orders_one_settlement_period in orders_by_settlement_period:
-        start_time = time()
-        order_book = ob.OrderBook()
-        orders_by_settlement_period_by_transaction_time = orders_one_settlement_period.groupby('TransactionTime')
-        for transaction_time, orders_by_transaction_time in orders_by_settlement_period_by_transaction_time:
-            orders_by_initial_id = orders_by_transaction_time.groupby('InitialId')
-            prices_affected_by_side = {}
-            for initial_id, orders_for_id in orders_by_initial_id:
-                order_book_side = orders_for_id.iloc[0]['Side']
-                prices_affected = []
-                for index, order_row in orders_for_id.iterrows():
-                    action_code = order_row['ActionCode']
-                    order = o.Order(
-                        initial_id=order_row['InitialId'],
-                        price=order_row['Price'],
-                        available_volume=order_row['Volume']
-                    )
-                    action_method = order_book.action_code_to_action[action_code]
-                    action_method(order_book, order, order_book_side)
-                    prices_affected.append(order_row['Price'])
-                if prices_affected_by_side.get(order_book_side) is not None:
-                    prices_affected_by_side[order_book_side].extend(prices_affected)
-                else:
-                    prices_affected_by_side[order_book_side] = prices_affected
-            
-            recalculate_order_book_features = False
-            for side, prices_affected in prices_affected_by_side.items():
-                if side == 'BUY' and len(prices_affected) > 0:
-                    if order_book.current_best_bid <= max(prices_affected):
-                        recalculate_order_book_features = True
-                        break
-                elif side == 'SELL' and len(prices_affected) > 0:
-                    if order_book.current_best_ask >= min(prices_affected):
-                        recalculate_order_book_features = True
-                        break            
-            if recalculate_order_book_features:
-                order_book.calculate_order_book_features(str(transaction_time))
-        
+    for delivery_start_time, (order_book, wall_time) in order_books_and_wall_times.items():
         order_book_by_delivery_start_time[delivery_start_time] = order_book
-        end_time = time()
-        print("time taken for order book reconstruction for delivery start time", delivery_start_time, ":", end_time - start_time, "seconds")
+        if metrics is not None:
+            metrics.record_delivery_period(delivery_start_time, encoded_orders_by_delivery_start[delivery_start_time], order_book, wall_time)
     
     return order_book_by_delivery_start_time
-            
-        
\ No newline at end of file
+
+#One read and one partitioning pass for every product asked for; product_names='all' takes every product in the file.
+#Results are nested {product: {delivery_start: OrderBook}}
+def reconstruct_order_books_by_product_one_day(
+    orders_csv_filepath : str,
+    product_names : Union[List[str], str] = 'all',
+    workers : int = 1,
+    cache_directory : Optional[str] = None,
+    depth_levels : int = 0,
+    depth_price_band : Optional[float] = None,
+    metrics : Optional[om.ReconstructionMetrics] = None,
+    compact_orders : bool = False,
+    feature_grid_width : Optional[str] = None,
+    record_feature_changes : bool = True
+) -> Dict[str, Dict[str, ob.OrderBook]]:
+    if isinstance(product_names, str):
+        product_names = None if product_names == 'all' else [product_names]
+    with om.stage(metrics, 'read_orders'):
+        orders = read_orders_for_products(orders_csv_filepath, product_names, cache_directory)
+    with om.stage(metrics, 'encode_orders'):
+        encoded_orders_by_product = replay.encode_orders_by_product_and_delivery_start(orders)
+    del orders
+
+    #Every (product, delivery start) pair goes through the same pool, so small products do not leave workers idle
+    encoded_orders_by_key = {
+        (product_name, delivery_start_time): encoded_orders
+        for product_name, encoded_orders_by_delivery_start in encoded_orders_by_product.items()
+        for delivery_start_time, encoded_orders in encoded_orders_by_delivery_start.items()
+    }
+    with om.stage(metrics, 'replay'):
+        order_books_and_wall_times = replay_encoded_delivery_periods(encoded_orders_by_key, workers, depth_levels, depth_price_band, compact_orders, feature_grid_width, record_feature_changes)
+
+    order_books_by_product = {product_name: {} for product_name in (product_names or encoded_orders_by_product.keys())}
+    for (product_name, delivery_start_time), (order_book, wall_time) in order_books_and_wall_times.items():
+        order_books_by_product[product_name][delivery_start_time] = order_book
+        if metrics is not None:
+            metrics.record_delivery_period(delivery_start_time, encoded_orders_by_key[(product_name, delivery_start_time)], order_book, wall_time, product_name)
+
+    return order_books_by_product
+
+def read_orders_for_products(
+    orders_csv_filepath : str,
+    product_names : Optional[List[str]],
+    cache_directory : Optional[str] = None
+) -> pd.DataFrame:
+    return cc.read_epex_csv_products(
+        orders_csv_filepath,
+        product_names,
+        ['InitialId', 'Side', 'Product', 'DeliveryStart', 'ActionCode', 'TransactionTime', 'Price', 'Volume'],
+        cache_directory,
+        parse_dates=['TransactionTime']
+    )
+
+def replay_encoded_delivery_periods(
+    encoded_orders_by_key : Dict,
+    workers : int = 1,
+    depth_levels : int = 0,
+    depth_price_band : Optional[float] = None,
+    compact_orders : bool = False,
+    feature_grid_width : Optional[str] = None,
+    record_feature_changes : bool = True
+) -> Dict:
+    if workers > 1:
+        return replay_delivery_periods_in_parallel(encoded_orders_by_key, workers, depth_levels, depth_price_band, compact_orders, feature_grid_width, record_feature_changes)
+    order_books_and_wall_times = {}
+    for key, encoded_orders in encoded_orders_by_key.items():
+        order_books_and_wall_times[key] = replay_delivery_period_timed(encoded_orders, depth_levels, depth_price_band, compact_orders, feature_grid_width, record_feature_changes)
+        print("time taken for order book reconstruction for delivery start time", key, ":", order_books_and_wall_times[key][1], "seconds")
+    return order_books_and_wall_times
+
+#Yields (delivery_start, features, depth) as each period finishes, depth being None without depth_levels or a depth_price_band.
+#Books and their orders are dropped as soon as their features are taken, and each period's encoded orders once it has been
+#replayed, so only the periods in flight are held.
+def stream_delivery_period_features_and_depth(
+    orders_csv_filepath : str,
+    product_name : str,
+    workers : int = 1,
+    cache_directory : Optional[str] = None,
+    depth_levels : int = 0,
+    depth_price_band : Optional[float] = None,
+    metrics : Optional[om.ReconstructionMetrics] = None,
+    compact_orders : bool = False
+) -> Iterator[Tuple[str, pd.DataFrame, Optional[pd.DataFrame]]]:
+    with om.stage(metrics, 'read_orders'):
+        orders = read_orders(orders_csv_filepath, product_name, cache_directory)
+    with om.stage(metrics, 'encode_orders'):
+        encoded_orders_by_delivery_start = replay.encode_orders_by_delivery_start(orders)
+    del orders
+
+    delivery_start_times = list(encoded_orders_by_delivery_start.keys())
+    if workers > 1:
+        #At most `workers` periods are submitted at once, and the next one is submitted as each is yielded, so neither
+        #the encoded orders waiting in the executor nor finished features waiting on the consumer add up to the whole day
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            remaining_delivery_start_times = iter(delivery_start_times)
+            futures = deque()
+            for delivery_start_time in remaining_delivery_start_times:
+                futures.append((delivery_start_time, executor.submit(replay_delivery_period_features, delivery_start_time, encoded_orders_by_delivery_start.pop(delivery_start_time), depth_levels, depth_price_band, compact_orders)))
+                if len(futures) >= workers:
+                    break
+
+            while futures:
+                delivery_start_time, future = futures.popleft()
+                features, depth, period_metrics = future.result()
+                del future
+                next_delivery_start_time = next(remaining_delivery_start_times, None)
+                if next_delivery_start_time is not None:
+                    futures.append((next_delivery_start_time, executor.submit(replay_delivery_period_features, next_delivery_start_time, encoded_orders_by_delivery_start.pop(next_delivery_start_time), depth_levels, depth_price_band, compact_orders)))
+                if metrics is not None:
+                    metrics.add_delivery_period(period_metrics)
+                yield delivery_start_time, features, depth
+        return
+
+    for delivery_start_time in delivery_start_times:
+        with om.stage(metrics, 'replay'):
+            features, depth, period_metrics = replay_delivery_period_features(delivery_start_time, encoded_orders_by_delivery_start.pop(delivery_start_time), depth_levels, depth_price_band, compact_orders)
+        print("time taken for order book reconstruction for delivery start time", delivery_start_time, ":", period_metrics.wall_time_seconds, "seconds")
+        if metrics is not None:
+            metrics.add_delivery_period(period_metrics)
+        yield delivery_start_time, features, depth
+
+#Yields (delivery_start, features) as each period finishes, see stream_delivery_period_features_and_depth
+def stream_delivery_period_features(
+    orders_csv_filepath : str,
+    product_name : str,
+    workers : int = 1,
+    cache_directory : Optional[str] = None,
+    depth_levels : int = 0,
+    depth_price_band : Optional[float] = None,
+    metrics : Optional[om.ReconstructionMetrics] = None,
+    compact_orders : bool = False
+) -> Iterator[Tuple[str, pd.DataFrame]]:
+    for delivery_start_time, features, _ in stream_delivery_period_features_and_depth(
+        orders_csv_filepath,
+        product_name,
+        workers,
+        cache_directory,
+        depth_levels,
+        depth_price_band,
+        metrics,
+        compact_orders
+    ):
+        yield delivery_start_time, features
+
+def replay_delivery_period_features(
+    delivery_start_time : str,
+    encoded_orders : replay.EncodedOrders,
+    depth_levels : int = 0,
+    depth_price_band : Optional[float] = None,
+    compact_orders : bool = False
+) -> Tuple[pd.DataFrame, Optional[pd.DataFrame], om.DeliveryPeriodMetrics]:
+    order_book, wall_time = replay_delivery_period_timed(encoded_orders, depth_levels, depth_price_band, compact_orders)
+    depth = order_book.depth.to_dataframe() if order_book.depth is not None else None
+    return order_book.features_to_dataframe(), depth, om.delivery_period_metrics(delivery_start_time, encoded_orders, order_book, wall_time)
+
+def replay_delivery_period_timed(
+    encoded_orders : replay.EncodedOrders,
+    depth_levels : int = 0,
+    depth_price_band : Optional[float] = None,
+    compact_orders : bool = False,
+    feature_grid_width : Optional[str] = None,
+    record_feature_changes : bool = True
+) -> Tuple[ob.OrderBook, float]:
+    start_time = perf_counter()
+    order_book = replay.replay_delivery_period(encoded_orders, depth_levels, depth_price_band, compact_orders, feature_grid_width, record_feature_changes)
+    return order_book, perf_counter() - start_time
+
+#Workers only receive the encoded NumPy arrays for their own delivery period, never the DataFrame
+def replay_delivery_periods_in_parallel(
+    encoded_orders_by_delivery_start : Dict[str, replay.EncodedOrders],
+    workers : int,
+    depth_levels : int = 0,
+    depth_price_band : Optional[float] = None,
+    compact_orders : bool = False,
+    feature_grid_width : Optional[str] = None,
+    record_feature_changes : bool = True
+) -> Dict[str, Tuple[ob.OrderBook, float]]:
+    start_time = time()
+    delivery_start_times = list(encoded_orders_by_delivery_start.keys())
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        order_books_and_wall_times = executor.map(
+            partial(replay_delivery_period_timed, depth_levels=depth_levels, depth_price_band=depth_price_band, compact_orders=compact_orders, feature_grid_width=feature_grid_width, record_feature_changes=record_feature_changes),
+            encoded_orders_by_delivery_start.values()
+        )
+        order_books_and_wall_times_by_delivery_start_time = dict(zip(delivery_start_times, order_books_and_wall_times))
+    end_time = time()
+    print("time taken for order book reconstruction for", len(delivery_start_times), "delivery start times with", workers, "workers:", end_time - start_time, "seconds")
+    
+    return order_books_and_wall_times_by_delivery_start_time
+
+#The original replay loop, one groupby level per key and one Order per row, on the current OrderBook; differential_replay
+#checks it against the frozen original (baseline_order_book) along with the faster engines
+def reconstruct_order_book_one_delivery_period_by_groups(
+    orders_one_settlement_period : pd.DataFrame
+) -> ob.OrderBook:
+    order_book = ob.OrderBook()
+    orders_by_settlement_period_by_transaction_time = orders_one_settlement_period.groupby('TransactionTime')
+    for transaction_time, orders_by_transaction_time in orders_by_settlement_period_by_transaction_time:
+        orders_by_initial_id = orders_by_transaction_time.groupby('InitialId')
+        prices_affected_by_side = {}
+        for initial_id, orders_for_id in orders_by_initial_id:
+            order_book_side = orders_for_id.iloc[0]['Side']
+            prices_affected = []
+            for index, order_row in orders_for_id.iterrows():
+                action_code = order_row['ActionCode']
+                order = o.Order(
+                    initial_id=order_row['InitialId'],
+                    price=order_row['Price'],
+                    available_volume=order_row['Volume']
+                )
+                action_method = order_book.action_code_to_action[action_code]
+                action_method(order_book, order, order_book_side)
+                prices_affected.append(order_row['Price'])
+            if prices_affected_by_side.get(order_book_side) is not None:
+                prices_affected_by_side[order_book_side].extend(prices_affected)
+            else:
+                prices_affected_by_side[order_book_side] = prices_affected
+        
+        recalculate_order_book_features = False
+        for side, prices_affected in prices_affected_by_side.items():
+            if side == 'BUY' and len(prices_affected) > 0:
+                if order_book.current_best_bid <= max(prices_affected):
+                    recalculate_order_book_features = True
+                    break
+            elif side == 'SELL' and len(prices_affected) > 0:
+                if order_book.current_best_ask >= min(prices_affected):
+                    recalculate_order_book_features = True
+                    break            
+        if recalculate_order_book_features:
+            order_book.calculate_order_book_features(pd.Timestamp(transaction_time).value)
+            order_book.recalculations_triggered += 1
+        else:
+            order_book.recalculations_skipped += 1
+    
+    return order_book
@@ -0,0 +1,155 @@
+import numpy as np
+import pandas as pd
+import order_book_handler.order_book as ob
+import order_book_handler.feature_table as ft
+import order_book_handler.trade_costs_reconstructor as tcr
+import order_book_handler.metrics as om
+from typing import Dict, Iterable, Iterator, Optional, Sequence, Tuple
+
+default_horizons = ('5s', '30s', '1min', '5min')
+features_at_execution = ('mid_price', 'bid_ask_spread', 'relative_bid_ask_spread', 'best_bid', 'best_ask')
+
+#Values of each column in force at every query time: strictly before it (as previous_mid_prices_before_trades does)
+#or at or before it, NaN where nothing was in force yet
+def values_as_of(
+    update_times: np.ndarray,
+    columns: Dict[str, np.ndarray],
+    query_times: np.ndarray,
+    strictly_before: bool
+) -> Dict[str, np.ndarray]:
+    rows = np.searchsorted(update_times, query_times, side='left' if strictly_before else 'right') - 1
+    in_force = rows >= 0
+    values_by_column = {}
+    for column, values in columns.items():
+        column_values = np.full(len(query_times), np.nan)
+        column_values[in_force] = values[rows[in_force]]
+        values_by_column[column] = column_values
+    return values_by_column
+
+#Per aggressor trade of one delivery period: the book at execution and the mid price at each horizon after it.
+#With d = +1 for buys and -1 for sells, and m0 the mid in force at execution:
+#  effective_spread = 2d(price - m0), price_impact_h = 2d(m_h - m0), realised_spread_h = 2d(price - m_h),
+#so effective_spread = price_impact_h + realised_spread_h for every horizon.
+def execution_features_one_delivery_period(
+    aggressor_trades: pd.DataFrame,
+    features: pd.DataFrame,
+    depth: Optional[pd.DataFrame] = None,
+    horizons: Sequence[str] = default_horizons
+) -> pd.DataFrame:
+    aggressor_trades = aggressor_trades.sort_values('ExecutionTime', kind='stable')
+    trade_times = ft.to_nanoseconds(aggressor_trades['ExecutionTime'])
+    prices = aggressor_trades['Price'].to_numpy(dtype=np.float64)
+    directions = np.where((aggressor_trades['Side'] == 'BUY').to_numpy(), 1.0, -1.0)
+
+    feature_times = ft.to_nanoseconds(features.index.to_series())
+    at_execution = values_as_of(
+        feature_times,
+        {column: features[column].to_numpy(dtype=np.float64) for column in features_at_execution},
+        trade_times,
+        strictly_before=True
+    )
+    if depth is not None:
+        at_execution.update(values_as_of(
+            ft.to_nanoseconds(depth.index.to_series()),
+            {column: depth[column].to_numpy(dtype=np.float64) for column in depth.columns},
+            trade_times,
+            strictly_before=True
+        ))
+
+    #Every horizon is answered by one search over the concatenated query times
+    horizon_offsets = [pd.Timedelta(horizon).value for horizon in horizons]
+    mid_prices_after = values_as_of(
+        feature_times,
+        {'mid_price': features['mid_price'].to_numpy(dtype=np.float64)},
+        np.concatenate([trade_times + offset for offset in horizon_offsets] + [np.empty(0, dtype=np.int64)]),
+        strictly_before=False
+    )['mid_price'].reshape(len(horizons), len(trade_times))
+
+    execution_features = pd.DataFrame({
+        'trade_id': aggressor_trades['TradeId'].to_numpy(),
+        'side': aggressor_trades['Side'].to_numpy(),
+        'trade_price': prices,
+        'trade_volume': aggressor_trades['Volume'].to_numpy(dtype=np.float64),
+        **at_execution
+    })
+    mid_price = at_execution['mid_price']
+    execution_features['effective_spread'] = 2 * directions * (prices - mid_price)
+    for horizon, mid_price_after in zip(horizons, mid_prices_after):
+        execution_features[f"mid_price_{horizon}"] = mid_price_after
+        execution_features[f"price_impact_{horizon}"] = 2 * directions * (mid_price_after - mid_price)
+        execution_features[f"realised_spread_{horizon}"] = 2 * directions * (prices - mid_price_after)
+    execution_features.index = pd.DatetimeIndex(trade_times.view('datetime64[ns]'), name='execution_time').tz_localize('UTC')
+    return execution_features
+
+def aggressor_trades_by_delivery_start(
+    trades_csv_filepath: str,
+    product_name: str,
+    cache_directory: Optional[str] = None,
+    metrics: Optional[om.ReconstructionMetrics] = None
+) -> Tuple[Dict[int, pd.DataFrame], pd.DataFrame]:
+    aggressor_trades = tcr.read_aggressor_trades(trades_csv_filepath, product_name, cache_directory, metrics)
+    trades_by_delivery_start = dict(list(aggressor_trades.groupby(ft.to_nanoseconds(aggressor_trades['DeliveryStart']), sort=False)))
+    return trades_by_delivery_start, aggressor_trades.iloc[:0]
+
+def calculate_execution_features(
+    trades_csv_filepath: str,
+    product_name: str,
+    features_by_delivery_start_time: Dict[str, pd.DataFrame],
+    depth_by_delivery_start_time: Optional[Dict[str, pd.DataFrame]] = None,
+    horizons: Sequence[str] = default_horizons,
+    cache_directory: Optional[str] = None,
+    metrics: Optional[om.ReconstructionMetrics] = None
+) -> Dict[str, pd.DataFrame]:
+    return dict(stream_execution_features(
+        trades_csv_filepath,
+        product_name,
+        features_by_delivery_start_time.items(),
+        depth_by_delivery_start_time,
+        horizons,
+        cache_directory,
+        metrics
+    ))
+
+def calculate_execution_features_from_order_books(
+    trades_csv_filepath: str,
+    product_name: str,
+    order_books: Dict[str, ob.OrderBook],
+    horizons: Sequence[str] = default_horizons,
+    cache_directory: Optional[str] = None,
+    metrics: Optional[om.ReconstructionMetrics] = None
+) -> Dict[str, pd.DataFrame]:
+    return calculate_execution_features(
+        trades_csv_filepath,
+        product_name,
+        {delivery_start_time: order_book.features_to_dataframe() for delivery_start_time, order_book in order_books.items()},
+        {delivery_start_time: order_book.depth.to_dataframe() for delivery_start_time, order_book in order_books.items() if order_book.depth is not None},
+        horizons,
+        cache_directory,
+        metrics
+    )
+
+#Takes (delivery_start, features) pairs, e.g. from ob_reconstruction.stream_delivery_period_features, so a year of days
+#can be processed one delivery period at a time
+def stream_execution_features(
+    trades_csv_filepath: str,
+    product_name: str,
+    feature_stream: Iterable[Tuple[str, pd.DataFrame]],
+    depth_by_delivery_start_time: Optional[Dict[str, pd.DataFrame]] = None,
+    horizons: Sequence[str] = default_horizons,
+    cache_directory: Optional[str] = None,
+    metrics: Optional[om.ReconstructionMetrics] = None
+) -> Iterator[Tuple[str, pd.DataFrame]]:
+    trades_by_delivery_start, no_trades = aggressor_trades_by_delivery_start(trades_csv_filepath, product_name, cache_directory, metrics)
+    depth_by_delivery_start_time = depth_by_delivery_start_time or {}
+    for delivery_start_time, features in feature_stream:
+        aggressor_trades = trades_by_delivery_start.pop(pd.Timestamp(delivery_start_time).value, no_trades)
+        with om.stage(metrics, 'execution_feature_join'):
+            execution_features = execution_features_one_delivery_period(
+                aggressor_trades,
+                features,
+                depth_by_delivery_start_time.get(delivery_start_time),
+                horizons
+            )
+        if metrics is not None:
+            metrics.increment('trades_with_execution_features', len(execution_features))
+        yield delivery_start_time, execution_features
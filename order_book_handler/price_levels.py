@@ -0,0 +1,213 @@
+import numpy as np
+from bisect import bisect_left, bisect_right, insort
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+@dataclass(slots=True)
+class PriceLevel:
+    volume : float = 0.0
+    order_ids : Dict[int, float] = field(default_factory=dict)
+
+#Besides the total, two running volumes are kept as orders come and go: that of the depth_levels levels nearest the best price
+#(the highest for bids, the lowest for asks) and that of the levels inside the band last asked for by band_volume
+class PriceLevels:
+    def __init__(
+        self,
+        depth_levels: int = 0,
+        best_is_highest: bool = True
+    ):
+        self.prices : List[float] = []
+        self.levels : Dict[float, PriceLevel] = {}
+        self.total_volume = 0.0
+        self.depth_levels = depth_levels
+        self.best_is_highest = best_is_highest
+        self.top_levels_volume = 0.0
+        self.band_lowest_price = np.inf
+        self.band_highest_price = -np.inf
+        self.band_total_volume = 0.0
+
+    def __len__(
+        self
+    ) -> int:
+        return len(self.prices)
+
+    def add(
+        self,
+        price: float,
+        initial_id: int,
+        volume: float
+    ):
+        if price != price:
+            return
+
+        level = self.level_at(price)
+        level.order_ids[initial_id] = volume
+        self.add_volume(price, level, volume)
+
+    def remove(
+        self,
+        price: float,
+        initial_id: int
+    ):
+        if price != price:
+            return
+
+        level = self.levels[price]
+        volume = level.order_ids.pop(initial_id)
+        self.remove_volume(price, level, volume, not level.order_ids)
+
+    def new_level(
+        self
+    ) -> PriceLevel:
+        return PriceLevel()
+
+    #Level and total volume bookkeeping shared by every way of holding a level's orders
+    def level_at(
+        self,
+        price: float
+    ):
+        level = self.levels.get(price)
+        if level is None:
+            level = self.new_level()
+            self.levels[price] = level
+            insort(self.prices, price)
+            #A new level among the top ones pushes the last of them out
+            if self.depth_levels > 0 and len(self.prices) > self.depth_levels:
+                pushed_out_price = self.prices[-self.depth_levels - 1] if self.best_is_highest else self.prices[self.depth_levels]
+                if (pushed_out_price < price) if self.best_is_highest else (pushed_out_price > price):
+                    self.top_levels_volume -= self.levels[pushed_out_price].volume
+        return level
+
+    def in_top_levels(
+        self,
+        price: float
+    ) -> bool:
+        if len(self.prices) <= self.depth_levels:
+            return True
+        return price >= self.prices[-self.depth_levels] if self.best_is_highest else price <= self.prices[self.depth_levels - 1]
+
+    def add_volume(
+        self,
+        price: float,
+        level,
+        volume: float
+    ):
+        level.volume += volume
+        self.total_volume += volume
+        if self.depth_levels > 0 and self.in_top_levels(price):
+            self.top_levels_volume += volume
+        if self.band_lowest_price <= price <= self.band_highest_price:
+            self.band_total_volume += volume
+
+    def remove_volume(
+        self,
+        price: float,
+        level,
+        volume: float,
+        level_emptied: bool
+    ):
+        level.volume -= volume
+        self.total_volume -= volume
+        in_top_levels = self.depth_levels > 0 and self.in_top_levels(price)
+        if in_top_levels:
+            self.top_levels_volume -= volume
+        if self.band_lowest_price <= price <= self.band_highest_price:
+            self.band_total_volume -= volume
+        if level_emptied:
+            #The first level below the top ones moves up in place of an emptied top level
+            if in_top_levels and len(self.prices) > self.depth_levels:
+                self.top_levels_volume += self.levels[self.prices[-self.depth_levels - 1] if self.best_is_highest else self.prices[self.depth_levels]].volume
+            del self.levels[price]
+            del self.prices[bisect_left(self.prices, price)]
+            if not self.prices:
+                self.top_levels_volume = self.band_total_volume = 0.0
+
+    def highest_price(
+        self
+    ) -> float:
+        return self.prices[-1]
+
+    def lowest_price(
+        self
+    ) -> float:
+        return self.prices[0]
+
+    def highest_price_below(
+        self,
+        price: float
+    ) -> Optional[Tuple[float, int]]:
+        index = bisect_left(self.prices, price)
+        if index == 0:
+            return None
+        return self.prices[index - 1], len(self.prices) - index
+
+    def lowest_price_above(
+        self,
+        price: float
+    ) -> Optional[Tuple[float, int]]:
+        index = bisect_right(self.prices, price)
+        if index == len(self.prices):
+            return None
+        return self.prices[index], index
+
+    #1 for the best level, one more for every level ahead of the price; a price between levels ranks where it would be added
+    def level_rank(
+        self,
+        price: float
+    ) -> int:
+        if self.best_is_highest:
+            return len(self.prices) - bisect_right(self.prices, price) + 1
+        return bisect_left(self.prices, price) + 1
+
+    def highest_level_volumes(
+        self,
+        number_of_levels: int
+    ) -> List[float]:
+        volumes = [self.levels[price].volume for price in self.prices[:-number_of_levels - 1:-1]]
+        return volumes + [0.0] * (number_of_levels - len(volumes))
+
+    def lowest_level_volumes(
+        self,
+        number_of_levels: int
+    ) -> List[float]:
+        volumes = [self.levels[price].volume for price in self.prices[:number_of_levels]]
+        return volumes + [0.0] * (number_of_levels - len(volumes))
+
+    def volume_of_prices(
+        self,
+        start: int,
+        stop: int
+    ) -> float:
+        return sum(self.levels[price].volume for price in self.prices[start:stop])
+
+    def volume_between(
+        self,
+        lowest_price: float,
+        highest_price: float
+    ) -> float:
+        return self.volume_of_prices(bisect_left(self.prices, lowest_price), bisect_right(self.prices, highest_price))
+
+    #Moves the tracked band to [lowest_price, highest_price] and returns its volume. Only the levels entering or leaving
+    #the band are summed, so a band following the mid price costs little more than the levels it slides over.
+    def band_volume(
+        self,
+        lowest_price: float,
+        highest_price: float
+    ) -> float:
+        if lowest_price != self.band_lowest_price or highest_price != self.band_highest_price:
+            prices = self.prices
+            start, stop = bisect_left(prices, lowest_price), bisect_right(prices, highest_price)
+            if self.band_lowest_price > self.band_highest_price or highest_price < self.band_lowest_price or lowest_price > self.band_highest_price:
+                self.band_total_volume = self.volume_of_prices(start, stop)
+            else:
+                previous_start, previous_stop = bisect_left(prices, self.band_lowest_price), bisect_right(prices, self.band_highest_price)
+                if start < previous_start:
+                    self.band_total_volume += self.volume_of_prices(start, previous_start)
+                elif start > previous_start:
+                    self.band_total_volume -= self.volume_of_prices(previous_start, start)
+                if stop > previous_stop:
+                    self.band_total_volume += self.volume_of_prices(previous_stop, stop)
+                elif stop < previous_stop:
+                    self.band_total_volume -= self.volume_of_prices(stop, previous_stop)
+            self.band_lowest_price, self.band_highest_price = lowest_price, highest_price
+        return self.band_total_volume
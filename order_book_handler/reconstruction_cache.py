@@ -0,0 +1,99 @@
+import os
+import json
+import hashlib
+import pandas as pd
+import order_book_handler.order_book as ob
+import order_book_handler.order_book_reconstructor as ob_reconstruction
+import order_book_handler.replay_engine as replay
+import order_book_handler.metrics as om
+from typing import Dict, Optional
+
+hash_chunk_size = 8 * 1024 * 1024
+
+#Hashes are remembered against size and mtime so an unchanged multi-GB file is only read once. Each file gets its own index
+#entry, named after its path, so parallel workers hashing different files never rewrite each other's entries.
+def hash_file(
+    filepath: str,
+    cache_directory: str
+) -> str:
+    absolute_filepath = os.path.abspath(filepath)
+    hash_index_directory = os.path.join(cache_directory, 'file_hashes')
+    hash_index_path = os.path.join(hash_index_directory, f"{hashlib.sha256(absolute_filepath.encode()).hexdigest()}.json")
+
+    file_stat = os.stat(filepath)
+    signature = {'size': file_stat.st_size, 'mtime_ns': file_stat.st_mtime_ns}
+    if os.path.exists(hash_index_path):
+        with open(hash_index_path) as hash_index_file:
+            indexed_hash = json.load(hash_index_file)
+        if indexed_hash['filepath'] == absolute_filepath and indexed_hash['signature'] == signature:
+            return indexed_hash['sha256']
+
+    file_hash = hashlib.sha256()
+    with open(filepath, 'rb') as file:
+        for chunk in iter(lambda: file.read(hash_chunk_size), b''):
+            file_hash.update(chunk)
+
+    os.makedirs(hash_index_directory, exist_ok=True)
+    temporary_path = f"{hash_index_path}.{os.getpid()}.tmp"
+    with open(temporary_path, 'w') as hash_index_file:
+        json.dump({'filepath': absolute_filepath, 'signature': signature, 'sha256': file_hash.hexdigest()}, hash_index_file, indent=2)
+    os.replace(temporary_path, hash_index_path)
+
+    return file_hash.hexdigest()
+
+def reconstruction_key(
+    orders_file_hash: str,
+    product_name: str
+) -> str:
+    return hashlib.sha256(f"{orders_file_hash}:{product_name}:{replay.ENGINE_VERSION}".encode()).hexdigest()
+
+def features_from_order_books(
+    order_books: Dict[str, ob.OrderBook]
+) -> Dict[str, pd.DataFrame]:
+    return {
+        delivery_start_time: order_book.features_to_dataframe()
+        for delivery_start_time, order_book in order_books.items()
+    }
+
+def load_or_reconstruct_features(
+    orders_csv_filepath: str,
+    product_name: str,
+    reconstruction_cache_directory: Optional[str] = None,
+    cache_directory: Optional[str] = None,
+    workers: int = 1,
+    metrics: Optional[om.ReconstructionMetrics] = None
+) -> Dict[str, pd.DataFrame]:
+    if reconstruction_cache_directory is None:
+        return reconstruct_features(orders_csv_filepath, product_name, cache_directory, workers, metrics)
+
+    os.makedirs(reconstruction_cache_directory, exist_ok=True)
+    key = reconstruction_key(hash_file(orders_csv_filepath, reconstruction_cache_directory), product_name)
+    features_path = os.path.join(reconstruction_cache_directory, f"{key}.pkl")
+    if os.path.exists(features_path):
+        with om.stage(metrics, 'load_cached_features'):
+            return pd.read_pickle(features_path)
+
+    features = reconstruct_features(orders_csv_filepath, product_name, cache_directory, workers, metrics)
+    temporary_path = f"{features_path}.{os.getpid()}.tmp"
+    pd.to_pickle(features, temporary_path)
+    os.replace(temporary_path, features_path)
+    print(f"Saved reconstructed features: {features_path}")
+
+    return features
+
+def reconstruct_features(
+    orders_csv_filepath: str,
+    product_name: str,
+    cache_directory: Optional[str] = None,
+    workers: int = 1,
+    metrics: Optional[om.ReconstructionMetrics] = None
+) -> Dict[str, pd.DataFrame]:
+    order_books = ob_reconstruction.reconstruct_order_book_one_product_one_day(
+        orders_csv_filepath,
+        product_name,
+        workers=workers,
+        cache_directory=cache_directory,
+        metrics=metrics
+    )
+    with om.stage(metrics, 'feature_extraction'):
+        return features_from_order_books(order_books)
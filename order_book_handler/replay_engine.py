@@ -0,0 +1,186 @@
+import numpy as np
+import pandas as pd
+import order_book_handler.order_book as ob
+import order_book_handler.compact_order_book as cob
+import order_book_handler.order as o
+import order_book_handler.feature_table as ft
+from dataclasses import dataclass
+from types import MethodType
+from typing import Dict, Optional, Tuple
+
+ENGINE_VERSION = 2
+SIDES = ('BUY', 'SELL')
+ACTION_CODES = ('A', 'C', 'D', 'P', 'M', 'X', 'H', 'I')
+
+@dataclass(slots=True)
+class EncodedOrders:
+    transaction_times : np.ndarray
+    transaction_time_starts : np.ndarray
+    initial_ids : np.ndarray
+    side_codes : np.ndarray
+    action_codes : np.ndarray
+    prices : np.ndarray
+    volumes : np.ndarray
+
+    def __len__(
+        self
+    ) -> int:
+        return len(self.initial_ids)
+
+def encode_codes(
+    values: pd.Series,
+    categories: tuple
+) -> np.ndarray:
+    codes = pd.Categorical(values, categories=categories).codes
+    if (codes < 0).any():
+        unknown_values = sorted(set(values[codes < 0].astype(str)))
+        raise ValueError(f"Unknown values {unknown_values}, expected one of {categories}.")
+    return codes.astype(np.int8)
+
+def encode_orders_by_delivery_start(
+    orders: pd.DataFrame
+) -> Dict[str, EncodedOrders]:
+    return {
+        delivery_start_time: encoded_orders
+        for (delivery_start_time,), encoded_orders in encode_orders_by_keys(orders, ('DeliveryStart',)).items()
+    }
+
+#Every product in the frame is partitioned in the same sort, so several products cost one pass rather than one each
+def encode_orders_by_product_and_delivery_start(
+    orders: pd.DataFrame
+) -> Dict[str, Dict[str, EncodedOrders]]:
+    encoded_orders_by_product = {}
+    for (product_name, delivery_start_time), encoded_orders in encode_orders_by_keys(orders, ('Product', 'DeliveryStart')).items():
+        encoded_orders_by_product.setdefault(product_name, {})[delivery_start_time] = encoded_orders
+    return encoded_orders_by_product
+
+def encode_orders_by_keys(
+    orders: pd.DataFrame,
+    key_columns: Tuple[str, ...]
+) -> Dict[tuple, EncodedOrders]:
+    orders = orders.dropna(subset=[*key_columns, 'TransactionTime', 'InitialId'])
+    if orders.empty:
+        return {}
+    factorized_keys = [pd.factorize(orders[key_column], sort=True) for key_column in key_columns]
+    transaction_times = ft.to_nanoseconds(orders['TransactionTime'])
+    initial_ids = orders['InitialId'].to_numpy()
+
+    # One stable sort replaces the key -> TransactionTime -> InitialId groupbys
+    order = np.lexsort((initial_ids, transaction_times, *[key_codes for key_codes, _ in reversed(factorized_keys)]))
+    key_codes = [key_codes[order] for key_codes, _ in factorized_keys]
+    transaction_times = transaction_times[order]
+    initial_ids = initial_ids[order]
+    side_codes = encode_codes(orders['Side'], SIDES)[order]
+    action_codes = encode_codes(orders['ActionCode'], ACTION_CODES)[order]
+    prices = orders['Price'].to_numpy(dtype=np.float64)[order]
+    volumes = orders['Volume'].to_numpy(dtype=np.float64)[order]
+
+    new_key = np.zeros(len(initial_ids) - 1, dtype=bool)
+    for codes in key_codes:
+        new_key |= np.diff(codes) != 0
+    new_transaction_time = new_key | (np.diff(transaction_times) != 0)
+    new_initial_id = new_transaction_time | (np.diff(initial_ids) != 0)
+
+    # Every event for an InitialId within a transaction time takes the side of the first one
+    initial_id_starts = np.flatnonzero(np.concatenate(([True], new_initial_id)))
+    initial_id_group_lengths = np.diff(np.append(initial_id_starts, len(initial_ids)))
+    side_codes = np.repeat(side_codes[initial_id_starts], initial_id_group_lengths)
+
+    key_bounds = np.append(np.flatnonzero(np.concatenate(([True], new_key))), len(initial_ids))
+    transaction_time_starts = np.flatnonzero(np.concatenate(([True], new_transaction_time)))
+
+    encoded_orders_by_key = {}
+    for start, stop in zip(key_bounds[:-1], key_bounds[1:]):
+        period_starts = transaction_time_starts[
+            np.searchsorted(transaction_time_starts, start):np.searchsorted(transaction_time_starts, stop)
+        ]
+        key = tuple(uniques[codes[start]] for codes, (_, uniques) in zip(key_codes, factorized_keys))
+        encoded_orders_by_key[key] = EncodedOrders(
+            transaction_times=transaction_times[period_starts],
+            transaction_time_starts=period_starts - start,
+            initial_ids=initial_ids[start:stop],
+            side_codes=side_codes[start:stop],
+            action_codes=action_codes[start:stop],
+            prices=prices[start:stop],
+            volumes=volumes[start:stop]
+        )
+
+    return encoded_orders_by_key
+
+def replay_delivery_period(
+    encoded_orders: EncodedOrders,
+    depth_levels: int = 0,
+    depth_price_band: Optional[float] = None,
+    compact_orders: bool = False,
+    feature_grid_width: Optional[str] = None,
+    record_feature_changes: bool = True
+) -> ob.OrderBook:
+    order_book_class = cob.CompactOrderBook if compact_orders else ob.OrderBook
+    order_book = order_book_class(depth_levels, depth_price_band, feature_grid_width, record_feature_changes)
+    replay_transaction_times(order_book, encoded_orders)
+    return order_book
+
+#Applies transaction-time groups [start, stop) to an existing book, so a replay can resume from a checkpoint
+def replay_transaction_times(
+    order_book: ob.OrderBook,
+    encoded_orders: EncodedOrders,
+    start: int = 0,
+    stop: Optional[int] = None
+):
+    stop = len(encoded_orders.transaction_times) if stop is None else stop
+    if start >= stop:
+        return
+
+    record_depth = order_book.depth is not None
+    # Books that take event fields directly skip building an Order per event
+    value_action_code_to_action = getattr(order_book, 'value_action_code_to_action', None)
+    takes_values = value_action_code_to_action is not None
+    action_methods = tuple(
+        MethodType((value_action_code_to_action if takes_values else type(order_book).action_code_to_action)[action_code], order_book)
+        for action_code in ACTION_CODES
+    )
+
+    event_bounds = np.append(encoded_orders.transaction_time_starts, len(encoded_orders))
+    first_event = event_bounds[start]
+    last_event = event_bounds[stop]
+    transaction_time_starts = encoded_orders.transaction_time_starts[start:stop] - first_event
+    event_prices = encoded_orders.prices[first_event:last_event]
+
+    # Per transaction time, the highest bid and lowest ask touched decide whether features are recalculated
+    is_buy = encoded_orders.side_codes[first_event:last_event] == 0
+    highest_buy_prices = np.maximum.reduceat(
+        np.where(is_buy, event_prices, -np.inf), transaction_time_starts
+    ).tolist()
+    lowest_sell_prices = np.minimum.reduceat(
+        np.where(is_buy, np.inf, event_prices), transaction_time_starts
+    ).tolist()
+
+    initial_ids = encoded_orders.initial_ids[first_event:last_event].tolist()
+    sides = [SIDES[side_code] for side_code in encoded_orders.side_codes[first_event:last_event].tolist()]
+    action_codes = encoded_orders.action_codes[first_event:last_event].tolist()
+    prices = event_prices.tolist()
+    volumes = encoded_orders.volumes[first_event:last_event].tolist()
+    event_bounds = (event_bounds[start:stop + 1] - first_event).tolist()
+
+    recalculations_triggered = 0
+    for group, transaction_time in enumerate(encoded_orders.transaction_times[start:stop].tolist()):
+        for i in range(event_bounds[group], event_bounds[group + 1]):
+            if takes_values:
+                action_methods[action_codes[i]](initial_ids[i], prices[i], volumes[i], sides[i])
+            else:
+                action_methods[action_codes[i]](
+                    o.Order(initial_id=initial_ids[i], price=prices[i], available_volume=volumes[i]),
+                    sides[i]
+                )
+
+        if order_book.current_best_bid <= highest_buy_prices[group] or order_book.current_best_ask >= lowest_sell_prices[group]:
+            order_book.calculate_order_book_features(transaction_time)
+            recalculations_triggered += 1
+        if record_depth:
+            order_book.record_depth_features(transaction_time)
+
+    # Features hold until the last transaction time applied, not just until their last change
+    if order_book.feature_grid is not None:
+        order_book.feature_grid.advance_to(transaction_time)
+    order_book.recalculations_triggered += recalculations_triggered
+    order_book.recalculations_skipped += stop - start - recalculations_triggered
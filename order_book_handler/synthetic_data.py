@@ -0,0 +1,457 @@
+import os
+import heapq
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+order_columns = [
+    'OrderId', 'InitialId', 'ParentId', 'Side', 'Product', 'DeliveryArea', 'DeliveryStart', 'DeliveryEnd',
+    'CreationTime', 'TransactionTime', 'ValidityTime', 'ActionCode', 'Price', 'Volume', 'Type'
+]
+trade_columns = [
+    'TradeId', 'Side', 'Product', 'DeliveryArea', 'DeliveryStart', 'DeliveryEnd', 'ExecutionTime', 'Price', 'Volume', 'OrderID'
+]
+default_action_mix = {
+    'A': 0.36,
+    'C': 0.14,
+    'P': 0.05,
+    'I': 0.02,
+    'D': 0.20,
+    'M': 0.08,
+    'X': 0.03,
+    'H': 0.12
+}
+
+@dataclass(slots=True)
+class SyntheticMarketConfig:
+    seed : int = 0
+    product_name : str = 'GB_Half_Hour_Power'
+    delivery_area : str = 'GB'
+    delivery_date : str = '2024-01-26'
+    number_of_delivery_periods : int = 48
+    delivery_period_minutes : int = 30
+    events_per_period : int = 20_000
+    events_per_second : float = 2.0
+    same_transaction_time_probability : float = 0.2
+    gate_closure_minutes : int = 60
+    action_mix : Dict[str, float] = field(default_factory=lambda: dict(default_action_mix))
+    crossed_book_probability : float = 0.01
+    reactivation_probability : float = 0.5
+    initial_price : float = 60.0
+    price_volatility : float = 0.02
+    price_offset_scale : float = 2.0
+    tick_size : float = 0.01
+    maximum_volume : int = 50
+
+@dataclass(slots=True)
+class SyntheticOrder:
+    side : str
+    price : float
+    volume : float
+    order_id : int
+
+#Random choice and removal in O(1) by swapping the removed id with the last one
+class RandomIdPool:
+    def __init__(
+        self
+    ):
+        self.ids : List[int] = []
+        self.positions : Dict[int, int] = {}
+
+    def __len__(
+        self
+    ) -> int:
+        return len(self.ids)
+
+    def add(
+        self,
+        initial_id: int
+    ):
+        self.positions[initial_id] = len(self.ids)
+        self.ids.append(initial_id)
+
+    def remove(
+        self,
+        initial_id: int
+    ):
+        position = self.positions.pop(initial_id)
+        last_id = self.ids.pop()
+        if last_id != initial_id:
+            self.ids[position] = last_id
+            self.positions[last_id] = position
+
+    def choose(
+        self,
+        uniform: float
+    ) -> int:
+        return self.ids[int(uniform * len(self.ids))]
+
+#Generates one delivery period's order events, keeping the resting book uncrossed except for the deliberate crosses,
+#each of which is followed by the fills that clear it. Every partial or full fill is recorded as a trade.
+class DeliveryPeriodSimulator:
+    def __init__(
+        self,
+        config: SyntheticMarketConfig,
+        rng: np.random.Generator,
+        next_initial_id: int,
+        next_order_id: int
+    ):
+        self.config = config
+        self.rng = rng
+        self.next_initial_id = next_initial_id
+        self.next_order_id = next_order_id
+        self.live_orders : Dict[int, SyntheticOrder] = {}
+        self.hibernated_orders : Dict[int, SyntheticOrder] = {}
+        self.live_ids = RandomIdPool()
+        self.hibernated_ids = RandomIdPool()
+        self.bid_heap : List[Tuple[float, int]] = []
+        self.ask_heap : List[Tuple[float, int]] = []
+        self.mid_price = config.initial_price
+        self.earliest_next_time = 0
+        self.order_events : List[Tuple] = []
+        self.trade_events : List[Tuple] = []
+
+    def new_order_id(
+        self
+    ) -> int:
+        self.next_order_id += 1
+        return self.next_order_id
+
+    def round_price(
+        self,
+        price: float
+    ) -> float:
+        return round(round(price / self.config.tick_size) * self.config.tick_size, 2)
+
+    #Heaps are cleaned lazily: entries whose order has gone or moved are dropped when they reach the top
+    def best_price(
+        self,
+        side: str
+    ) -> Optional[Tuple[float, int]]:
+        heap = self.bid_heap if side == 'BUY' else self.ask_heap
+        while heap:
+            heap_price, initial_id = heap[0]
+            price = -heap_price if side == 'BUY' else heap_price
+            order = self.live_orders.get(initial_id)
+            if order is not None and order.side == side and order.price == price:
+                return price, initial_id
+            heapq.heappop(heap)
+        return None
+
+    def rest_order(
+        self,
+        initial_id: int,
+        order: SyntheticOrder
+    ):
+        self.live_orders[initial_id] = order
+        self.live_ids.add(initial_id)
+        if order.side == 'BUY':
+            heapq.heappush(self.bid_heap, (-order.price, initial_id))
+        else:
+            heapq.heappush(self.ask_heap, (order.price, initial_id))
+
+    def remove_live_order(
+        self,
+        initial_id: int
+    ) -> SyntheticOrder:
+        self.live_ids.remove(initial_id)
+        return self.live_orders.pop(initial_id)
+
+    #Passive price on the order's own side of the mid, clamped so it never crosses the opposite best
+    def passive_price(
+        self,
+        side: str,
+        offset: float
+    ) -> float:
+        opposite_best = self.best_price('SELL' if side == 'BUY' else 'BUY')
+        if side == 'BUY':
+            price = self.round_price(self.mid_price - self.config.tick_size - offset)
+            if opposite_best is not None:
+                price = min(price, self.round_price(opposite_best[0] - self.config.tick_size))
+        else:
+            price = self.round_price(self.mid_price + self.config.tick_size + offset)
+            if opposite_best is not None:
+                price = max(price, self.round_price(opposite_best[0] + self.config.tick_size))
+        return price
+
+    def record_order_event(
+        self,
+        time: int,
+        initial_id: int,
+        action_code: str,
+        order: SyntheticOrder
+    ):
+        self.order_events.append((time, order.order_id, initial_id, order.side, action_code, order.price, order.volume))
+
+    def record_trade(
+        self,
+        time: int,
+        passive_order: SyntheticOrder,
+        aggressor_order_id: int,
+        price: float,
+        volume: float
+    ):
+        aggressor_side = 'SELL' if passive_order.side == 'BUY' else 'BUY'
+        self.trade_events.append((time, passive_order.side, price, volume, passive_order.order_id))
+        self.trade_events.append((time, aggressor_side, price, volume, aggressor_order_id))
+
+    def add_order(
+        self,
+        time: int,
+        side: str,
+        offset: float,
+        volume: float,
+        uniform: float
+    ):
+        if len(self.hibernated_ids) > 0 and uniform < self.config.reactivation_probability:
+            initial_id = self.hibernated_ids.choose(uniform / self.config.reactivation_probability)
+            self.hibernated_ids.remove(initial_id)
+            order = self.hibernated_orders.pop(initial_id)
+            order = SyntheticOrder(order.side, self.passive_price(order.side, offset), order.volume, self.new_order_id())
+        else:
+            self.next_initial_id += 1
+            initial_id = self.next_initial_id
+            order = SyntheticOrder(side, self.passive_price(side, offset), volume, self.new_order_id())
+        self.rest_order(initial_id, order)
+        self.record_order_event(time, initial_id, 'A', order)
+
+    #An aggressive order priced through the opposite best rests crossed for one transaction time, then both sides fill
+    def add_crossing_order(
+        self,
+        time: int,
+        side: str,
+        offset: float,
+        volume: float
+    ) -> bool:
+        opposite_best = self.best_price('SELL' if side == 'BUY' else 'BUY')
+        if opposite_best is None:
+            return False
+        passive_price, passive_id = opposite_best
+        passive_order = self.live_orders[passive_id]
+        through = self.config.tick_size + offset
+        price = self.round_price(passive_price + through if side == 'BUY' else passive_price - through)
+        volume = min(volume, passive_order.volume)
+
+        self.next_initial_id += 1
+        aggressor_id = self.next_initial_id
+        aggressor_order = SyntheticOrder(side, price, volume, self.new_order_id())
+        self.record_order_event(time, aggressor_id, 'A', aggressor_order)
+
+        #Later events are held back until after the fills so none of them can touch the passive order first
+        fill_time = time + 1_000_000
+        self.earliest_next_time = fill_time + 1_000_000
+        self.record_trade(fill_time, passive_order, aggressor_order.order_id, passive_price, volume)
+        self.record_order_event(fill_time, aggressor_id, 'M', SyntheticOrder(side, price, 0.0, self.new_order_id()))
+        self.fill_order(fill_time, passive_id, volume)
+        return True
+
+    def fill_order(
+        self,
+        time: int,
+        initial_id: int,
+        volume: float
+    ):
+        order = self.live_orders[initial_id]
+        remaining_volume = order.volume - volume
+        if remaining_volume > 0:
+            filled_order = SyntheticOrder(order.side, order.price, remaining_volume, self.new_order_id())
+            self.live_orders[initial_id] = filled_order
+            self.record_order_event(time, initial_id, 'P', filled_order)
+        else:
+            self.remove_live_order(initial_id)
+            self.record_order_event(time, initial_id, 'M', SyntheticOrder(order.side, order.price, 0.0, self.new_order_id()))
+
+    def apply_event(
+        self,
+        time: int,
+        action_code: str,
+        side: str,
+        offset: float,
+        volume: float,
+        uniform: float
+    ):
+        if action_code == 'A' or len(self.live_ids) < 2:
+            self.add_order(time, side, offset, volume, uniform)
+            return
+
+        if action_code == 'D' and len(self.hibernated_ids) > 0 and uniform < 0.1:
+            initial_id = self.hibernated_ids.choose(uniform / 0.1)
+            self.hibernated_ids.remove(initial_id)
+            order = self.hibernated_orders.pop(initial_id)
+            self.record_order_event(time, initial_id, 'D', SyntheticOrder(order.side, order.price, 0.0, self.new_order_id()))
+            return
+
+        initial_id = self.live_ids.choose(uniform)
+        order = self.live_orders[initial_id]
+        if action_code in ('C', 'I'):
+            price = order.price if action_code == 'I' else self.passive_price(order.side, offset)
+            changed_order = SyntheticOrder(order.side, price, volume, self.new_order_id())
+            self.remove_live_order(initial_id)
+            self.rest_order(initial_id, changed_order)
+            self.record_order_event(time, initial_id, action_code, changed_order)
+        elif action_code == 'P':
+            fill_volume = min(volume, order.volume)
+            self.record_trade(time, order, self.new_order_id(), order.price, fill_volume)
+            self.fill_order(time, initial_id, fill_volume)
+        elif action_code == 'M':
+            self.record_trade(time, order, self.new_order_id(), order.price, order.volume)
+            self.fill_order(time, initial_id, order.volume)
+        elif action_code == 'H':
+            self.remove_live_order(initial_id)
+            self.hibernated_orders[initial_id] = order
+            self.hibernated_ids.add(initial_id)
+            self.record_order_event(time, initial_id, 'H', order)
+        else:
+            self.remove_live_order(initial_id)
+            self.record_order_event(time, initial_id, action_code, SyntheticOrder(order.side, order.price, 0.0, self.new_order_id()))
+
+    def simulate(
+        self,
+        transaction_times: np.ndarray
+    ):
+        config = self.config
+        number_of_events = len(transaction_times)
+        action_codes = list(config.action_mix.keys())
+        action_probabilities = np.array(list(config.action_mix.values()), dtype=np.float64)
+        actions = self.rng.choice(action_codes, size=number_of_events, p=action_probabilities / action_probabilities.sum()).tolist()
+        sides = np.where(self.rng.random(number_of_events) < 0.5, 'BUY', 'SELL').tolist()
+        offsets = self.rng.exponential(config.price_offset_scale, number_of_events).tolist()
+        volumes = self.rng.integers(1, config.maximum_volume + 1, number_of_events).astype(np.float64).tolist()
+        uniforms = self.rng.random(number_of_events).tolist()
+        crosses = (self.rng.random(number_of_events) < config.crossed_book_probability).tolist()
+        price_moves = self.rng.normal(0, config.price_volatility, number_of_events).tolist()
+
+        for i, time in enumerate(transaction_times.tolist()):
+            time = max(time, self.earliest_next_time)
+            self.mid_price += price_moves[i]
+            if crosses[i] and self.add_crossing_order(time, sides[i], offsets[i] / 4, volumes[i]):
+                continue
+            self.apply_event(time, actions[i], sides[i], offsets[i], volumes[i], uniforms[i])
+
+#Poisson arrivals at the configured rate, ending at gate closure; some events share the previous transaction time
+def transaction_times_for_period(
+    config: SyntheticMarketConfig,
+    rng: np.random.Generator,
+    delivery_start_ns: int
+) -> np.ndarray:
+    gaps = rng.exponential(1 / config.events_per_second, config.events_per_period)
+    gaps[rng.random(config.events_per_period) < config.same_transaction_time_probability] = 0
+    gaps_ms = np.round(gaps * 1000).astype(np.int64)
+    offsets_ms = np.cumsum(gaps_ms)
+    session_close_ns = delivery_start_ns - config.gate_closure_minutes * 60 * 1_000_000_000
+    session_open_ns = session_close_ns - offsets_ms[-1] * 1_000_000 if len(offsets_ms) else session_close_ns
+    return session_open_ns + offsets_ms * 1_000_000
+
+def generate_synthetic_day(
+    config: SyntheticMarketConfig
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    rng = np.random.default_rng(config.seed)
+    day_start_ns = pd.Timestamp(config.delivery_date, tz='UTC').value
+    period_ns = config.delivery_period_minutes * 60 * 1_000_000_000
+    next_initial_id = 1_000_000
+    next_order_id = 10_000_000
+
+    order_frames = []
+    trade_frames = []
+    for period in range(config.number_of_delivery_periods):
+        delivery_start_ns = day_start_ns + period * period_ns
+        simulator = DeliveryPeriodSimulator(config, rng, next_initial_id, next_order_id)
+        simulator.simulate(transaction_times_for_period(config, rng, delivery_start_ns))
+        next_initial_id = simulator.next_initial_id
+        next_order_id = simulator.next_order_id
+
+        order_events = pd.DataFrame(
+            simulator.order_events,
+            columns=['TransactionTime', 'OrderId', 'InitialId', 'Side', 'ActionCode', 'Price', 'Volume']
+        )
+        order_events['DeliveryStart'] = delivery_start_ns
+        order_frames.append(order_events)
+
+        trade_events = pd.DataFrame(
+            simulator.trade_events,
+            columns=['ExecutionTime', 'Side', 'Price', 'Volume', 'OrderID']
+        )
+        trade_events['DeliveryStart'] = delivery_start_ns
+        trade_frames.append(trade_events)
+
+    orders = pd.concat(order_frames, ignore_index=True).sort_values('TransactionTime', kind='stable', ignore_index=True)
+    trades = pd.concat(trade_frames, ignore_index=True).sort_values('ExecutionTime', kind='stable', ignore_index=True)
+    trades['TradeId'] = np.arange(len(trades)) // 2 + 1
+
+    return format_orders(orders, config, period_ns), format_trades(trades, config, period_ns)
+
+#Same text layout as the EPEX exports, e.g. 2024-01-26T08:30:00Z and 2024-01-26T07:12:03.417Z
+def format_timestamps(
+    timestamps_ns: pd.Series,
+    unit: str
+) -> np.ndarray:
+    return np.char.add(np.datetime_as_string(timestamps_ns.to_numpy(dtype=np.int64).view('datetime64[ns]'), unit=unit), 'Z')
+
+def format_orders(
+    orders: pd.DataFrame,
+    config: SyntheticMarketConfig,
+    period_ns: int
+) -> pd.DataFrame:
+    transaction_times = format_timestamps(orders['TransactionTime'], 'ms')
+    return pd.DataFrame({
+        'OrderId': orders['OrderId'],
+        'InitialId': orders['InitialId'],
+        'ParentId': np.nan,
+        'Side': orders['Side'],
+        'Product': config.product_name,
+        'DeliveryArea': config.delivery_area,
+        'DeliveryStart': format_timestamps(orders['DeliveryStart'], 's'),
+        'DeliveryEnd': format_timestamps(orders['DeliveryStart'] + period_ns, 's'),
+        'CreationTime': transaction_times,
+        'TransactionTime': transaction_times,
+        'ValidityTime': format_timestamps(orders['DeliveryStart'] - config.gate_closure_minutes * 60 * 1_000_000_000, 'ms'),
+        'ActionCode': orders['ActionCode'],
+        'Price': orders['Price'],
+        'Volume': orders['Volume'],
+        'Type': 'Limit'
+    }, columns=order_columns)
+
+def format_trades(
+    trades: pd.DataFrame,
+    config: SyntheticMarketConfig,
+    period_ns: int
+) -> pd.DataFrame:
+    return pd.DataFrame({
+        'TradeId': trades['TradeId'],
+        'Side': trades['Side'],
+        'Product': config.product_name,
+        'DeliveryArea': config.delivery_area,
+        'DeliveryStart': format_timestamps(trades['DeliveryStart'], 's'),
+        'DeliveryEnd': format_timestamps(trades['DeliveryStart'] + period_ns, 's'),
+        'ExecutionTime': format_timestamps(trades['ExecutionTime'], 'ms'),
+        'Price': trades['Price'],
+        'Volume': trades['Volume'],
+        'OrderID': trades['OrderID']
+    }, columns=trade_columns)
+
+#EPEX exports carry one line before the header, which is why they are read with header=1
+def write_epex_csv(
+    frame: pd.DataFrame,
+    filepath: str,
+    description: str
+):
+    with open(filepath, 'w', newline='') as file:
+        file.write(f"# {description}\n")
+        frame.to_csv(file, index=False)
+
+def write_synthetic_day(
+    output_directory: str,
+    config: SyntheticMarketConfig
+) -> Tuple[str, str]:
+    os.makedirs(output_directory, exist_ok=True)
+    orders, trades = generate_synthetic_day(config)
+    date = pd.Timestamp(config.delivery_date)
+    file_date = date.strftime('%Y%m%d')
+    export_time = (date + pd.Timedelta(days=1)).strftime('%Y%m%dT000000000Z')
+    orders_csv_filepath = os.path.join(output_directory, f"Continuous_Orders-{config.delivery_area}-{file_date}-{export_time}.csv")
+    trades_csv_filepath = os.path.join(output_directory, f"Continuous_Trades-{config.delivery_area}-{file_date}-{export_time}.csv")
+    write_epex_csv(orders, orders_csv_filepath, f"Synthetic continuous orders, seed {config.seed}")
+    write_epex_csv(trades, trades_csv_filepath, f"Synthetic continuous trades, seed {config.seed}")
+    print(f"Wrote {len(orders)} synthetic order events and {len(trades) // 2} trades to {output_directory}")
+    return orders_csv_filepath, trades_csv_filepath
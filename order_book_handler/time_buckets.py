@@ -0,0 +1,203 @@
+import numpy as np
+import pandas as pd
+import order_book_handler.feature_table as ft
+from typing import Dict, Optional, Tuple
+
+#Times are bucketed either on the wall clock (aligned to midnight UTC, like resample) or relative to each period's gate closure,
+#where bucket starts are negative Timedeltas counting up to gate closure at zero
+def bucket_origins(
+    delivery_starts_ns: np.ndarray,
+    gate_closure_offset: Optional[pd.Timedelta]
+) -> np.ndarray:
+    if gate_closure_offset is None:
+        return np.zeros(len(delivery_starts_ns), dtype=np.int64)
+    return delivery_starts_ns - pd.Timedelta(gate_closure_offset).value
+
+def bucket_starts(
+    bucket_codes: np.ndarray,
+    bucket_width_ns: int,
+    gate_closure_offset: Optional[pd.Timedelta]
+) -> pd.Index:
+    offsets = bucket_codes * bucket_width_ns
+    if gate_closure_offset is None:
+        return pd.DatetimeIndex(offsets.view('datetime64[ns]')).tz_localize('UTC')
+    return pd.TimedeltaIndex(offsets.view('timedelta64[ns]'))
+
+#Flattens {key: frame} into one set of arrays with an integer code per key
+def stack_by_key(
+    frames_by_key: Dict,
+    columns: Tuple[str, ...]
+) -> Tuple[list, np.ndarray, np.ndarray, Dict[str, np.ndarray]]:
+    keys = list(frames_by_key.keys())
+    lengths = [len(frame) for frame in frames_by_key.values()]
+    key_codes = np.repeat(np.arange(len(keys)), lengths)
+    times = np.concatenate(
+        [ft.to_nanoseconds(frame.index.to_series()) for frame in frames_by_key.values()] + [np.empty(0, dtype=np.int64)]
+    )
+    values = {
+        column: np.concatenate([np.asarray(frame[column] if isinstance(frame, pd.DataFrame) else frame, dtype=np.float64) for frame in frames_by_key.values()] + [np.empty(0)])
+        for column in columns
+    }
+    return keys, key_codes, times, values
+
+#Sums per (key, bucket) in one grouped pass; with fill_empty_buckets every bucket between a key's first and last is present,
+#as resample would give, so plotted lines break across empty buckets
+def grouped_bucket_sums(
+    key_codes: np.ndarray,
+    bucket_codes: np.ndarray,
+    sums: Dict[str, np.ndarray],
+    fill_empty_buckets: bool = True
+) -> pd.DataFrame:
+    grouped = pd.DataFrame({'key': key_codes, 'bucket': bucket_codes, **sums}).groupby(['key', 'bucket'], sort=True).sum()
+    if not fill_empty_buckets or grouped.empty:
+        return grouped
+
+    key_index = grouped.index.get_level_values('key').to_numpy()
+    bucket_index = grouped.index.get_level_values('bucket').to_numpy()
+    first_rows = np.flatnonzero(np.concatenate(([True], key_index[1:] != key_index[:-1])))
+    last_rows = np.append(first_rows[1:], len(key_index)) - 1
+    bucket_counts = bucket_index[last_rows] - bucket_index[first_rows] + 1
+    full_keys = np.repeat(key_index[first_rows], bucket_counts)
+    full_buckets = np.arange(bucket_counts.sum()) - np.repeat(np.cumsum(bucket_counts) - bucket_counts, bucket_counts) + np.repeat(bucket_index[first_rows], bucket_counts)
+    return grouped.reindex(pd.MultiIndex.from_arrays([full_keys, full_buckets], names=['key', 'bucket']), fill_value=0)
+
+def labelled_buckets(
+    grouped: pd.DataFrame,
+    keys: list,
+    key_names: Tuple[str, ...],
+    bucket_width_ns: int,
+    gate_closure_offset: Optional[pd.Timedelta]
+) -> pd.DataFrame:
+    key_codes = grouped.index.get_level_values('key').to_numpy()
+    labels = {}
+    for level, key_name in enumerate(key_names):
+        level_values = np.array([key[level] if len(key_names) > 1 else key for key in keys], dtype=object)
+        labels[key_name] = level_values[key_codes] if len(keys) else np.empty(0, dtype=object)
+    labels['bucket_start'] = bucket_starts(grouped.index.get_level_values('bucket').to_numpy(), bucket_width_ns, gate_closure_offset)
+    return pd.DataFrame(labels)
+
+#VWAP of value_column, traded volume and trade count per bucket, for every delivery period (and side, when keyed by
+#(side, delivery_start)) at once. VWAP is NaN where a bucket has no volume.
+def aggregate_trades(
+    trades_by_key: Dict,
+    bucket_width: str = '5min',
+    value_column: str = 'implicit_trade_cost',
+    volume_column: str = 'trade_volume',
+    gate_closure_offset: Optional[pd.Timedelta] = None,
+    fill_empty_buckets: bool = True,
+    key_names: Tuple[str, ...] = ('delivery_start',)
+) -> pd.DataFrame:
+    bucket_width_ns = pd.Timedelta(bucket_width).value
+    keys, key_codes, times, values = stack_by_key(trades_by_key, (value_column, volume_column))
+    delivery_starts_ns = np.array([pd.Timestamp(key[-1] if isinstance(key, tuple) else key).value for key in keys], dtype=np.int64)
+    bucket_codes = (times - bucket_origins(delivery_starts_ns, gate_closure_offset)[key_codes]) // bucket_width_ns
+
+    grouped = grouped_bucket_sums(
+        key_codes,
+        bucket_codes,
+        {
+            'weighted_value': values[value_column] * values[volume_column],
+            'volume': values[volume_column],
+            'count': np.ones(len(times), dtype=np.int64)
+        },
+        fill_empty_buckets
+    )
+    aggregated = labelled_buckets(grouped, keys, key_names, bucket_width_ns, gate_closure_offset)
+    volume = grouped['volume'].to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        aggregated['vwap'] = np.where(volume > 0, grouped['weighted_value'].to_numpy() / volume, np.nan)
+    aggregated['volume'] = volume
+    aggregated['count'] = grouped['count'].to_numpy()
+    return aggregated
+
+def aggregate_trades_by_side(
+    implicit_buy_costs: Dict[str, pd.DataFrame],
+    implicit_sell_costs: Dict[str, pd.DataFrame],
+    bucket_width: str = '5min',
+    gate_closure_offset: Optional[pd.Timedelta] = None,
+    fill_empty_buckets: bool = True
+) -> pd.DataFrame:
+    trades_by_key = {('buy', delivery_start_time): costs for delivery_start_time, costs in implicit_buy_costs.items()}
+    trades_by_key.update({('sell', delivery_start_time): costs for delivery_start_time, costs in implicit_sell_costs.items()})
+    return aggregate_trades(
+        trades_by_key,
+        bucket_width,
+        gate_closure_offset=gate_closure_offset,
+        fill_empty_buckets=fill_empty_buckets,
+        key_names=('side', 'delivery_start')
+    )
+
+#Mean of the spread at its change points and its time-weighted mean, holding each value until the next change.
+#Each period's last value is held until its end time, by default the period's last change. As in FeatureGrid, time spent
+#at a NaN spread counts towards neither the weighted sum nor the duration of the time-weighted mean.
+def aggregate_spreads(
+    spreads_by_delivery_start: Dict[str, pd.Series],
+    bucket_width: str = '5min',
+    gate_closure_offset: Optional[pd.Timedelta] = None,
+    end_times: Optional[Dict[str, pd.Timestamp]] = None,
+    fill_empty_buckets: bool = True
+) -> pd.DataFrame:
+    bucket_width_ns = pd.Timedelta(bucket_width).value
+    spreads_by_delivery_start = {key: spreads for key, spreads in spreads_by_delivery_start.items() if len(spreads) > 0}
+    keys, key_codes, times, values = stack_by_key(spreads_by_delivery_start, ('spread',))
+    spreads = values['spread']
+    delivery_starts_ns = np.array([pd.Timestamp(key).value for key in keys], dtype=np.int64)
+    origins = bucket_origins(delivery_starts_ns, gate_closure_offset)
+    bucket_codes = (times - origins[key_codes]) // bucket_width_ns
+
+    #Segment boundaries are the change points plus every bucket boundary up to each period's end
+    first_rows = np.flatnonzero(np.concatenate(([True], key_codes[1:] != key_codes[:-1]))) if len(keys) else np.empty(0, dtype=np.int64)
+    last_rows = np.append(first_rows[1:], len(times)) - 1
+    period_ends = times[last_rows].copy()
+    if end_times is not None:
+        for i, key in enumerate(keys):
+            if key in end_times:
+                period_ends[i] = max(period_ends[i], pd.Timestamp(end_times[key]).value)
+    first_boundaries = bucket_codes[first_rows] + 1
+    boundary_counts = np.maximum((period_ends - origins) // bucket_width_ns - first_boundaries + 1, 0)
+    boundary_keys = np.repeat(np.arange(len(keys)), boundary_counts)
+    boundary_buckets = np.arange(boundary_counts.sum()) - np.repeat(np.cumsum(boundary_counts) - boundary_counts, boundary_counts) + np.repeat(first_boundaries, boundary_counts)
+    boundary_times = boundary_buckets * bucket_width_ns + origins[boundary_keys]
+
+    segment_keys = np.concatenate((key_codes, boundary_keys, np.arange(len(keys))))
+    segment_times = np.concatenate((times, boundary_times, period_ends))
+    is_change = np.concatenate((np.ones(len(times), dtype=bool), np.zeros(len(boundary_times) + len(keys), dtype=bool)))
+    change_rows = np.concatenate((np.arange(len(times)), np.full(len(boundary_times) + len(keys), -1)))
+    order = np.lexsort((~is_change, segment_times, segment_keys))
+    segment_keys = segment_keys[order]
+    segment_times = segment_times[order]
+    #Every period starts with a change, so carrying the last change row forward never crosses into another period
+    segment_values = spreads[np.maximum.accumulate(change_rows[order])] if len(order) else np.empty(0)
+    durations = np.zeros(len(segment_times), dtype=np.float64)
+    same_key = segment_keys[1:] == segment_keys[:-1]
+    durations[:-1] = np.where(same_key, segment_times[1:] - segment_times[:-1], 0)
+
+    segment_buckets = (segment_times - origins[segment_keys]) // bucket_width_ns
+    #Period ends falling exactly on a bucket boundary would otherwise open an empty trailing bucket
+    in_period = durations > 0
+    has_spread = ~np.isnan(segment_values[in_period])
+    time_weighted = pd.DataFrame({
+        'key': segment_keys[in_period],
+        'bucket': segment_buckets[in_period],
+        'weighted_spread': np.where(has_spread, segment_values[in_period] * durations[in_period], 0.0),
+        'duration': np.where(has_spread, durations[in_period], 0.0)
+    }).groupby(['key', 'bucket']).sum()
+
+    grouped = grouped_bucket_sums(
+        key_codes,
+        bucket_codes,
+        {'spread_sum': spreads, 'count': np.ones(len(times), dtype=np.int64)},
+        fill_empty_buckets
+    )
+    #Buckets after the last change, up to the period end, only carry a time-weighted value
+    grouped = grouped.reindex(grouped.index.union(time_weighted.index), fill_value=0)
+    aggregated = labelled_buckets(grouped, keys, ('delivery_start',), bucket_width_ns, gate_closure_offset)
+    count = grouped['count'].to_numpy()
+    time_weighted = time_weighted.reindex(grouped.index)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        aggregated['mean_spread'] = np.where(count > 0, grouped['spread_sum'].to_numpy() / count, np.nan)
+        weighted_spread = time_weighted['weighted_spread'].to_numpy()
+        spread_duration = time_weighted['duration'].to_numpy()
+        aggregated['time_weighted_spread'] = np.where(spread_duration > 0, weighted_spread / spread_duration, np.nan)
+    aggregated['count'] = count
+    return aggregated
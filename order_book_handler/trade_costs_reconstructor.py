@@ -1,72 +1,91 @@
-import os
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import order_book_handler.order_book_reconstructor as ob_reconstruction
-from typing import Dict
+import order_book_handler.order_book as ob
+import order_book_handler.columnar_cache as cc
+import order_book_handler.reconstruction_cache as rc
+import order_book_handler.feature_table as ft
+import order_book_handler.metrics as om
+from typing import Dict, Iterable, Iterator, Optional, Tuple
 
 def calculate_implicit_trade_cost_by_product_by_day(
     trades_csv_filepath: str,
     orders_csv_filepath: str,
-    product_name: str
+    product_name: str,
+    cache_directory: Optional[str] = None,
+    reconstruction_cache_directory: Optional[str] = None,
+    metrics: Optional[om.ReconstructionMetrics] = None
 ):
-    trades_one_day = pd.read_csv(
+    features_by_delivery_start_time = rc.load_or_reconstruct_features(
+        orders_csv_filepath,
+        product_name,
+        reconstruction_cache_directory,
+        cache_directory,
+        metrics=metrics
+    )
+    return calculate_implicit_trade_cost_from_features(
         trades_csv_filepath,
-        header=1,
-        usecols=['Product', 'Side', 'DeliveryStart', 'ExecutionTime', 'Price', 'Volume'],
-        dtype={
-            'Price': float,
-            'Volume': float
-        },
-        parse_dates=['ExecutionTime', 'DeliveryStart']
+        product_name,
+        features_by_delivery_start_time,
+        cache_directory,
+        metrics
     )
-    
-    trades_one_day_one_product = trades_one_day[trades_one_day['Product'] == product_name]
-    unique_trades_one_day_one_product = trades_one_day_one_product[trades_one_day_one_product['Side'] == 'BUY']  # Arbitrarily filter to get only the unique trades (since both buy and sell feature in the trade book)
-    
-    order_book_by_delivery_start_time = ob_reconstruction.reconstruct_order_book_one_product_one_day(
-        orders_csv_filepath,
-        product_name
+
+def calculate_implicit_trade_cost_from_order_books(
+    trades_csv_filepath: str,
+    product_name: str,
+    order_books: Dict[str, ob.OrderBook],
+    cache_directory: Optional[str] = None,
+    metrics: Optional[om.ReconstructionMetrics] = None
+):
+    return calculate_implicit_trade_cost_from_features(
+        trades_csv_filepath,
+        product_name,
+        rc.features_from_order_books(order_books),
+        cache_directory,
+        metrics
     )
-    
-    midprice_df_by_delivery_start_time = {
-        delivery_start_time: pd.DataFrame.from_dict(
-            order_book.mid_price_over_time,
-            orient='index',
-            columns=['mid_price']
+
+def calculate_implicit_trade_cost_from_features(
+    trades_csv_filepath: str,
+    product_name: str,
+    features_by_delivery_start_time: Dict[str, pd.DataFrame],
+    cache_directory: Optional[str] = None,
+    metrics: Optional[om.ReconstructionMetrics] = None
+):
+    with om.stage(metrics, 'read_trades'):
+        trades_one_day_one_product = cc.read_epex_csv(
+            trades_csv_filepath,
+            product_name,
+            ['Product', 'Side', 'DeliveryStart', 'ExecutionTime', 'Price', 'Volume'],
+            cache_directory,
+            dtype={
+                'Price': float,
+                'Volume': float
+            },
+            parse_dates=['ExecutionTime', 'DeliveryStart']
         )
-        for delivery_start_time, order_book in order_book_by_delivery_start_time.items()
-    }
     
-    implicit_trade_costs_and_volumes = {}
+    unique_trades_one_day_one_product = trades_one_day_one_product[trades_one_day_one_product['Side'] == 'BUY']  # Arbitrarily filter to get only the unique trades (since both buy and sell feature in the trade book)
+    
+    with om.stage(metrics, 'trade_cost_join'):
+        previous_mid_prices = previous_mid_prices_before_trades(unique_trades_one_day_one_product, features_by_delivery_start_time)
+    record_trade_counts(metrics, previous_mid_prices)
+    unique_trades_one_day_one_product = unique_trades_one_day_one_product.assign(
+        previous_mid_price=previous_mid_prices
+    ).dropna(subset=['previous_mid_price'])
+    implicit_trade_costs = pd.DataFrame({
+        'implicit_trade_cost': (unique_trades_one_day_one_product['Price'] - unique_trades_one_day_one_product['previous_mid_price']).abs(),
+        'trade_volume': unique_trades_one_day_one_product['Volume']
+    })
+    implicit_trade_costs.index = pd.Index(unique_trades_one_day_one_product['ExecutionTime']).rename(None)
     
-    for delivery_start_time, midprice_df in midprice_df_by_delivery_start_time.items():
-        trades_for_delivery_start_time = unique_trades_one_day_one_product[unique_trades_one_day_one_product['DeliveryStart'] == delivery_start_time]
-        trade_costs = {}
-        execution_times = trades_for_delivery_start_time['ExecutionTime'].sort_values()
-        midprice_times = midprice_df.index.sort_values()
-        
-        closest_index = np.searchsorted(midprice_times, execution_times, side='right') - 1
-        closest_times = midprice_times[closest_index]
-        previous_mid_prices = pd.Series(midprice_df.loc[closest_times, 'mid_price']).values
-        prices = trades_for_delivery_start_time['Price'].to_numpy()
-        volumes = trades_for_delivery_start_time['Volume'].values
-        implicit_trade_costs = np.abs(prices - previous_mid_prices)
-        #TODO - may be ablke to delete this, once happy with the vectorised operations
-        for index, trade_row in trades_for_delivery_start_time.iterrows():
-            execution_time = trade_row['ExecutionTime']
-            earlier_times = midprice_df[midprice_df.index < execution_time]
-            closest_earlier_time = earlier_times.index[-1]
-            previous_mid_price = midprice_df.loc[closest_earlier_time, 'mid_price']
-            implicit_trade_cost = abs(trade_row['Price'] - previous_mid_price)
-            trade_costs[execution_time] = (implicit_trade_cost, trade_row['Volume'])
-        #Delete up to here, and then change the conversion to a dataframe
-        implicit_trade_costs_and_volumes[delivery_start_time] = pd.DataFrame.from_dict(
-            trade_costs,
-            orient='index',
-            columns=['implicit_trade_cost', 'trade_volume']
+    with om.stage(metrics, 'split_by_delivery_start'):
+        implicit_trade_costs_and_volumes = split_by_delivery_start(
+            implicit_trade_costs,
+            unique_trades_one_day_one_product['DeliveryStart'],
+            features_by_delivery_start_time
         )
-        print(f"Implicit trade costs calculated for delivery start time: {delivery_start_time}")
+    print(f"Implicit trade costs calculated for {len(implicit_trade_costs_and_volumes)} delivery start times")
     
     return implicit_trade_costs_and_volumes
 
@@ -74,67 +93,186 @@ def calculate_implicit_trade_cost_by_product_by_day(
 def calculate_implicit_trade_costs_by_side_by_product_by_day(
     trades_csv_filepath: str,
     orders_csv_filepath: str,
-    product_name: str
+    product_name: str,
+    cache_directory: Optional[str] = None,
+    reconstruction_cache_directory: Optional[str] = None,
+    metrics: Optional[om.ReconstructionMetrics] = None
 ):
-    trades_one_day = pd.read_csv(
+    features_by_delivery_start_time = rc.load_or_reconstruct_features(
+        orders_csv_filepath,
+        product_name,
+        reconstruction_cache_directory,
+        cache_directory,
+        metrics=metrics
+    )
+    return calculate_implicit_trade_costs_by_side_from_features(
         trades_csv_filepath,
-        header=1,
-        usecols=['TradeId', 'Product', 'Side', 'DeliveryStart', 'ExecutionTime', 'Price', 'Volume', 'OrderID']
+        product_name,
+        features_by_delivery_start_time,
+        cache_directory,
+        metrics
     )
-    
-    trades_one_day_one_product = trades_one_day[trades_one_day['Product'] == product_name]
-    
-    order_book_by_delivery_start_time = ob_reconstruction.reconstruct_order_book_one_product_one_day(
-        orders_csv_filepath,
-        product_name
+
+def calculate_implicit_trade_costs_by_side_from_order_books(
+    trades_csv_filepath: str,
+    product_name: str,
+    order_books: Dict[str, ob.OrderBook],
+    cache_directory: Optional[str] = None,
+    metrics: Optional[om.ReconstructionMetrics] = None
+):
+    return calculate_implicit_trade_costs_by_side_from_features(
+        trades_csv_filepath,
+        product_name,
+        rc.features_from_order_books(order_books),
+        cache_directory,
+        metrics
     )
-    
-    midprice_df_by_delivery_start_time = {
-        delivery_start_time: pd.DataFrame.from_dict(
-            order_book.mid_price_over_time,
-            orient='index',
-            columns=['mid_price']
+
+def calculate_implicit_trade_costs_by_side_from_features(
+    trades_csv_filepath: str,
+    product_name: str,
+    features_by_delivery_start_time: Dict[str, pd.DataFrame],
+    cache_directory: Optional[str] = None,
+    metrics: Optional[om.ReconstructionMetrics] = None
+):
+    aggressor_trades = read_aggressor_trades(trades_csv_filepath, product_name, cache_directory, metrics)
+    implicit_buy_costs_by_start_time, implicit_sell_costs_by_start_time = implicit_trade_costs_by_side(
+        aggressor_trades,
+        features_by_delivery_start_time,
+        metrics
+    )
+    print(f"Implicit trade costs by side calculated for {len(features_by_delivery_start_time)} delivery start times")
+
+    return implicit_buy_costs_by_start_time, implicit_sell_costs_by_start_time
+
+#Consumes (delivery_start, features) as the reconstruction yields them and yields (delivery_start, features, buy costs, sell costs),
+#so a period's features can be released once its costs are taken. Trades are read once, up front.
+def stream_implicit_trade_costs_by_side(
+    trades_csv_filepath: str,
+    product_name: str,
+    feature_stream: Iterable[Tuple[str, pd.DataFrame]],
+    cache_directory: Optional[str] = None,
+    metrics: Optional[om.ReconstructionMetrics] = None
+) -> Iterator[Tuple[str, pd.DataFrame, pd.DataFrame, pd.DataFrame]]:
+    aggressor_trades = read_aggressor_trades(trades_csv_filepath, product_name, cache_directory, metrics)
+    trades_by_delivery_start = dict(list(aggressor_trades.groupby(ft.to_nanoseconds(aggressor_trades['DeliveryStart']), sort=False)))
+    no_trades = aggressor_trades.iloc[:0]
+    del aggressor_trades
+    for delivery_start_time, features in feature_stream:
+        trades = trades_by_delivery_start.pop(pd.Timestamp(delivery_start_time).value, no_trades)
+        implicit_buy_costs, implicit_sell_costs = implicit_trade_costs_by_side(trades, {delivery_start_time: features}, metrics)
+        yield delivery_start_time, features, implicit_buy_costs[delivery_start_time], implicit_sell_costs[delivery_start_time]
+
+#This keeps the aggressor of each trade, based on the later order ID in a transaction pair
+def read_aggressor_trades(
+    trades_csv_filepath: str,
+    product_name: str,
+    cache_directory: Optional[str] = None,
+    metrics: Optional[om.ReconstructionMetrics] = None
+) -> pd.DataFrame:
+    with om.stage(metrics, 'read_trades'):
+        trades_one_day_one_product = cc.read_epex_csv(
+            trades_csv_filepath,
+            product_name,
+            ['TradeId', 'Product', 'Side', 'DeliveryStart', 'ExecutionTime', 'Price', 'Volume', 'OrderID'],
+            cache_directory,
+            parse_dates=['ExecutionTime']
         )
-        for delivery_start_time, order_book in order_book_by_delivery_start_time.items()
-    }
     
-    implicit_buy_costs_by_start_time = {}
-    implicit_sell_costs_by_start_time = {}
+    with om.stage(metrics, 'trade_cost_join'):
+        aggressor_rows = trades_one_day_one_product.groupby(['DeliveryStart', 'TradeId'])['OrderID'].idxmax()
+        return trades_one_day_one_product.loc[aggressor_rows.dropna()]
+
+def implicit_trade_costs_by_side(
+    aggressor_trades: pd.DataFrame,
+    features_by_delivery_start_time: Dict[str, pd.DataFrame],
+    metrics: Optional[om.ReconstructionMetrics] = None
+) -> Tuple[Dict[str, pd.DataFrame], Dict[str, pd.DataFrame]]:
+    with om.stage(metrics, 'trade_cost_join'):
+        previous_mid_prices = previous_mid_prices_before_trades(aggressor_trades, features_by_delivery_start_time)
+    record_trade_counts(metrics, previous_mid_prices)
+    aggressor_trades = aggressor_trades.assign(
+        previous_mid_price=previous_mid_prices
+    ).dropna(subset=['previous_mid_price'])
+    implicit_trade_costs = pd.DataFrame({
+        'implicit_trade_cost': (aggressor_trades['Price'] - aggressor_trades['previous_mid_price']).abs(),
+        'trade_volume': aggressor_trades['Volume'],
+        'trade_price': aggressor_trades['Price']
+    })
+    implicit_trade_costs.index = pd.Index(aggressor_trades['ExecutionTime']).rename(None)
     
-    for delivery_start_time, midprice_df in midprice_df_by_delivery_start_time.items():
-        trades_for_delivery_start_time = trades_one_day_one_product[trades_one_day_one_product['DeliveryStart'] == delivery_start_time]
-        buy_costs = {}
-        sell_costs = {}
-        #TODO - the same goes for here as the function above
-        for trade_id, trades in trades_for_delivery_start_time.groupby('TradeId'):
-            max_orderid_row = trades.loc[trades['OrderID'].idxmax()]
-            execution_time = max_orderid_row['ExecutionTime']
-            side = str(max_orderid_row['Side'])
-            price = max_orderid_row['Price']
-            volume = max_orderid_row['Volume']
+    is_buy = (aggressor_trades['Side'] == 'BUY').to_numpy()
+    is_sell = (aggressor_trades['Side'] == 'SELL').to_numpy()
+    with om.stage(metrics, 'split_by_delivery_start'):
+        implicit_buy_costs_by_start_time = split_by_delivery_start(
+            implicit_trade_costs[is_buy],
+            aggressor_trades['DeliveryStart'][is_buy],
+            features_by_delivery_start_time
+        )
+        implicit_sell_costs_by_start_time = split_by_delivery_start(
+            implicit_trade_costs[is_sell],
+            aggressor_trades['DeliveryStart'][is_sell],
+            features_by_delivery_start_time
+        )
+    return implicit_buy_costs_by_start_time, implicit_sell_costs_by_start_time
 
-            earlier_times = midprice_df[midprice_df.index < execution_time]
-            
-            if not earlier_times.empty:
-                closest_earlier_time = earlier_times.index[-1]
-                previous_mid_price = midprice_df.loc[closest_earlier_time, 'mid_price']
-                if side == 'BUY':
-                    implicit_trade_cost = price - previous_mid_price # type: ignore
-                    buy_costs[execution_time] = (abs(implicit_trade_cost), volume, price)
-                elif side == 'SELL':
-                    implicit_trade_cost = previous_mid_price - price # type: ignore
-                    sell_costs[execution_time] = (abs(implicit_trade_cost), volume, price)
+def record_trade_counts(
+    metrics: Optional[om.ReconstructionMetrics],
+    previous_mid_prices: np.ndarray
+):
+    if metrics is not None:
+        metrics.increment('trades_costed', int(np.count_nonzero(~np.isnan(previous_mid_prices))))
+        metrics.increment('trades_without_previous_mid_price', int(np.count_nonzero(np.isnan(previous_mid_prices))))
 
-        implicit_buy_costs_by_start_time[delivery_start_time] = pd.DataFrame.from_dict(
-            buy_costs,
-            orient='index',
-            columns=['implicit_trade_cost', 'trade_volume', 'trade_price']
-        )
-        implicit_sell_costs_by_start_time[delivery_start_time] = pd.DataFrame.from_dict(
-            sell_costs,
-            orient='index',
-            columns=['implicit_trade_cost', 'trade_volume', 'trade_price']
+#One as-of join over every delivery period: the last mid price strictly before each trade, NaN if there is none
+def previous_mid_prices_before_trades(
+    trades: pd.DataFrame,
+    features_by_delivery_start_time: Dict[str, pd.DataFrame]
+) -> np.ndarray:
+    mid_prices_by_delivery_start_time = {
+        pd.Timestamp(delivery_start_time).value: features['mid_price'].dropna()
+        for delivery_start_time, features in features_by_delivery_start_time.items()
+    }
+    mid_prices = pd.DataFrame({
+        'delivery_start': np.repeat(
+            np.array(list(mid_prices_by_delivery_start_time.keys()), dtype=np.int64),
+            [len(mid_price) for mid_price in mid_prices_by_delivery_start_time.values()]
+        ),
+        'time': np.concatenate(
+            [ft.to_nanoseconds(mid_price.index.to_series()) for mid_price in mid_prices_by_delivery_start_time.values()] + [np.empty(0, dtype=np.int64)]
+        ),
+        'previous_mid_price': np.concatenate(
+            [mid_price.to_numpy() for mid_price in mid_prices_by_delivery_start_time.values()] + [np.empty(0)]
         )
-        print(f"Implicit trade costs by side calculated for delivery start time: {delivery_start_time}")
+    }).sort_values('time', kind='stable')
+    
+    trade_times = pd.DataFrame({
+        'delivery_start': ft.to_nanoseconds(trades['DeliveryStart']),
+        'time': ft.to_nanoseconds(trades['ExecutionTime']),
+        'row': np.arange(len(trades))
+    }).sort_values('time', kind='stable')
+    
+    joined = pd.merge_asof(
+        trade_times,
+        mid_prices,
+        on='time',
+        by='delivery_start',
+        direction='backward',
+        allow_exact_matches=False
+    )
+    previous_mid_prices = np.full(len(trades), np.nan)
+    previous_mid_prices[joined['row'].to_numpy()] = joined['previous_mid_price'].to_numpy()
+    return previous_mid_prices
 
-    return implicit_buy_costs_by_start_time, implicit_sell_costs_by_start_time
+#Splits costs back out per delivery period, keeping the first position and last value for repeated execution times as the per-period dicts used to
+def split_by_delivery_start(
+    implicit_trade_costs: pd.DataFrame,
+    delivery_starts: pd.Series,
+    features_by_delivery_start_time: Dict[str, pd.DataFrame]
+) -> Dict[str, pd.DataFrame]:
+    costs_by_delivery_start = dict(list(implicit_trade_costs.groupby(ft.to_nanoseconds(delivery_starts), sort=False)))
+    implicit_trade_costs_by_delivery_start_time = {}
+    for delivery_start_time in features_by_delivery_start_time.keys():
+        costs = costs_by_delivery_start.get(pd.Timestamp(delivery_start_time).value, implicit_trade_costs.iloc[:0])
+        implicit_trade_costs_by_delivery_start_time[delivery_start_time] = costs[~costs.index.duplicated(keep='last')].reindex(costs.index.unique())
+    return implicit_trade_costs_by_delivery_start_time
@@ -0,0 +1,226 @@
+import numpy as np
+import pandas as pd
+import order_book_handler.columnar_cache as cc
+import order_book_handler.feature_table as ft
+import order_book_handler.price_impact as pi
+import order_book_handler.order_book as ob
+import order_book_handler.replay_engine as replay
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+#Order events of one day and product, sorted by transaction time, with hash indexes from OrderId to its event row and
+#from InitialId to the order's first event, so trades are resolved in one get_indexer call rather than a filter per trade
+@dataclass(slots=True)
+class OrderEventIndex:
+    order_ids : np.ndarray
+    initial_ids : np.ndarray
+    transaction_times : np.ndarray
+    prices : np.ndarray
+    volumes : np.ndarray
+    action_codes : np.ndarray
+    order_id_index : pd.Index
+    order_id_event_rows : np.ndarray
+    initial_id_index : pd.Index
+    entry_event_rows : np.ndarray
+
+    def __len__(
+        self
+    ) -> int:
+        return len(self.order_ids)
+
+    #Event row for each OrderID, -1 where the orders file has no such event
+    def rows_for_order_ids(
+        self,
+        order_ids: np.ndarray
+    ) -> np.ndarray:
+        positions = self.order_id_index.get_indexer(order_ids)
+        return np.where(positions >= 0, self.order_id_event_rows[positions], -1)
+
+    #Row of the first event of each InitialId, -1 where it is unknown
+    def entry_rows_for_initial_ids(
+        self,
+        initial_ids: np.ndarray
+    ) -> np.ndarray:
+        positions = self.initial_id_index.get_indexer(initial_ids)
+        return np.where(positions >= 0, self.entry_event_rows[positions], -1)
+
+def read_order_events(
+    orders_csv_filepath: str,
+    product_name: str,
+    cache_directory: Optional[str] = None
+) -> pd.DataFrame:
+    return cc.read_epex_csv(
+        orders_csv_filepath,
+        product_name,
+        ['OrderId', 'InitialId', 'Side', 'Product', 'DeliveryStart', 'TransactionTime', 'ActionCode', 'Price', 'Volume'],
+        cache_directory,
+        parse_dates=['TransactionTime']
+    )
+
+def build_order_event_index(
+    orders: pd.DataFrame
+) -> OrderEventIndex:
+    orders = orders.dropna(subset=['OrderId', 'InitialId', 'TransactionTime'])
+    transaction_times = ft.to_nanoseconds(orders['TransactionTime'])
+    order = np.argsort(transaction_times, kind='stable')
+    order_ids = orders['OrderId'].to_numpy(dtype=np.int64)[order]
+    initial_ids = orders['InitialId'].to_numpy(dtype=np.int64)[order]
+
+    #A repeated OrderId resolves to its earliest event, and an InitialId's entry is its earliest event
+    unique_order_ids, order_id_event_rows = np.unique(order_ids, return_index=True)
+    unique_initial_ids, entry_event_rows = np.unique(initial_ids, return_index=True)
+    return OrderEventIndex(
+        order_ids=order_ids,
+        initial_ids=initial_ids,
+        transaction_times=transaction_times[order],
+        prices=orders['Price'].to_numpy(dtype=np.float64)[order],
+        volumes=orders['Volume'].to_numpy(dtype=np.float64)[order],
+        action_codes=orders['ActionCode'].astype(str).to_numpy()[order],
+        order_id_index=pd.Index(unique_order_ids),
+        order_id_event_rows=order_id_event_rows,
+        initial_id_index=pd.Index(unique_initial_ids),
+        entry_event_rows=entry_event_rows
+    )
+
+#The aggressor of each trade is the side with the larger OrderID, as in the implicit trade cost calculation
+def trade_roles(
+    trades: pd.DataFrame
+) -> np.ndarray:
+    largest_order_ids = trades.groupby(['DeliveryStart', 'TradeId'])['OrderID'].transform('max')
+    return np.where((trades['OrderID'] == largest_order_ids).to_numpy(), 'aggressor', 'passive')
+
+#Rank of each order's entry price among the price levels on its side (1 at the best), in the book reconstructed from the
+#delivery period's events up to, but not including, the transaction time of the order's first event. The book is replayed
+#once, pausing at each entry in time order; -1 where the entry time is not one of the period's transaction times.
+def entry_level_ranks(
+    encoded_orders: replay.EncodedOrders,
+    entry_times: np.ndarray,
+    entry_prices: np.ndarray,
+    is_buy: np.ndarray
+) -> np.ndarray:
+    level_ranks = np.full(len(entry_times), -1, dtype=np.int64)
+    groups = np.searchsorted(encoded_orders.transaction_times, entry_times)
+    found = groups < len(encoded_orders.transaction_times)
+    found[found] = encoded_orders.transaction_times[groups[found]] == entry_times[found]
+    found &= ~np.isnan(entry_prices)
+    rows = np.flatnonzero(found)
+    rows = rows[np.argsort(groups[rows], kind='stable')]
+
+    order_book = ob.OrderBook(record_feature_changes=False)
+    groups_replayed = 0
+    for row in rows.tolist():
+        group = int(groups[row])
+        replay.replay_transaction_times(order_book, encoded_orders, groups_replayed, group)
+        groups_replayed = max(groups_replayed, group)
+        level_ranks[row] = order_book.price_levels['BUY' if is_buy[row] else 'SELL'].level_rank(entry_prices[row])
+    return level_ranks
+
+#One row per trade row (both the resting and aggressing side of every trade), linked to the order event it filled.
+#Time to fill runs from the order's first event to the execution. With features, the order's distance behind the
+#best price on its own side in force just before execution is given for passive fills (0 at the best, NaN without a
+#book). An aggressor crosses the spread rather than queueing behind the best, so its distance and at_best are NaN.
+#With the encoded orders of each delivery period, entry_level_rank is the order's price-level position when it entered
+#the book, for both roles: 1 when it joined or set the best price on its side, NA where its entry cannot be replayed.
+def link_trades_to_orders(
+    trades: pd.DataFrame,
+    order_event_index: OrderEventIndex,
+    features_by_delivery_start_time: Optional[Dict[str, pd.DataFrame]] = None,
+    encoded_orders_by_delivery_start_time: Optional[Dict[str, replay.EncodedOrders]] = None
+) -> pd.DataFrame:
+    execution_times = ft.to_nanoseconds(trades['ExecutionTime'])
+    order_rows = order_event_index.rows_for_order_ids(trades['OrderID'].to_numpy(dtype=np.int64))
+    linked = order_rows >= 0
+    linked_rows = order_rows[linked]
+
+    initial_ids = np.full(len(trades), -1, dtype=np.int64)
+    initial_ids[linked] = order_event_index.initial_ids[linked_rows]
+    entry_rows = np.where(linked, order_event_index.entry_rows_for_initial_ids(initial_ids), -1)
+    has_entry = entry_rows >= 0
+
+    order_prices = np.full(len(trades), np.nan)
+    order_prices[linked] = order_event_index.prices[linked_rows]
+    order_volumes = np.full(len(trades), np.nan)
+    order_volumes[linked] = order_event_index.volumes[linked_rows]
+    #The int64 minimum is NaT once viewed as datetime64
+    order_event_times = np.full(len(trades), np.iinfo(np.int64).min, dtype=np.int64)
+    order_event_times[linked] = order_event_index.transaction_times[linked_rows]
+    entry_times = np.full(len(trades), np.iinfo(np.int64).min, dtype=np.int64)
+    entry_times[has_entry] = order_event_index.transaction_times[entry_rows[has_entry]]
+
+    trade_links = pd.DataFrame({
+        'trade_id': trades['TradeId'].to_numpy(),
+        'delivery_start': trades['DeliveryStart'].to_numpy(),
+        'side': trades['Side'].to_numpy(),
+        'role': trade_roles(trades),
+        'order_id': trades['OrderID'].to_numpy(),
+        'initial_id': pd.arrays.IntegerArray(initial_ids, ~linked),
+        'trade_price': trades['Price'].to_numpy(dtype=np.float64),
+        'trade_volume': trades['Volume'].to_numpy(dtype=np.float64),
+        'order_price': order_prices,
+        'order_volume': order_volumes,
+        'order_event_time': pd.DatetimeIndex(order_event_times.view('datetime64[ns]')).tz_localize('UTC'),
+        'entry_time': pd.DatetimeIndex(entry_times.view('datetime64[ns]')).tz_localize('UTC'),
+        'time_to_fill_seconds': np.where(has_entry, (execution_times - entry_times) / 1e9, np.nan)
+    })
+
+    is_buy = (trades['Side'] == 'BUY').to_numpy()
+    rows_by_delivery_start = pd.Series(np.arange(len(trades))).groupby(ft.to_nanoseconds(trades['DeliveryStart'])).indices
+    if features_by_delivery_start_time is not None:
+        distances_to_best = np.full(len(trades), np.nan)
+        is_passive = trade_links['role'].to_numpy() == 'passive'
+        for delivery_start_time, features in features_by_delivery_start_time.items():
+            in_period = rows_by_delivery_start.get(pd.Timestamp(delivery_start_time).value)
+            if in_period is None:
+                continue
+            best_prices = pi.values_as_of(
+                ft.to_nanoseconds(features.index.to_series()),
+                {side: features[column].to_numpy(dtype=np.float64) for side, column in (('BUY', 'best_bid'), ('SELL', 'best_ask'))},
+                execution_times[in_period],
+                strictly_before=True
+            )
+            period_is_buy = is_buy[in_period]
+            distances_to_best[in_period] = np.where(
+                is_passive[in_period],
+                np.where(period_is_buy, best_prices['BUY'] - order_prices[in_period], order_prices[in_period] - best_prices['SELL']),
+                np.nan
+            )
+        trade_links['distance_to_best'] = distances_to_best
+        trade_links['at_best'] = pd.arrays.BooleanArray(distances_to_best <= 0, np.isnan(distances_to_best))
+
+    if encoded_orders_by_delivery_start_time is not None:
+        level_ranks = np.full(len(trades), -1, dtype=np.int64)
+        entry_prices = np.full(len(trades), np.nan)
+        entry_prices[has_entry] = order_event_index.prices[entry_rows[has_entry]]
+        for delivery_start_time, encoded_orders in encoded_orders_by_delivery_start_time.items():
+            in_period = rows_by_delivery_start.get(pd.Timestamp(delivery_start_time).value)
+            if in_period is None:
+                continue
+            in_period = in_period[has_entry[in_period]]
+            level_ranks[in_period] = entry_level_ranks(encoded_orders, entry_times[in_period], entry_prices[in_period], is_buy[in_period])
+        trade_links['entry_level_rank'] = pd.arrays.IntegerArray(level_ranks, level_ranks < 0)
+
+    trade_links.index = pd.DatetimeIndex(execution_times.view('datetime64[ns]'), name='execution_time').tz_localize('UTC')
+    return trade_links
+
+def calculate_trade_order_linkage(
+    trades_csv_filepath: str,
+    orders_csv_filepath: str,
+    product_name: str,
+    features_by_delivery_start_time: Optional[Dict[str, pd.DataFrame]] = None,
+    cache_directory: Optional[str] = None,
+    level_ranks: bool = False
+) -> pd.DataFrame:
+    orders = read_order_events(orders_csv_filepath, product_name, cache_directory)
+    order_event_index = build_order_event_index(orders)
+    encoded_orders_by_delivery_start_time = replay.encode_orders_by_delivery_start(orders) if level_ranks else None
+    del orders
+    trades = cc.read_epex_csv(
+        trades_csv_filepath,
+        product_name,
+        ['TradeId', 'Product', 'Side', 'DeliveryStart', 'ExecutionTime', 'Price', 'Volume', 'OrderID'],
+        cache_directory,
+        parse_dates=['ExecutionTime']
+    )
+    trade_links = link_trades_to_orders(trades, order_event_index, features_by_delivery_start_time, encoded_orders_by_delivery_start_time)
+    print(f"Linked {int(trade_links['initial_id'].notna().sum())} of {len(trade_links)} trade rows to order events")
+    return trade_links
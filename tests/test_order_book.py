@@ -0,0 +1,158 @@
+import numpy as np
+import pandas as pd
+import pytest
+import order_book_handler.order_book as ob
+import order_book_handler.price_levels as pl
+import order_book_handler.order_book_reconstructor as ob_reconstruction
+import order_book_handler.replay_engine as replay
+import order_book_handler.checkpoints as checkpoints
+import order_book_handler.differential_replay as dr
+import order_book_handler.synthetic_data as sd
+
+depth_levels = 3
+depth_price_band = 0.5
+
+@pytest.fixture(scope='module')
+def synthetic_orders(
+    tmp_path_factory
+) -> pd.DataFrame:
+    config = sd.SyntheticMarketConfig(seed=7, number_of_delivery_periods=2, events_per_period=1500)
+    orders_csv_filepath, _ = sd.write_synthetic_day(str(tmp_path_factory.mktemp('synthetic')), config)
+    return ob_reconstruction.read_orders(orders_csv_filepath, config.product_name)
+
+@pytest.fixture(scope='module')
+def encoded_orders_by_delivery_start(
+    synthetic_orders
+):
+    return replay.encode_orders_by_delivery_start(synthetic_orders)
+
+def live_level_volumes(
+    order_book,
+    side: str
+) -> pd.Series:
+    volumes = pd.Series(
+        [order.available_volume for order in order_book.orders[side].values() if order.price == order.price],
+        index=[order.price for order in order_book.orders[side].values() if order.price == order.price],
+        dtype=np.float64
+    )
+    return volumes.groupby(level=0).sum().sort_index(ascending=side == 'SELL')
+
+def volume_imbalance(
+    bid_volume: float,
+    ask_volume: float
+) -> float:
+    return (bid_volume - ask_volume) / (bid_volume + ask_volume) if bid_volume + ask_volume > 0 else np.nan
+
+#The depth row a book records, recalculated from its resting orders
+def recalculated_depth_row(
+    order_book
+) -> list:
+    bid_volumes = live_level_volumes(order_book, 'BUY')
+    ask_volumes = live_level_volumes(order_book, 'SELL')
+    top_bid_volumes = list(bid_volumes.iloc[:depth_levels]) + [0.0] * (depth_levels - len(bid_volumes.iloc[:depth_levels]))
+    top_ask_volumes = list(ask_volumes.iloc[:depth_levels]) + [0.0] * (depth_levels - len(ask_volumes.iloc[:depth_levels]))
+    row = top_bid_volumes + top_ask_volumes + [volume_imbalance(sum(top_bid_volumes), sum(top_ask_volumes))]
+    if order_book.feature_updates > 0:
+        mid_price = order_book.current_mid_price
+        bid_depth = bid_volumes[(bid_volumes.index >= mid_price - depth_price_band) & (bid_volumes.index <= mid_price)].sum()
+        ask_depth = ask_volumes[(ask_volumes.index >= mid_price) & (ask_volumes.index <= mid_price + depth_price_band)].sum()
+        row += [bid_depth, ask_depth, volume_imbalance(bid_depth, ask_depth)]
+    else:
+        row += [np.nan, np.nan, np.nan]
+    hibernated_volumes = [sum(order.available_volume for order in order_book.hibernated_orders[side].values()) for side in replay.SIDES]
+    return row + [bid_volumes.sum(), ask_volumes.sum()] + hibernated_volumes
+
+def book_state(
+    order_book
+) -> tuple:
+    return (
+        {side: dr.order_values(order_book.orders[side]) for side in replay.SIDES},
+        {side: dr.order_values(order_book.hibernated_orders[side]) for side in replay.SIDES},
+        (
+            order_book.current_best_bid,
+            order_book.current_best_ask,
+            order_book.current_bid_ask_spread,
+            order_book.current_mid_price,
+            order_book.current_relative_bid_ask_spread
+        )
+    )
+
+def test_running_level_totals_match_a_full_resum():
+    rng = np.random.default_rng(0)
+    for best_is_highest in (True, False):
+        price_levels = pl.PriceLevels(depth_levels, best_is_highest=best_is_highest)
+        resting_orders = {}
+        for initial_id in range(5_000):
+            if resting_orders and rng.random() < 0.45:
+                removed_id = int(rng.choice(list(resting_orders)))
+                price_levels.remove(resting_orders.pop(removed_id), removed_id)
+            else:
+                price = round(60 + rng.integers(-40, 40) * 0.05, 2)
+                price_levels.add(price, initial_id, float(rng.integers(1, 50)))
+                resting_orders[initial_id] = price
+
+            top_levels = price_levels.prices[::-1][:depth_levels] if best_is_highest else price_levels.prices[:depth_levels]
+            assert price_levels.top_levels_volume == pytest.approx(sum(price_levels.levels[price].volume for price in top_levels))
+            assert price_levels.total_volume == pytest.approx(sum(level.volume for level in price_levels.levels.values()))
+            lowest_price = round(60 + rng.integers(-20, 20) * 0.05, 2)
+            assert price_levels.band_volume(lowest_price, lowest_price + 0.5) == pytest.approx(price_levels.volume_between(lowest_price, lowest_price + 0.5))
+
+def test_depth_features_match_levels_recalculated_from_orders(
+    encoded_orders_by_delivery_start
+):
+    for encoded_orders in encoded_orders_by_delivery_start.values():
+        order_book = ob.OrderBook(depth_levels, depth_price_band)
+        recalculated_rows = []
+        for transaction_time in range(len(encoded_orders.transaction_times)):
+            replay.replay_transaction_times(order_book, encoded_orders, transaction_time, transaction_time + 1)
+            recalculated_rows.append(recalculated_depth_row(order_book))
+
+        depth = order_book.depth.to_dataframe()
+        assert list(depth.columns) == list(order_book.depth_columns())
+        np.testing.assert_allclose(depth.to_numpy(), np.array(recalculated_rows), atol=1e-9)
+        assert depth['bid_depth_within_band'].notna().any()
+
+def test_band_depth_does_not_need_recorded_feature_changes(
+    encoded_orders_by_delivery_start
+):
+    for encoded_orders in encoded_orders_by_delivery_start.values():
+        recorded = replay.replay_delivery_period(encoded_orders, depth_levels, depth_price_band)
+        unrecorded = replay.replay_delivery_period(encoded_orders, depth_levels, depth_price_band, record_feature_changes=False)
+        assert len(unrecorded.features) == 0
+        assert unrecorded.feature_updates == recorded.feature_updates > 0
+        pd.testing.assert_frame_equal(unrecorded.depth.to_dataframe(), recorded.depth.to_dataframe())
+
+def test_state_at_matches_a_replay_of_the_events_before(
+    encoded_orders_by_delivery_start
+):
+    checkpointed_order_books = checkpoints.CheckpointedOrderBooks(encoded_orders_by_delivery_start, checkpoint_every_events=200)
+    for delivery_start_time, encoded_orders in encoded_orders_by_delivery_start.items():
+        assert checkpointed_order_books.checkpoints_by_delivery_start[delivery_start_time]
+        transaction_times = encoded_orders.transaction_times
+        timestamps = [transaction_times[0] - 1, transaction_times[-1] + 1]
+        timestamps += [int(transaction_time) for transaction_time in transaction_times[::97]]
+        timestamps += [int(transaction_time) + 1 for transaction_time in transaction_times[50::131]]
+        for timestamp in timestamps:
+            order_book = checkpointed_order_books.state_at(delivery_start_time, pd.Timestamp(timestamp, tz='UTC'))
+            replayed_order_book = ob.OrderBook()
+            replay.replay_transaction_times(replayed_order_book, encoded_orders, 0, int(np.searchsorted(transaction_times, timestamp, side='right')))
+            assert book_state(order_book) == book_state(replayed_order_book)
+            assert order_book.feature_updates == replayed_order_book.feature_updates
+
+def test_compact_replay_matches_object_replay(
+    encoded_orders_by_delivery_start
+):
+    for encoded_orders in encoded_orders_by_delivery_start.values():
+        object_order_book = replay.replay_delivery_period(encoded_orders, depth_levels, depth_price_band)
+        compact_order_book = replay.replay_delivery_period(encoded_orders, depth_levels, depth_price_band, compact_orders=True)
+        pd.testing.assert_frame_equal(compact_order_book.features.to_dataframe(), object_order_book.features.to_dataframe())
+        pd.testing.assert_frame_equal(compact_order_book.depth.to_dataframe(), object_order_book.depth.to_dataframe())
+        assert book_state(compact_order_book) == book_state(object_order_book)
+
+def test_engines_match_the_baseline_reference(
+    synthetic_orders
+):
+    delivery_start, orders_one_delivery_period = next(iter(synthetic_orders.groupby('DeliveryStart', observed=True)))
+    results = dr.compare_engines_one_delivery_period(dr.engines, orders_one_delivery_period, str(delivery_start))
+    assert [result.engine_name for result in results] == list(dr.engines)
+    assert all(result.matches for result in results), [(result.engine_name, result.divergence, result.state_differences) for result in results]